@@ -0,0 +1,136 @@
+"""
+Deployless batch reader of token balances.
+Constructor bytecode is executed with `eth_call` and returns balances instead of runtime code, nothing is deployed.
+"""
+import asyncio
+
+import numpy as np
+
+
+ETH_ADDRESS = "0xEeeeeEeeeEeEeeEeEeEeeEEEeeeeEeeeeeeeEEeE"
+BALANCE_OF = 0x70a08231  # balanceOf(address)
+CALL_GAS = 100_000  # gas limit of each balanceOf, so broken tokens can't drain the call
+
+_OPCODES = {
+    "ADD": 0x01, "MUL": 0x02, "SUB": 0x03, "LT": 0x10, "GT": 0x11, "EQ": 0x14, "ISZERO": 0x15, "AND": 0x16,
+    "SHL": 0x1b, "BALANCE": 0x31, "CODESIZE": 0x38, "CODECOPY": 0x39, "RETURNDATASIZE": 0x3d,
+    "POP": 0x50, "MLOAD": 0x51, "MSTORE": 0x52, "JUMP": 0x56, "JUMPI": 0x57, "JUMPDEST": 0x5b,
+    "RETURN": 0xf3, "STATICCALL": 0xfa,
+    **{f"DUP{i}": 0x7f + i for i in range(1, 17)},
+}
+
+
+def _assemble(program) -> bytes:
+    """
+    Items are opcode names, (value, size) pushes, ":label" definitions and "@label" references (PUSH2).
+    "@end" is the length of the code.
+    """
+    def size(item):
+        if isinstance(item, tuple):
+            return 1 + item[1]
+        if item.startswith(":"):
+            return 1  # JUMPDEST
+        if item.startswith("@"):
+            return 3
+        return 1
+
+    labels, pc = {}, 0
+    for item in program:
+        if isinstance(item, str) and item.startswith(":"):
+            labels[item[1:]] = pc
+        pc += size(item)
+    labels["end"] = pc
+
+    code = b""
+    for item in program:
+        if isinstance(item, tuple):
+            value, n = item
+            code += bytes([0x5f + n]) + value.to_bytes(n, "big")
+        elif item.startswith(":"):
+            code += bytes([_OPCODES["JUMPDEST"]])
+        elif item.startswith("@"):
+            code += bytes([0x61]) + labels[item[1:]].to_bytes(2, "big")
+        else:
+            code += bytes([_OPCODES[item]])
+    return code
+
+
+# Constructor arguments appended to the code: n, (holder, token) * n.
+# Returns uint256[n] balances, 0 for reverting tokens or ones returning less than 32 bytes.
+# Stack is shown after each line.
+_BALANCES_CODE = _assemble([
+    "@end", "CODESIZE", "SUB", "@end", (0, 1), "CODECOPY",  # copy arguments to memory[0:]
+    (0, 1), "MLOAD",  # [n]
+    "DUP1", (64, 1), "MUL", (32, 1), "ADD",  # [n, R], results
+    "DUP2", (32, 1), "MUL", "DUP2", "ADD",  # [n, R, S], balanceOf calldata
+    (BALANCE_OF, 4), (224, 1), "SHL", "DUP2", "MSTORE",
+    (0, 1),  # [n, R, S, i]
+    ":loop",
+    "DUP4", "DUP2", "LT", "ISZERO", "@return", "JUMPI",
+    "DUP1", (64, 1), "MUL", (32, 1), "ADD", "MLOAD",  # [n, R, S, i, holder]
+    "DUP2", (64, 1), "MUL", (64, 1), "ADD", "MLOAD",  # [n, R, S, i, holder, token]
+    "DUP3", (32, 1), "MUL", "DUP6", "ADD",  # [n, R, S, i, holder, token, dst]
+    "DUP2", (int(ETH_ADDRESS, 16), 20), "EQ", "@eth", "JUMPI",
+    "DUP3", "DUP6", (4, 1), "ADD", "MSTORE",  # balanceOf(holder)
+    (32, 1), "DUP2", (36, 1), "DUP8", "DUP6", (CALL_GAS, 3), "STATICCALL",  # [..., dst, success]
+    "RETURNDATASIZE", (32, 1), "GT", "ISZERO", "AND", "@next", "JUMPI",
+    (0, 1), "DUP2", "MSTORE", "@next", "JUMP",  # failed or no return value
+    ":eth",
+    "DUP3", "BALANCE", "DUP2", "MSTORE",
+    ":next",
+    "POP", "POP", "POP", (1, 1), "ADD", "@loop", "JUMP",  # [n, R, S, i + 1]
+    ":return",
+    "DUP4", (32, 1), "MUL", "DUP4", "RETURN",
+])
+
+
+class BalanceReader:
+    """
+    Read `balanceOf` of many (holder, token) pairs in a few `eth_call`s.
+    ETH_ADDRESS is read as native balance.
+
+    Usage:
+        reader = BalanceReader()
+        balances = await reader.read_matrix(web3, [PROXY, FEE_COLLECTOR], coins)  # [holder][token] of 4 uint64 limbs
+        usd = BalanceReader.to_float(balances) / 10 ** decimals * prices
+    """
+
+    def __init__(self, chunk_size=1000):
+        """
+        @param chunk_size Pairs per call, keeps gas under node's eth_call gas cap
+        """
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def calldata(pairs: list[tuple[str, str]]) -> str:
+        args = len(pairs).to_bytes(32, "big") + b"".join(
+            int(holder, 16).to_bytes(32, "big") + int(token, 16).to_bytes(32, "big") for holder, token in pairs
+        )
+        return "0x" + (_BALANCES_CODE + args).hex()
+
+    async def _read_chunk(self, web3, pairs, block_identifier) -> bytes:
+        return bytes(await web3.eth.call({"data": self.calldata(pairs)}, block_identifier))
+
+    async def read_raw(self, web3, pairs: list[tuple[str, str]], block_identifier="latest") -> bytes:
+        """Packed uint256 balances of `pairs`, chunks are requested concurrently"""
+        chunks = await asyncio.gather(*[
+            self._read_chunk(web3, pairs[i: i + self.chunk_size], block_identifier)
+            for i in range(0, len(pairs), self.chunk_size)
+        ])
+        return b"".join(chunks)
+
+    async def read_pairs(self, web3, pairs: list[tuple[str, str]], block_identifier="latest") -> list[int]:
+        """Exact balances of `pairs`"""
+        data = await self.read_raw(web3, pairs, block_identifier)
+        return [int.from_bytes(data[i: i + 32], "big") for i in range(0, len(data), 32)]
+
+    async def read_matrix(self, web3, holders: list[str], tokens: list[str], block_identifier="latest") -> np.ndarray:
+        """
+        @return uint256[holders][tokens] as big-endian uint64 limbs of shape (holders, tokens, 4), a view of response
+        """
+        data = await self.read_raw(web3, [(holder, token) for holder in holders for token in tokens], block_identifier)
+        return np.frombuffer(data, dtype=">u8").reshape(len(holders), len(tokens), 4)
+
+    @staticmethod
+    def to_float(limbs: np.ndarray) -> np.ndarray:
+        return limbs.astype(np.float64) @ np.array([2. ** 192, 2. ** 128, 2. ** 64, 1.])
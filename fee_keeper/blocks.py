@@ -0,0 +1,135 @@
+"""
+Source of new block headers for keeper loops.
+"""
+import asyncio
+import json
+import threading
+import time
+
+import websockets
+
+
+class BlockSource:
+    """
+    Follows chain head in a background thread.
+    Subscribes to `newHeads` over WebSocket if available, otherwise polls `eth_blockNumber`
+    adaptively: sleeps until the next block is expected and polls more often while it is late.
+    RPC errors and dropped subscriptions are logged and retried with backoff, polling until resubscribed,
+    so the thread outlives node hiccups. Exceptions of callbacks are logged and do not stop it.
+
+    Usage:
+        block_source = BlockSource(web3, block_time=12, ws_uri="ws://localhost:8546")
+        block_source.on_head(lambda header: print(header["number"]))
+        header = block_source.wait_for_new_head(after=header["number"])
+    """
+
+    def __init__(self, web3, block_time, ws_uri=None, min_poll_interval=0.1, resubscribe_after=60):
+        """
+        @param web3 HTTP provider, used for polling and initial header
+        @param block_time Expected seconds between blocks
+        @param ws_uri WebSocket endpoint, polling only if not set
+        @param min_poll_interval Seconds between polls when block is expected
+        @param resubscribe_after Seconds to poll after subscription dropped before resubscribing
+        """
+        self.web3 = web3
+        self.block_time = block_time
+        self.ws_uri = ws_uri
+        self.min_poll_interval = min_poll_interval
+        self.resubscribe_after = resubscribe_after
+        self.head = None
+        self._callbacks = []
+        self._new_head = threading.Condition()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def on_head(self, callback):
+        """Call `callback(header)` on every new head"""
+        self._callbacks.append(callback)
+
+    def _set_head(self, header):
+        with self._new_head:
+            if self.head is not None and header["number"] <= self.head["number"]:
+                return
+            self.head = header
+            self._new_head.notify_all()
+        for callback in self._callbacks:
+            try:
+                callback(header)
+            except Exception as e:
+                print(f"Head callback failed at block {header['number']}", repr(e))
+
+    @staticmethod
+    def _parse_header(header):
+        def to_int(value):
+            return int(value, 16) if isinstance(value, str) else value
+        return {
+            "number": to_int(header["number"]),
+            "timestamp": to_int(header["timestamp"]),
+            "baseFeePerGas": to_int(header.get("baseFeePerGas", 0)),
+            "gasLimit": to_int(header.get("gasLimit", 0)),
+            "hash": header["hash"].hex() if hasattr(header["hash"], "hex") else header["hash"],
+        }
+
+    def _run(self):
+        retry = self.min_poll_interval
+        while self.head is None:
+            try:
+                self._set_head(self._parse_header(self.web3.eth.get_block("latest")))
+            except Exception as e:
+                print("Could not fetch head", repr(e))
+                time.sleep(retry)
+                retry = min(2 * retry, self.block_time)
+        if not self.ws_uri:
+            self._poll()
+        while True:
+            try:
+                asyncio.run(self._subscribe())
+                print("newHeads subscription closed, polling meanwhile")
+            except Exception as e:
+                print("newHeads subscription failed, polling meanwhile", repr(e))
+            self._poll(until=time.time() + self.resubscribe_after)
+
+    async def _subscribe(self):
+        async with websockets.connect(self.ws_uri) as ws:
+            await ws.send(json.dumps({"jsonrpc": "2.0", "id": 1, "method": "eth_subscribe", "params": ["newHeads"]}))
+            response = json.loads(await ws.recv())
+            if "error" in response:
+                raise ValueError(response["error"])
+            async for message in ws:
+                self._set_head(self._parse_header(json.loads(message)["params"]["result"]))
+
+    def _poll(self, until=None):
+        """Poll till `until` timestamp, forever if not set"""
+        interval = self.min_poll_interval
+        while until is None or time.time() < until:
+            try:
+                number = self.web3.eth.block_number
+                if number > self.head["number"]:
+                    self._set_head(self._parse_header(self.web3.eth.get_block(number)))
+                    interval = self.min_poll_interval
+                    # Sleep until the next block is expected
+                    time.sleep(max(self.head["timestamp"] + self.block_time - time.time(), interval))
+                    continue
+            except Exception as e:
+                print("Polling head failed", repr(e))
+            time.sleep(interval)
+            interval = min(2 * interval, self.block_time / 4)  # late block or RPC error, back off
+
+    def wait_for_new_head(self, after=None, timeout=None):
+        """
+        @param after Block number to wait to be surpassed, current head if not set
+        @param timeout Maximum seconds to wait
+        @return Header of the new head or None on timeout
+        """
+        with self._new_head:
+            if after is None:
+                after = self.head["number"] if self.head else -1
+            if self._new_head.wait_for(lambda: self.head is not None and self.head["number"] > after, timeout):
+                return self.head
+        return None
+
+    def latest(self):
+        """Current head, waiting for the first one"""
+        return self.head or self.wait_for_new_head()
+
+    async def async_wait_for_new_head(self, after=None, timeout=None):
+        return await asyncio.to_thread(self.wait_for_new_head, after, timeout)
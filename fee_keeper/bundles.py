@@ -0,0 +1,164 @@
+"""
+Bundle submission to block builders.
+"""
+import asyncio
+import threading
+import time
+
+import aiohttp
+
+
+class BundleSubmitter:
+    """
+    Post bundles to all builders concurrently over keep-alive connections.
+    Runs its own event loop in a background thread, so it can be used from sync code.
+
+    Usage:
+        submitter = BundleSubmitter(BUILDERS)
+        submitter.submit(signed_txs, block)
+        print(submitter.stats())
+    """
+
+    def __init__(self, builders, timeout=3., connections_per_builder=4):
+        """
+        @param builders Builder RPC endpoints
+        @param timeout Seconds to wait for each builder
+        @param connections_per_builder Size of keep-alive connection pool of each builder
+        """
+        self.builders = builders
+        self.timeout = timeout
+        self.connections_per_builder = connections_per_builder
+        self.latencies = {builder: [] for builder in builders}
+        self._sessions = {}
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+
+    def _session(self, builder):
+        if builder not in self._sessions:
+            self._sessions[builder] = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connections_per_builder, keepalive_timeout=120),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._sessions[builder]
+
+    @staticmethod
+    def payloads(raw_txs, block, max_block=None):
+        """
+        Flashbots (mev-share) payload covering [block, max_block] and common `eth_sendBundle` payload per block
+        @return {"flashbots": payload, "default": [payload for each block]}
+        """
+        max_block = max_block or block
+        return {
+            "flashbots": {
+                "jsonrpc": "2.0",
+                "id": 1,
+                "method": "eth_sendBundle",
+                "params": [
+                    {
+                        "version": "v0.1",
+                        "inclusion": {"block": hex(block), "maxBlock": hex(max_block)},
+                        "body": [{"tx": tx, "canRevert": True} for tx in raw_txs],
+                    }
+                ]
+            },
+            "default": [
+                {
+                    "jsonrpc": "2.0",
+                    "id": 1,
+                    "method": "eth_sendBundle",
+                    "params": [
+                        {
+                            "txs": raw_txs,
+                            "blockNumber": hex(target_block),
+                        }
+                    ]
+                } for target_block in range(block, max_block + 1)
+            ],
+        }
+
+    async def _post(self, builder, payload):
+        start = time.perf_counter()
+        try:
+            async with self._session(builder).post(builder, json=payload) as r:
+                response = await r.json(content_type=None)
+        except Exception as e:
+            response = repr(e)
+        latency = time.perf_counter() - start
+        self.latencies[builder].append(latency)
+        return response, latency
+
+    async def _submit(self, payloads):
+        posts = []
+        for builder in self.builders:
+            if "flashbots" in builder:
+                posts.append((builder, payloads["flashbots"]))
+            else:
+                posts.extend((builder, payload) for payload in payloads["default"])
+        results = await asyncio.gather(*[self._post(builder, payload) for builder, payload in posts])
+        return [(builder, response, latency) for (builder, _), (response, latency) in zip(posts, results)]
+
+    async def _connect(self):
+        payload = {"jsonrpc": "2.0", "id": 1, "method": "net_version", "params": []}
+
+        async def ping(builder):
+            try:
+                async with self._session(builder).post(builder, json=payload) as r:
+                    await r.read()
+            except Exception as e:
+                print(f"Could not connect to {builder}: {repr(e)}")
+        await asyncio.gather(*[ping(builder) for builder in self.builders])
+
+    def connect(self):
+        """Open keep-alive connections (TCP and TLS handshakes) to all builders ahead of the first submission"""
+        self._run(self._connect())
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def submit(self, signed_txs, block, max_block=None, verbose=True):
+        """
+        @param signed_txs Signed transactions of the bundle
+        @param block First target block number
+        @param max_block Last target block number, only `block` by default
+        @return [(builder, response, latency)]
+        """
+        raw_txs = [tx.rawTransaction.hex() for tx in signed_txs]
+        results = self._run(self._submit(self.payloads(raw_txs, block, max_block)))
+        if verbose:
+            for builder, response, latency in results:
+                print(builder, f"{latency * 1000:.0f}ms", response)
+        return results
+
+    def submit_until_included(self, web3, signed_txs, wallet_address, nonce, n_blocks=3, max_blocks=10,
+                              poll_interval=0.5, block_source=None, first_block=None):
+        """
+        Keep bundle submitted for the next `n_blocks` blocks, waking up on each new block
+        until wallet nonce reaches `nonce` or `max_blocks` blocks passed.
+        @param nonce Wallet nonce after the bundle is included
+        @param block_source BlockSource to wake up on new heads, polls `block_number` if not set
+        @param first_block Earliest block to target, the next one by default
+        @return True if included
+        """
+        head = block_source.latest()["number"] if block_source else web3.eth.block_number
+        covered = max(head, first_block - 1) if first_block else head  # last block bundle was submitted for
+        last_block = covered + max_blocks
+        while web3.eth.get_transaction_count(wallet_address) < nonce:
+            if head >= last_block:
+                return False
+            if covered < min(head + n_blocks, last_block):
+                print(f"Trying blocks: [{max(covered, head) + 1}, {min(head + n_blocks, last_block)}]")
+                self.submit(signed_txs, max(covered, head) + 1, min(head + n_blocks, last_block))
+                covered = min(head + n_blocks, last_block)
+            if block_source:
+                head = block_source.wait_for_new_head(after=head)["number"]
+                continue
+            while (new_head := web3.eth.block_number) == head:
+                time.sleep(poll_interval)
+            head = new_head
+        return True
+
+    def stats(self):
+        return ", ".join(
+            f"{builder}: {sum(latencies) / len(latencies) * 1000:.0f}ms avg" for builder, latencies in self.latencies.items()
+            if latencies
+        )
@@ -0,0 +1,22 @@
+"""
+Curve API helpers for keeper scripts, see draft/pool_data.py for the loader.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from draft.pool_data import CURVE_API, MAX_WORKERS, get_pool_data
+
+
+def fetch_pool_data(chain, registries, force=False):
+    urls = [f"{CURVE_API}/getPools/{chain}/{registry}" for registry in registries]
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        responses = list(executor.map(lambda url: get_pool_data(url, force), urls))
+    return [pool_dict for response in responses for pool_dict in response]
+
+
+def coin_usd_price(chain, coin):
+    """USD price of `coin` from the first pool listing it"""
+    for pool_dict in get_pool_data(f"{CURVE_API}/getPools/all/{chain}/"):
+        for coin_dict in pool_dict["coins"]:
+            if coin_dict["address"].lower() == coin.lower() and coin_dict.get("usdPrice"):
+                return float(coin_dict["usdPrice"])
+    raise ValueError(f"No price of {coin} on {chain}")
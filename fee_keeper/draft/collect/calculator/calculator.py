@@ -1,4 +1,9 @@
-from utils import Registrar, prune_config
+import heapq
+
+import numpy as np
+
+from data.fee_collector import FeeCollectorMirror
+from utils import EPOCH, Registrar, prune_config
 from collect.calculator.price_source import PriceSource
 from collect.calculator.fee_applier import FeeApplier
 
@@ -9,6 +14,48 @@ class Calculator(Registrar):
     def __init__(self, config):
         self.price_source = PriceSource.get_from_config(config)(config)
         self.fee_applier = FeeApplier.get_from_config(config)(config)
+        self.config = config
+        self._fee_collector = None
+        self.last_tallies = {}
+
+    @property
+    def fee_collector(self) -> FeeCollectorMirror:
+        """Mirror is built on first tally, so configs that never tally don't connect to web3"""
+        if self._fee_collector is None:
+            self._fee_collector = FeeCollectorMirror.from_config(self.config)
+        return self._fee_collector
+
+    def tally(self, fee_sources: set[FeeSource]) -> dict[FeeSource, dict]:
+        """
+        Tally all sources at once, grouped by implementation so each can batch its requests.
+        Coins killed in FeeCollector for COLLECT are dropped before any estimation,
+        sources left without alive coins are skipped.
+        """
+        if not fee_sources:
+            self.last_tallies = {}
+            return {}
+        self.fee_collector.sync()
+        alive = set(self.fee_collector.filter_alive(
+            set(coin for source in fee_sources for coin in source.coins), 1 << EPOCH.COLLECT.value,
+        ))
+        by_type = {}
+        for source in fee_sources:
+            if any(coin in alive for coin in source.coins):
+                by_type.setdefault(type(source), []).append(source)
+        tallies = {}
+        for source_type, sources in by_type.items():
+            for source, gain in source_type.tally_many(sources).items():
+                tallies[source] = {coin: amount for coin, amount in gain.items() if coin in alive}
+        self.last_tallies = tallies
+        return tallies
+
+    def value(self, gain: dict) -> float:
+        """USD keeper fee of a tallied gain"""
+        mass = 0
+        for coin, amount in gain.items():
+            profit = self.fee_applier.get_profit(coin, amount)
+            mass += self.price_source.get_amount(coin, profit)
+        return mass
 
     def calculate(self, fee_sources: set[FeeSource]) -> (list, list):
         return []
@@ -23,14 +70,163 @@ class ThresholdCalculator(Calculator):
 
     def calculate(self, fee_sources: set[FeeSource]) -> (list, list):
         to_execute = []
-        for source in fee_sources:
-            gain = source.tally()
-            mass = 0
-            for coin, amount in gain.items():
-                profit = self.fee_applier.get_profit(coin, amount)
-                mass += self.price_source.get_amount(coin, profit)
+        for source, gain in self.tally(fee_sources).items():
+            mass = self.value(gain)
             if mass >= self.threshold:
                 to_execute.append(source)
             if len(to_execute) >= self.max_n_sources:
                 break
         return to_execute, [source.get_call() for source in to_execute]
+
+
+class KnapsackCalculator(Calculator):
+    """
+    Maximize keeper fee minus gas spent under a gas budget.
+    Sources share costs: coins are collected once (`FeeCollector.collect` takes up to 64 coins per call)
+    and stable pools are withdrawn through proxy in batches of 20 addresses.
+    Greedy by profit per gas with batch overheads amortized per slot,
+    sources are re-ranked when their coins get collected by already taken ones.
+    """
+    _COLLECT_MAX_LEN = 64  # FeeCollector.MAX_LEN
+    _PROXY_BATCH = 20  # proxy.withdraw_many(address[20])
+
+    _SOURCE_GAS = {  # default gas of source call by type
+        "STABLE_POOL": 120_000,
+        "CRYPTO_POOL": 180_000,
+        "STABLECOIN_CONTROLLER": 150_000,
+        "PEG_KEEPER": 120_000,
+    }
+    _PROXY_SLOT_GAS = 2_500  # withdraw_many iteration, also paid for ZERO_ADDRESS padding
+    _PROXY_BATCH_GAS = 50_000  # withdraw_many tx overhead
+    _COLLECT_COIN_GAS = 45_000  # coin transfer in collect
+    _COLLECT_GAS = 60_000  # collect tx overhead
+
+    def __init__(self, config):
+        super().__init__(config)
+        config = prune_config(config, self.__class__)
+        self.gas_budget = config["gas_budget"]
+        self.gas_price = config["gas_price"] * 10 ** 9  # gwei
+        self.native_price = config["native_price"]  # USD
+        self.source_gas = {**self._SOURCE_GAS, **config.get("source_gas", {})}
+        self.source_gas_estimates = {address.lower(): gas for address, gas in config.get("source_gas_estimates", {}).items()}
+
+    def gas_cost(self, gas: int) -> float:
+        """Gas in USD"""
+        return gas * self.gas_price * self.native_price / 10 ** 18
+
+    def estimate_gas(self, source: FeeSource) -> int:
+        """Gas of source own call, per-address estimate if known"""
+        return self.source_gas_estimates.get(source.address.lower(), self.source_gas[source.source_type.name])
+
+    def _via_proxy(self, source: FeeSource) -> bool:
+        return source.source_type == FeeSource._SourceType.STABLE_POOL
+
+    def _marginal_gas(self, source: FeeSource, coins: set) -> float:
+        gas = self.estimate_gas(source)
+        if self._via_proxy(source):
+            gas += self._PROXY_SLOT_GAS + self._PROXY_BATCH_GAS / self._PROXY_BATCH
+        new_coins = len(set(coin.lower() for coin in source.coins) - coins)
+        return gas + new_coins * (self._COLLECT_COIN_GAS + self._COLLECT_GAS / self._COLLECT_MAX_LEN)
+
+    def _exact_gas(self, source_gas: int, n_proxy: int, n_coins: int) -> int:
+        proxy_batches = -(-n_proxy // self._PROXY_BATCH)
+        collects = -(-n_coins // self._COLLECT_MAX_LEN)
+        return source_gas + proxy_batches * (self._PROXY_BATCH * self._PROXY_SLOT_GAS + self._PROXY_BATCH_GAS) + \
+            n_coins * self._COLLECT_COIN_GAS + collects * self._COLLECT_GAS
+
+    def calculate(self, fee_sources: set[FeeSource]) -> (list, list):
+        values = {source: self.value(gain) for source, gain in self.tally(fee_sources).items()}
+        sources = [source for source, value in values.items() if value > 0]
+        by_coin = {}
+        for i, source in enumerate(sources):
+            for coin in source.coins:
+                by_coin.setdefault(coin.lower(), []).append(i)
+
+        # Max heap of profit per gas, outdated entries are skipped
+        coins = set()
+        keys = [None] * len(sources)
+        heap = []
+
+        def push(i):
+            gas = self._marginal_gas(sources[i], coins)
+            profit = values[sources[i]] - self.gas_cost(gas)
+            keys[i] = -profit / gas if profit > 0 else None
+            if keys[i] is not None:
+                heapq.heappush(heap, (keys[i], i))
+
+        for i in range(len(sources)):
+            push(i)
+
+        to_execute, taken = [], [False] * len(sources)
+        source_gas, n_proxy = 0, 0
+        while heap:
+            key, i = heapq.heappop(heap)
+            if taken[i] or key != keys[i]:
+                continue
+            source = sources[i]
+            new_coins = set(coin.lower() for coin in source.coins) - coins
+            via_proxy = self._via_proxy(source)
+            gas = self._exact_gas(source_gas + self.estimate_gas(source), n_proxy + via_proxy, len(coins) + len(new_coins))
+            if gas > self.gas_budget:
+                keys[i] = None
+                continue
+            taken[i] = True
+            to_execute.append(source)
+            source_gas += self.estimate_gas(source)
+            n_proxy += via_proxy
+            coins.update(new_coins)
+            # Sources sharing newly collected coins got cheaper
+            for coin in new_coins:
+                for j in by_coin[coin]:
+                    if not taken[j]:
+                        push(j)
+        return to_execute, [source.get_call() for source in to_execute]
+
+
+class VectorizedCalculator(Calculator):
+    """
+    Same selection as ThresholdCalculator computed over aligned arrays of all (source, coin) amounts.
+    Price source and fee applier are linear in amount, so they are queried once per coin instead of per amount.
+    Takes top `max_n_sources` sources by mass above threshold.
+    """
+    _ONE = 10 ** 18
+
+    def __init__(self, config):
+        super().__init__(config)
+        config = prune_config(config, self.__class__)
+        self.threshold = config["threshold"]  # USD
+        self.max_n_sources = config["max_n_sources"]
+
+    def _coin_values(self, coins: list[str]) -> np.ndarray:
+        """USD value of fee from one unit of raw amount of each coin"""
+        return np.array([
+            self.price_source.get_amount(coin, self._ONE) / self._ONE * self.fee_applier.get_profit(coin)
+            for coin in coins
+        ], dtype=np.float64)
+
+    def masses(self, fee_sources: set[FeeSource]) -> (list[FeeSource], np.ndarray):
+        """Fee-applied USD mass of every source"""
+        tallies = self.tally(fee_sources)
+        sources = list(tallies.keys())
+        coin_index = {}
+        source_idx, coin_idx, amounts = [], [], []
+        for i, gain in enumerate(tallies.values()):
+            for coin, amount in gain.items():
+                source_idx.append(i)
+                coin_idx.append(coin_index.setdefault(coin.lower(), len(coin_index)))
+                amounts.append(amount)
+        values = self._coin_values(list(coin_index.keys()))
+        weights = np.asarray(amounts, dtype=np.float64) * values[np.asarray(coin_idx, dtype=np.int64)]
+        return sources, np.bincount(np.asarray(source_idx, dtype=np.int64), weights=weights, minlength=len(sources))
+
+    def select(self, masses: np.ndarray) -> np.ndarray:
+        """Indices of top `max_n_sources` masses above threshold, descending"""
+        candidates = np.flatnonzero(masses >= self.threshold)
+        if len(candidates) > self.max_n_sources:
+            candidates = candidates[np.argpartition(-masses[candidates], self.max_n_sources - 1)[:self.max_n_sources]]
+        return candidates[np.argsort(-masses[candidates], kind="stable")]
+
+    def calculate(self, fee_sources: set[FeeSource]) -> (list, list):
+        sources, masses = self.masses(fee_sources)
+        to_execute = [sources[i] for i in self.select(masses)]
+        return to_execute, [source.get_call() for source in to_execute]
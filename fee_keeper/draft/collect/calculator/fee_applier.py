@@ -1,6 +1,7 @@
 import typing as tp
 from abc import abstractmethod
 
+from data.fee_collector import FeeCollectorMirror
 from utils import Registrar, EPOCH
 
 
@@ -15,20 +16,17 @@ class FeeApplier(Registrar):
 
 class OfflineFeeApplier(FeeApplier):
     """
-    Reproduce `FeeCollector.fee()`
+    Reproduce `FeeCollector.fee()` with `max_fee` from the FeeCollector mirror, synced on first use if not mirrored yet
     """
-    # TODO fetch updates of max_fee
-    _COLLECT_MAX_FEE: int = 2 * 10 ** (18 - 2)  # 2%
-    _FORWARD_MAX_FEE: int = 1 * 10 ** (18 - 2)  # 1%
+    def __init__(self, config: dict):
+        super().__init__(config)
+        self.fee_collector = FeeCollectorMirror.from_config(config)
 
     def get_profit(self, coin: str, amount: int = None) -> tp.Union[float, int]:
-        match EPOCH.get_current():
-            case EPOCH.COLLECT:
-                max_fee = self._COLLECT_MAX_FEE
-            case EPOCH.FORWARD:
-                max_fee = self._FORWARD_MAX_FEE
-            case _:
-                max_fee = 0
+        if self.fee_collector.block is None:
+            self.fee_collector.sync()
+        epoch = EPOCH.get_current()
+        max_fee = self.fee_collector.max_fee.get(1 << epoch.value, 0) if epoch in (EPOCH.COLLECT, EPOCH.FORWARD) else 0
 
         time_elapsed: int = EPOCH.get_epoch_time_elapsed()  # Might be less than actual block time execution
         return int(amount * time_elapsed * max_fee // 10 ** 18 // (24 * 3600)) if amount is not None\
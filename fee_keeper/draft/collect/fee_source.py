@@ -2,6 +2,8 @@ import typing as tp
 from abc import abstractmethod
 from enum import Enum
 
+from web3 import Web3
+
 from data.brownie import BrownieData
 from data.web3py import Web3PyData
 from utils import Registrar
@@ -27,6 +29,8 @@ class FeeSource(Registrar):
             {"stateMutability": "view", "type": "function", "name": "claim_admin_fees", "inputs": [], "outputs": []},
         ],
         _SourceType.STABLECOIN_CONTROLLER: [
+            {"stateMutability": "view", "type": "function", "name": "admin_fees", "inputs": [],
+             "outputs": [{"name": "", "type": "uint256"}]},
             {"stateMutability": "nonpayable", "type": "function", "name": "collect_fees", "inputs": [],
              "outputs": [{"name": "", "type": "uint256"}]},
         ],
@@ -63,6 +67,11 @@ class FeeSource(Registrar):
         # Can be cached for some time
         return {}
 
+    @classmethod
+    def tally_many(cls, sources: tp.Iterable["FeeSource"]) -> dict["FeeSource", dict]:
+        """Tally several sources of this type at once, implementations may batch requests"""
+        return {source: source.tally() for source in sources}
+
     @abstractmethod
     def get_call(self) -> list[tuple]:
         return [
@@ -77,9 +86,48 @@ class FeeSource(Registrar):
 
 
 class FeeSourceWeb3Py(FeeSource, Web3PyData):
+    _MULTICALL_CHUNK = 500  # calls per aggregate3, keep eth_call gas under node limits
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.contract = self.web3.eth.contract(self.address, abi=self._ABI[self.source_type])
+        self._import_web3(kwargs["config"])
+        self.contract = self.web3.eth.contract(Web3.to_checksum_address(self.address), abi=self._ABI[self.source_type])
+
+    def _tally_calls(self) -> list[tuple[str, str]]:
+        """(coin, calldata) pairs reading accrued amounts, same as `tally()`"""
+        if self.source_type == self._SourceType.STABLE_POOL:
+            return [(coin, self.contract.encodeABI("admin_balances", [i])) for i, coin in enumerate(self.coins)]
+        elif self.source_type == self._SourceType.CRYPTO_POOL:
+            return []  # TODO how to count crypto pool profit?
+        elif self.source_type == self._SourceType.STABLECOIN_CONTROLLER:
+            return [(coin, self.contract.encodeABI("admin_fees")) for coin in self.coins]
+        elif self.source_type == self._SourceType.PEG_KEEPER:
+            return [(coin, self.contract.encodeABI("calc_profit")) for coin in self.coins]
+        else:
+            raise ValueError(f"Type {self.source_type} is not supported")
+
+    @classmethod
+    def tally_many(cls, sources: tp.Iterable[FeeSource], block_identifier: tp.Optional[int] = None) ->\
+            dict[FeeSource, dict]:
+        """
+        Tally all sources through Multicall3 `aggregate3` pinned to one block.
+        Failed calls are omitted from the result.
+        """
+        sources = list(sources)
+        if block_identifier is None:
+            block_identifier = cls.web3.eth.block_number
+
+        calls = [(source, coin, calldata) for source in sources for coin, calldata in source._tally_calls()]
+        tallies = {source: {} for source in sources}
+        for i in range(0, len(calls), cls._MULTICALL_CHUNK):
+            chunk = calls[i: i + cls._MULTICALL_CHUNK]
+            results = cls.multicall.functions.aggregate3(
+                [(source.contract.address, True, calldata) for source, _, calldata in chunk]
+            ).call(block_identifier=block_identifier)
+            for (source, coin, _), (success, data) in zip(chunk, results):
+                if success and len(data) >= 32:
+                    tallies[source][coin] = int.from_bytes(data[:32], "big")
+        return tallies
 
     def tally(self) -> dict:
         if self.source_type == self._SourceType.STABLE_POOL:
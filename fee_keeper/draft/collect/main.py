@@ -1,20 +1,24 @@
 from collect.calculator.calculator import Calculator
+from collect.poll_scheduler import PollScheduler
 from tx_sender import TxSender
 from collect.source_fetcher import SourceFetcher
-from utils import load_config_from_file
+from utils import Cached, CacheStore, load_config_from_file
 
 
 def collect():
     config = load_config_from_file()
+    Cached.set_cache_store(CacheStore.get_from_config(config)(config))
 
     source_fetcher = SourceFetcher.get_from_config(config)(config)
     fee_sources = source_fetcher.sources
     # fee_sources = source_fetcher.fetch()
+    poll_scheduler = PollScheduler.get_from_config(config)(config)
     calculator = Calculator.get_from_config(config)(config)
     tx_sender = TxSender.get_from_config(config)(config)
     while True:
-        # tally = {source: source.tally() for source in fee_sources}  # How to multicall?
-        sources, txs = calculator.calculate(fee_sources)
+        due = poll_scheduler.due(fee_sources)
+        sources, txs = calculator.calculate(due)
+        poll_scheduler.observe({source: calculator.value(gain) for source, gain in calculator.last_tallies.items()})
 
         # Combine calls
         proxy_withdraw = [[]]
@@ -0,0 +1,129 @@
+import heapq
+import math
+import typing as tp
+
+from data.web3py import Web3PyData
+from utils import Cached, Registrar, prune_config
+from collect.fee_source import FeeSource
+
+
+class PollScheduler(Registrar, Cached):
+    """Chooses sources to tally at a block, between SourceFetcher and Calculator"""
+    def __init__(self, config: dict):
+        self.chain = config["chain"]
+
+    def due(self, fee_sources: set[FeeSource], block: tp.Optional[int] = None) -> set[FeeSource]:
+        return fee_sources
+
+    def observe(self, values: dict[FeeSource, float], block: tp.Optional[int] = None):
+        """
+        @param values USD value of fee of sources returned by `due` that got tallied
+        """
+        pass
+
+
+class EveryBlockPollScheduler(PollScheduler):
+    """Tally every source every time"""
+
+
+class AdaptivePollScheduler(PollScheduler, Web3PyData):
+    """
+    Accrual rate (USD per block) of each source is an EWMA of growth between its tallies.
+    Next check is when the source is predicted to reach `threshold` (scaled by `safety` to not be late),
+    so busy pools are checked every block and sources about to cross break-even move up the queue.
+    Sources that did not grow back off exponentially up to `max_interval` blocks.
+    A drop of value means fees were collected, it resets the baseline but keeps the rate.
+    Due sources that were not tallied keep their baseline and back off the same way.
+    Sources never seen are due at once.
+    State is saved every `save_interval` blocks, sources are only polled earlier after a restart.
+    """
+    def __init__(self, config: dict):
+        super().__init__(config)
+        config = prune_config(config, self.__class__)
+        self._import_web3(config)
+        self.threshold = config["threshold"]  # USD
+        self.max_interval = config.get("max_interval", 300)  # blocks
+        self.alpha = config.get("alpha", 0.3)  # EWMA weight of the latest growth
+        self.safety = config.get("safety", 0.5)  # share of predicted time to wait
+        self.save_interval = config.get("save_interval", 100)  # blocks
+        self.state = {}  # key: {"block", "value", "rate", "backoff", "next"}
+        self.queue = []  # (next block, key), outdated entries are skipped
+        self._block = None
+        self._due = set()  # keys returned by the last `due`
+        self._saved_block = None
+        self.load_cache()
+
+    @staticmethod
+    def _key(source: FeeSource) -> str:
+        return f"{source.source_type.name}:{source.address.lower()}"
+
+    def __getstate__(self) -> dict:
+        return {self.chain.name: self.state}
+
+    def __setstate__(self, state):
+        self.state = state.get(self.chain.name, {})
+        self.queue = [(entry["next"], key) for key, entry in self.state.items()]
+        heapq.heapify(self.queue)
+
+    def due(self, fee_sources: set[FeeSource], block: tp.Optional[int] = None) -> set[FeeSource]:
+        self._block = self.web3.eth.block_number if block is None else block
+        by_key = {self._key(source): source for source in fee_sources}
+        due = {source for key, source in by_key.items() if key not in self.state}
+        while self.queue and self.queue[0][0] <= self._block:
+            next_block, key = heapq.heappop(self.queue)
+            entry = self.state.get(key)
+            if entry is None or entry["next"] != next_block:
+                continue
+            if key in by_key:
+                due.add(by_key[key])
+            else:  # no longer fetched
+                del self.state[key]
+        self._due = {self._key(source) for source in due}
+        return due
+
+    def _interval(self, entry: dict, grew: bool) -> int:
+        if entry["value"] >= self.threshold:
+            return 1
+        entry["backoff"] = 1 if grew else min(entry["backoff"] * 2, self.max_interval)
+        interval = entry["backoff"]
+        if entry["rate"] > 0:
+            predicted = math.ceil(self.safety * (self.threshold - entry["value"]) / entry["rate"])
+            interval = predicted if grew else min(predicted, interval)
+        return min(max(interval, 1), self.max_interval)
+
+    def observe(self, values: dict[FeeSource, float], block: tp.Optional[int] = None):
+        """
+        @param values USD value of fee of sources returned by `due` that got tallied,
+            other due sources are not a drop of value and are retried after backoff
+        """
+        if block is None:
+            block = self._block if self._block is not None else self.web3.eth.block_number
+        observed = set()
+        for source, value in values.items():
+            key = self._key(source)
+            observed.add(key)
+            entry = self.state.get(key)
+            grew = False
+            if entry is None:
+                entry = {"block": block, "value": value, "rate": 0., "backoff": 1}
+            elif block > entry["block"]:
+                growth = value - entry["value"]
+                if growth >= 0:
+                    entry["rate"] = self.alpha * growth / (block - entry["block"]) + (1 - self.alpha) * entry["rate"]
+                    grew = growth > 0
+                entry["block"], entry["value"] = block, value
+            entry["next"] = block + self._interval(entry, grew)
+            self.state[key] = entry
+            heapq.heappush(self.queue, (entry["next"], key))
+        for key in self._due - observed:
+            entry = self.state.get(key)
+            if entry is None:  # never seen, stays due
+                continue
+            entry["backoff"] = min(entry["backoff"] * 2, self.max_interval)
+            entry["next"] = block + entry["backoff"]
+            heapq.heappush(self.queue, (entry["next"], key))
+        self._due = set()
+
+        if self._saved_block is None or block - self._saved_block >= self.save_interval:
+            self.save_cache()
+            self._saved_block = block
@@ -75,7 +75,7 @@ class CurveAPISourceFetcher(SourceFetcher, CurveAPIData):
                 coins=[coin_data["address"] for coin_data in pool_dict["coins"]],
                 config=self.config,
             ))
-            self.save_cache()
+        self.save_cache()
         print(f"Loaded {len(self.sources) - initial_len} new sources")
 
     def fetch(self, force=False) -> set[FeeSource]:
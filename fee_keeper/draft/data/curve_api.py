@@ -1,5 +1,7 @@
-import requests
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+from pool_data import get_pool_data
 from utils import Chain
 
 
@@ -48,18 +50,32 @@ class CurveAPIData:
         }
     }
 
-    def iterate_over_all_pool_data(self, chain: Chain) -> list:
+    _MAX_WORKERS = 8
+    _REFRESH_CYCLE = 60  # sec, fetchers share loaded registries within one cycle
+
+    _cycles = {}  # chain: (ts, pool_datas)
+
+    def iterate_over_all_pool_data(self, chain: Chain, force: bool = False) -> list:
+        ts, pool_datas = self._cycles.get(chain, (0, None))
+        if not force and pool_datas is not None and time.time() < ts + self._REFRESH_CYCLE:
+            return pool_datas
+
         api_network_name = self._CURVE_API['network_name'][chain]
+        chunks = [(type_name, chunk) for type_name, type_chunks in self._CURVE_API["types"].items()
+                  for chunk in type_chunks]
+        with ThreadPoolExecutor(max_workers=self._MAX_WORKERS) as executor:
+            responses = executor.map(
+                lambda url: get_pool_data(url, force),
+                [f"{self._CURVE_API['endpoint']}/getPools/{api_network_name}/{chunk}" for _, chunk in chunks],
+            )
+
         pool_datas = []
-        for type_name, chunks in self._CURVE_API["types"].items():
-            for chunk in chunks:
-                response = requests.get(
-                    f"{self._CURVE_API['endpoint']}/getPools/{api_network_name}/{chunk}",
-                ).json()["data"]["poolData"]
-                for pool_dict in response:
-                    if pool_dict["address"] in self._REGISTRY_ERRORS["copy"].get(api_network_name, {}).get(type_name, []):
-                        continue
-                    update = self._REGISTRY_ERRORS["update"].get(api_network_name, {}).get(pool_dict["address"], {})
-                    pool_dict.update(update)
-                    pool_datas.append((update.get("type", type_name), pool_dict))
+        for (type_name, _), response in zip(chunks, responses):
+            for pool_dict in response:
+                if pool_dict["address"] in self._REGISTRY_ERRORS["copy"].get(api_network_name, {}).get(type_name, []):
+                    continue
+                update = self._REGISTRY_ERRORS["update"].get(api_network_name, {}).get(pool_dict["address"], {})
+                pool_dict = pool_dict | update  # copy, loaded responses are shared
+                pool_datas.append((update.get("type", type_name), pool_dict))
+        self._cycles[chain] = (time.time(), pool_datas)
         return pool_datas
@@ -0,0 +1,178 @@
+import typing as tp
+
+from web3 import Web3
+
+from data.web3py import Web3PyData
+from utils import Cached, Chain
+
+
+class FeeCollectorMirror(Cached, Web3PyData):
+    """
+    Local copy of FeeCollector configuration: target, max_fee, burner, hooker and is_killed.
+    Bootstrapped with one multicall and kept up to date from Set* logs.
+    `is_killed` holds every coin looked up so far, unknown coins are read in one multicall at the mirrored block.
+
+    Epochs are FeeCollector bit flags (SLEEP=1, COLLECT=2, EXCHANGE=4, FORWARD=8), `1 << EPOCH.value` of utils.EPOCH.
+    """
+    _ADDRESS = {
+        Chain.Ethereum: "0xa2Bcd1a4Efbd04B63cd03f5aFf2561106ebCCE00",
+        Chain.Gnosis: "0xBb7404F9965487a9DdE721B3A5F0F3CcfA9aa4C5",
+    }
+    ALL_COINS = "0x0000000000000000000000000000000000000000"
+    _EPOCHS = [1, 2, 4, 8]
+    _LOGS_RANGE = 10_000  # blocks per eth_getLogs
+
+    _ABI = [
+        {"stateMutability": "view", "type": "function", "name": "target", "inputs": [],
+         "outputs": [{"name": "", "type": "address"}]},
+        {"stateMutability": "view", "type": "function", "name": "max_fee",
+         "inputs": [{"name": "arg0", "type": "uint256"}], "outputs": [{"name": "", "type": "uint256"}]},
+        {"stateMutability": "view", "type": "function", "name": "burner", "inputs": [],
+         "outputs": [{"name": "", "type": "address"}]},
+        {"stateMutability": "view", "type": "function", "name": "hooker", "inputs": [],
+         "outputs": [{"name": "", "type": "address"}]},
+        {"stateMutability": "view", "type": "function", "name": "is_killed",
+         "inputs": [{"name": "arg0", "type": "address"}], "outputs": [{"name": "", "type": "uint256"}]},
+        {"anonymous": False, "type": "event", "name": "SetMaxFee",
+         "inputs": [{"name": "epoch", "type": "uint256", "indexed": True},
+                    {"name": "max_fee", "type": "uint256", "indexed": False}]},
+        {"anonymous": False, "type": "event", "name": "SetBurner",
+         "inputs": [{"name": "burner", "type": "address", "indexed": True}]},
+        {"anonymous": False, "type": "event", "name": "SetHooker",
+         "inputs": [{"name": "hooker", "type": "address", "indexed": True}]},
+        {"anonymous": False, "type": "event", "name": "SetTarget",
+         "inputs": [{"name": "target", "type": "address", "indexed": True}]},
+        {"anonymous": False, "type": "event", "name": "SetKilled",
+         "inputs": [{"name": "coin", "type": "address", "indexed": True},
+                    {"name": "epoch_mask", "type": "uint256", "indexed": False}]},
+    ]
+
+    _instances: dict[Chain, "FeeCollectorMirror"] = {}
+
+    def __init__(self, config: dict):
+        self.chain = config["chain"]
+        self._import_web3(config)
+        self.contract = self.web3.eth.contract(Web3.to_checksum_address(self._ADDRESS[self.chain]), abi=self._ABI)
+        self._events = {}  # topic: event
+        for abi in self._ABI:
+            if abi["type"] == "event":
+                signature = f"{abi['name']}({','.join(i['type'] for i in abi['inputs'])})"
+                self._events[bytes(Web3.keccak(text=signature))] = self.contract.events[abi["name"]]()
+
+        self.block = None
+        self.target = None
+        self.max_fee = {}
+        self.burner = None
+        self.hooker = None
+        self.is_killed = {}
+        self.load_cache()
+
+    @classmethod
+    def from_config(cls, config: dict) -> "FeeCollectorMirror":
+        """One mirror per chain, shared by all modules"""
+        if config["chain"] not in cls._instances:
+            cls._instances[config["chain"]] = cls(config)
+        return cls._instances[config["chain"]]
+
+    def __getstate__(self) -> dict:
+        return {self.chain.name: {
+            "block": self.block,
+            "target": self.target,
+            "max_fee": {str(epoch): fee for epoch, fee in self.max_fee.items()},
+            "burner": self.burner,
+            "hooker": self.hooker,
+            "is_killed": self.is_killed,
+        }}
+
+    def __setstate__(self, state):
+        state = state.get(self.chain.name)
+        if not state:
+            return
+        self.block = state["block"]
+        self.target = state["target"]
+        self.max_fee = {int(epoch): fee for epoch, fee in state["max_fee"].items()}
+        self.burner = state["burner"]
+        self.hooker = state["hooker"]
+        self.is_killed = {coin.lower(): mask for coin, mask in state["is_killed"].items()}
+
+    def _multicall(self, calls: list[tuple[str, list]], block_identifier: int) -> list:
+        results = self.multicall.functions.aggregate3(
+            [(self.contract.address, False, self.contract.encodeABI(fn_name, args)) for fn_name, args in calls]
+        ).call(block_identifier=block_identifier)
+        return [
+            self.web3.codec.decode([self.contract.get_function_by_name(fn_name).abi["outputs"][0]["type"]], data)[0]
+            for (fn_name, _), (_, data) in zip(calls, results)
+        ]
+
+    def bootstrap(self, coins: tp.Iterable[str] = (), block_identifier: tp.Optional[int] = None):
+        """Read whole configuration in one multicall"""
+        if block_identifier is None:
+            block_identifier = self.web3.eth.block_number
+        coins = list(set(coin.lower() for coin in coins) | {self.ALL_COINS})
+        calls = [("target", []), ("burner", []), ("hooker", [])] +\
+            [("max_fee", [epoch]) for epoch in self._EPOCHS] +\
+            [("is_killed", [Web3.to_checksum_address(coin)]) for coin in coins]
+        target, burner, hooker, *values = self._multicall(calls, block_identifier)
+
+        self.block = block_identifier
+        self.target, self.burner, self.hooker = target.lower(), burner.lower(), hooker.lower()
+        self.max_fee = dict(zip(self._EPOCHS, values[:len(self._EPOCHS)]))
+        self.is_killed = dict(zip(coins, values[len(self._EPOCHS):]))
+        self.save_cache()
+
+    def _apply(self, log):
+        event = self._events.get(bytes(log["topics"][0])) if log["topics"] else None
+        if event is None:
+            return
+        args = event.process_log(log)["args"]
+        match event.event_name:
+            case "SetMaxFee":
+                self.max_fee[args["epoch"]] = args["max_fee"]
+            case "SetBurner":
+                self.burner = args["burner"].lower()
+            case "SetHooker":
+                self.hooker = args["hooker"].lower()
+            case "SetTarget":
+                self.target = args["target"].lower()
+            case "SetKilled":
+                self.is_killed[args["coin"].lower()] = args["epoch_mask"]
+
+    def sync(self, to_block: tp.Optional[int] = None):
+        """Apply Set* logs emitted since the mirrored block"""
+        if to_block is None:
+            to_block = self.web3.eth.block_number
+        if self.block is None:
+            self.bootstrap(block_identifier=to_block)
+            return
+        for from_block in range(self.block + 1, to_block + 1, self._LOGS_RANGE):
+            logs = self.web3.eth.get_logs({
+                "address": self.contract.address,
+                "topics": [["0x" + topic.hex() for topic in self._events]],
+                "fromBlock": from_block,
+                "toBlock": min(from_block + self._LOGS_RANGE - 1, to_block),
+            })
+            for log in sorted(logs, key=lambda log: (log["blockNumber"], log["logIndex"])):
+                self._apply(log)
+        if to_block != self.block:
+            self.block = to_block
+            self.save_cache()
+
+    def fetch_killed(self, coins: tp.Iterable[str]):
+        """Look up `is_killed` of coins not mirrored yet"""
+        unknown = list(set(coin.lower() for coin in coins) - self.is_killed.keys())
+        if not unknown:
+            return
+        if self.block is None:
+            self.sync()
+        values = self._multicall([("is_killed", [Web3.to_checksum_address(coin)]) for coin in unknown], self.block)
+        self.is_killed.update(zip(unknown, values))
+        self.save_cache()
+
+    def killed(self, coin: str, epoch: int) -> bool:
+        return bool((self.is_killed.get(self.ALL_COINS, 0) | self.is_killed.get(coin.lower(), 0)) & epoch)
+
+    def filter_alive(self, coins: tp.Iterable[str], epoch: int) -> list[str]:
+        """Coins that won't revert with "Killed coin"/"Killed epoch" in `epoch`"""
+        coins = list(coins)
+        self.fetch_killed(coins)
+        return [coin for coin in coins if not self.killed(coin, epoch)]
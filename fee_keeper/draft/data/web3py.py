@@ -0,0 +1,46 @@
+import typing as tp
+
+from web3 import Web3
+from web3.middleware import geth_poa_middleware
+
+from utils import Chain
+
+
+class Web3PyData:
+    _RPC = {
+        Chain.Ethereum: "http://localhost:8545",
+        Chain.Gnosis: "https://rpc.gnosischain.com",
+    }
+    _POA_CHAINS = [Chain.Gnosis]
+
+    _MULTICALL = "0xcA11bde05977b3631167028862bE2a173976CA11"  # https://github.com/mds1/multicall/ v3
+    _MULTICALL_ABI = [
+        {"inputs": [{"components": [{"internalType": "address", "name": "target", "type": "address"},
+                                    {"internalType": "bool", "name": "allowFailure", "type": "bool"},
+                                    {"internalType": "bytes", "name": "callData", "type": "bytes"}],
+                     "internalType": "struct Multicall3.Call3[]", "name": "calls", "type": "tuple[]"}],
+         "name": "aggregate3",
+         "outputs": [{"components": [{"internalType": "bool", "name": "success", "type": "bool"},
+                                     {"internalType": "bytes", "name": "returnData", "type": "bytes"}],
+                      "internalType": "struct Multicall3.Result[]", "name": "returnData", "type": "tuple[]"}],
+         "stateMutability": "payable", "type": "function"},
+    ]
+
+    def __init__(self, config: tp.Optional[dict] = None, chain: tp.Optional[Chain] = None):
+        self._import_web3(config=config, chain=chain)
+
+    @staticmethod
+    def _import_web3(config: tp.Optional[dict] = None, chain: tp.Optional[Chain] = None):
+        if config and not chain:
+            chain = config["chain"]
+        if chain and getattr(Web3PyData, "chain", None) != chain:
+            Web3PyData._connect(chain)
+
+    @staticmethod
+    def _connect(chain: Chain):
+        web3 = Web3(provider=Web3.HTTPProvider(Web3PyData._RPC[chain]))
+        if chain in Web3PyData._POA_CHAINS:
+            web3.middleware_onion.inject(geth_poa_middleware, layer=0)
+        Web3PyData.web3 = web3
+        Web3PyData.multicall = web3.eth.contract(Web3PyData._MULTICALL, abi=Web3PyData._MULTICALL_ABI)
+        Web3PyData.chain = chain
@@ -0,0 +1,109 @@
+"""
+EIP-1559 gas pricing from `eth_feeHistory` and builder inclusion outcomes.
+"""
+import statistics
+import time
+
+
+class FeeOracle:
+    """
+    maxPriorityFeePerGas is a percentile of priority fees paid in recent blocks, scaled by a multiplier
+    that goes up when a bundle is not included and decays back after inclusions.
+    maxFeePerGas covers next block base fee growing at max rate (12.5% per block) for `headroom_blocks` blocks.
+    Gas costs are in USD using native coin price, refreshed every `price_ttl` seconds.
+
+    Usage:
+        oracle = FeeOracle(web3, lambda: coin_usd_price("ethereum", WETH), tx_gas={"source": 850_000})
+        tx.update(oracle.fees())
+        included = bundle_submitter.submit_until_included(...)
+        oracle.record_outcome(included)
+        oracle.gas_cost("source")  # USD
+    """
+    BASE_FEE_MAX_CHANGE = 1.125  # EIP-1559 max base fee change per block
+
+    def __init__(self, web3, native_price_fn=None, tx_gas: dict[str, int] = None, blocks=20, percentile=50,
+                 headroom_blocks=6, min_priority=10 ** 8, max_priority=10 * 10 ** 9, bump=1.25, decay=0.9,
+                 max_age=12, price_ttl=600, native_price=1.):
+        """
+        @param native_price_fn Returns USD price of native coin, `native_price` is used if not set
+        @param tx_gas Typical gas by transaction type
+        @param blocks Number of recent blocks to take priority fees from
+        @param percentile Percentile of priority fees within each block
+        @param headroom_blocks Blocks of max base fee growth maxFeePerGas survives
+        @param min_priority Lower bound of maxPriorityFeePerGas
+        @param max_priority Upper bound of maxPriorityFeePerGas
+        @param bump Priority multiplier growth after a missed inclusion
+        @param decay Priority multiplier decay after an inclusion, down to 1
+        @param max_age Seconds to reuse fee history for, about block time
+        @param price_ttl Seconds to reuse native coin price for
+        @param native_price USD price of native coin until fetched
+        """
+        self.web3 = web3
+        self.native_price_fn = native_price_fn
+        self.tx_gas = tx_gas or {}
+        self.blocks = blocks
+        self.percentile = percentile
+        self.headroom_blocks = headroom_blocks
+        self.min_priority = min_priority
+        self.max_priority = max_priority
+        self.bump = bump
+        self.decay = decay
+        self.max_age = max_age
+        self.price_ttl = price_ttl
+
+        self.multiplier = 1.
+        self._history = None
+        self._history_ts = 0
+        self._native_price = native_price
+        self._native_price_ts = 0
+
+    def history(self) -> dict:
+        if self._history is None or time.time() - self._history_ts >= self.max_age:
+            self._history = self.web3.eth.fee_history(self.blocks, "latest", [self.percentile])
+            self._history_ts = time.time()
+        return self._history
+
+    def next_base_fee(self) -> int:
+        return self.history()["baseFeePerGas"][-1]  # includes the block after newest
+
+    def priority_fee(self) -> int:
+        rewards = [reward[0] for reward in self.history()["reward"] if reward]
+        priority = statistics.median(rewards) if rewards else self.min_priority
+        return int(min(max(priority * self.multiplier, self.min_priority), self.max_priority))
+
+    def fees(self, headroom_blocks: int = None) -> dict[str, int]:
+        """maxFeePerGas and maxPriorityFeePerGas of a transaction"""
+        headroom_blocks = self.headroom_blocks if headroom_blocks is None else headroom_blocks
+        priority = self.priority_fee()
+        return {
+            "maxFeePerGas": int(self.next_base_fee() * self.BASE_FEE_MAX_CHANGE ** headroom_blocks) + priority,
+            "maxPriorityFeePerGas": priority,
+        }
+
+    def record_outcome(self, included: bool):
+        """Adapt priority to builder outcome of a submitted bundle"""
+        if included:
+            self.multiplier = max(self.multiplier * self.decay, 1.)
+        else:
+            self.multiplier *= self.bump
+
+    def native_price(self) -> float:
+        if self.native_price_fn and time.time() - self._native_price_ts >= self.price_ttl:
+            try:
+                self._native_price = self.native_price_fn()
+                self._native_price_ts = time.time()
+            except Exception as e:
+                print(f"Could not fetch native price, using {self._native_price}: {repr(e)}")
+        return self._native_price
+
+    def gas_price(self) -> int:
+        """Expected effective gas price of the next block"""
+        return self.next_base_fee() + self.priority_fee()
+
+    def gas_cost(self, gas: int | str) -> float:
+        """
+        @param gas Gas or transaction type from `tx_gas`
+        @return USD
+        """
+        gas = self.tx_gas[gas] if isinstance(gas, str) else gas
+        return gas * self.gas_price() / 10 ** 18 * self.native_price()
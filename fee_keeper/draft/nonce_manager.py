@@ -0,0 +1,182 @@
+"""
+Nonce-pipelined transaction sending: nonces are assigned locally, so a batch goes out back to back.
+"""
+import asyncio
+import time
+
+from web3.exceptions import TransactionNotFound
+
+
+class NonceManager:
+    """
+    Signs and sends transactions of one account with consecutive local nonces without waiting for each other,
+    then follows all of them concurrently until their receipts:
+    - a transaction not mined for `stuck_time` seconds is replaced at the same nonce with bumped fees;
+    - a transaction dropped from the mempool is broadcast again;
+    - a transaction the node rejects (underpriced, reverted estimation, ...) is replaced by an empty
+      self-transfer, so the gap in nonces does not block the rest of the batch; its receipt is reported as None.
+    Blocking web3 calls run in threads, so a sync provider is enough.
+
+    Usage:
+        nonce_manager = NonceManager(web3, wallet_pk, fee_oracle.fees)
+        receipts = await nonce_manager.send_all(txs)  # receipt for each tx, None if not mined or filled
+    """
+    REPLACEMENT_BUMP = 1.125  # nodes require at least 10% higher fees to replace a pending tx
+    _NONCE_USED = ("nonce too low", "already known", "known transaction")
+
+    def __init__(self, web3, private_key, fee_fn=None, stuck_time=30., max_bumps=5, poll_interval=1.):
+        """
+        @param fee_fn Returns fee fields (maxFeePerGas, ...) for txs without them and for bumps
+        @param stuck_time Seconds to wait for inclusion before bumping fees
+        @param max_bumps Fee bumps of one tx before giving up on it
+        @param poll_interval Seconds between receipt checks
+        """
+        self.web3 = web3
+        self.account = web3.eth.account.from_key(private_key)
+        self.address = self.account.address
+        self.fee_fn = fee_fn
+        self.stuck_time = stuck_time
+        self.max_bumps = max_bumps
+        self.poll_interval = poll_interval
+
+        self._chain_id = None
+        self._nonce = None
+        self._in_flight = 0
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    async def _call(fn, *args):
+        return await asyncio.to_thread(fn, *args)
+
+    async def _reserve(self, n: int) -> int:
+        """First of `n` consecutive nonces"""
+        async with self._lock:
+            pending = await self._call(self.web3.eth.get_transaction_count, self.address, "pending")
+            if self._nonce is None or self._in_flight == 0 or pending > self._nonce:
+                self._nonce = pending  # nothing of ours in flight, node is the source of truth
+            nonce = self._nonce
+            self._nonce += n
+            self._in_flight += n
+            return nonce
+
+    async def _prepare(self, tx: dict, nonce: int) -> dict:
+        if self._chain_id is None:
+            self._chain_id = await self._call(lambda: self.web3.eth.chain_id)
+        tx = {k: v for k, v in tx.items() if k != "from"} | {"nonce": nonce}
+        tx.setdefault("chainId", self._chain_id)
+        tx.setdefault("value", 0)
+        if "gasPrice" not in tx and "maxFeePerGas" not in tx and self.fee_fn:
+            tx.update(self.fee_fn())
+        return tx
+
+    def _bump(self, tx: dict) -> dict:
+        fresh = self.fee_fn() if self.fee_fn else {}
+        fields = ["gasPrice"] if "gasPrice" in tx else ["maxFeePerGas", "maxPriorityFeePerGas"]
+        return tx | {field: max(int(tx[field] * self.REPLACEMENT_BUMP) + 1, fresh.get(field, 0)) for field in fields}
+
+    def _noop(self, tx: dict) -> dict:
+        fields = ["gasPrice"] if "gasPrice" in tx else ["maxFeePerGas", "maxPriorityFeePerGas"]
+        return {"to": self.address, "value": 0, "data": b"", "gas": 21_000, "nonce": tx["nonce"],
+                "chainId": tx["chainId"]} | {field: tx[field] for field in fields}
+
+    async def _send(self, tx: dict) -> bytes:
+        signed = self.account.sign_transaction(tx)
+        try:
+            await self._call(self.web3.eth.send_raw_transaction, signed.rawTransaction)
+        except ValueError as e:
+            if not any(reason in str(e).lower() for reason in self._NONCE_USED):
+                raise
+        return bytes(signed.hash)
+
+    async def _receipt(self, tx_hash: bytes):
+        try:
+            return await self._call(self.web3.eth.get_transaction_receipt, tx_hash)
+        except TransactionNotFound:
+            return None
+
+    async def _known(self, tx_hash: bytes) -> bool:
+        try:
+            await self._call(self.web3.eth.get_transaction, tx_hash)
+            return True
+        except TransactionNotFound:
+            return False
+
+    async def _mined(self, hashes: list[bytes]):
+        """Receipt of the latest mined of `hashes`"""
+        for tx_hash in reversed(hashes):
+            if receipt := await self._receipt(tx_hash):
+                return receipt
+        return None
+
+    async def _follow(self, tx: dict, tx_hash: bytes | None):
+        """
+        Wait for tx (or its replacement) at `tx["nonce"]` to be mined
+        @return Receipt, None if not mined or the nonce was filled
+        """
+        hashes = [tx_hash] if tx_hash else []
+        bumps, sent_at = 0, time.time()
+        filled = not hashes
+        if filled:  # rejected by node, fill the gap
+            print(f"Nonce {tx['nonce']} rejected, filling with empty tx")
+            tx = self._noop(tx)
+        while True:
+            if not hashes:
+                try:
+                    hashes.append(await self._send(tx))
+                    sent_at = time.time()
+                except ValueError as e:  # filler has fees of the rejected tx, may be underpriced as well
+                    if bumps >= self.max_bumps:
+                        print(f"Could not fill nonce {tx['nonce']} after {bumps} bumps, giving up: {repr(e)}")
+                        return None
+                    tx = self._bump(tx)
+                    bumps += 1
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+            await asyncio.sleep(self.poll_interval)
+            if receipt := await self._mined(hashes):
+                return None if filled else receipt
+            if await self._call(self.web3.eth.get_transaction_count, self.address) > tx["nonce"]:
+                if receipt := await self._mined(hashes):  # mined in between
+                    return None if filled else receipt
+                print(f"Nonce {tx['nonce']} is used by another tx")
+                return None
+
+            try:
+                if time.time() - sent_at >= self.stuck_time:
+                    if bumps >= self.max_bumps:
+                        print(f"Nonce {tx['nonce']} stuck after {bumps} bumps, giving up")
+                        return None
+                    tx = self._bump(tx)
+                    bumps += 1
+                    hashes.append(await self._send(tx))
+                    sent_at = time.time()
+                elif not await self._known(hashes[-1]):  # dropped from mempool
+                    hashes.append(await self._send(tx))
+            except ValueError as e:
+                print(f"Could not resend nonce {tx['nonce']}: {repr(e)}")
+
+    async def send_all(self, txs: list[dict]) -> list:
+        """
+        @param txs Transactions with gas, nonce and from are overridden
+        @return Receipt of each transaction, None if it was not mined
+        """
+        if not txs:
+            return []
+        nonce = await self._reserve(len(txs))
+        try:
+            txs = [await self._prepare(tx, nonce + i) for i, tx in enumerate(txs)]
+            hashes = []
+            for tx in txs:  # back to back in nonce order, so nodes don't queue later ones
+                try:
+                    hashes.append(await self._send(tx))
+                except ValueError as e:
+                    print(f"Nonce {tx['nonce']} rejected: {repr(e)}")
+                    hashes.append(None)
+            return list(await asyncio.gather(*[self._follow(tx, tx_hash) for tx, tx_hash in zip(txs, hashes)]))
+        finally:
+            async with self._lock:
+                self._in_flight -= len(txs)
+
+    def send(self, txs: list[dict]) -> list:
+        """Blocking `send_all` for code outside of an event loop"""
+        return asyncio.run(self.send_all(txs))
@@ -0,0 +1,45 @@
+"""
+Curve API poolData loader, shared by keeper scripts and the draft.
+Registries are fetched over one pooled session with conditional GETs,
+so an unchanged registry costs 304 instead of a whole JSON download.
+Responses are shared within one refresh cycle, the last one is kept if the API fails.
+Returned lists are shared as well, copy pool dicts before changing them.
+"""
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+CURVE_API = "https://api.curve.fi/api"
+MAX_WORKERS = 8
+REFRESH_CYCLE = 60  # sec
+
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_maxsize=MAX_WORKERS))
+_responses = {}  # url: (ETag, Last-Modified, poolData)
+_fetched_at = {}  # url: ts
+
+
+def get_pool_data(url, force=False):
+    etag, last_modified, pool_data = _responses.get(url, (None, None, None))
+    if not force and pool_data is not None and time.time() < _fetched_at[url] + REFRESH_CYCLE:
+        return pool_data
+
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    _fetched_at[url] = time.time()  # failed fetches are retried next cycle as well
+    try:
+        r = session.get(url, headers=headers, timeout=30)
+        if r.status_code == 304 and pool_data is not None:
+            return pool_data
+        r.raise_for_status()
+        new_pool_data = r.json().get("data", {}).get("poolData", [])
+    except (requests.RequestException, ValueError) as e:
+        print(f"Could not fetch {url}, using {'cached' if pool_data is not None else 'no'} pool data", repr(e))
+        return pool_data if pool_data is not None else []
+    _responses[url] = (r.headers.get("ETag"), r.headers.get("Last-Modified"), new_pool_data)
+    return new_pool_data
@@ -1,7 +1,11 @@
+import os
 import time
 from abc import abstractmethod
 
 from fee_keeper import BrownieData
+from data.web3py import Web3PyData
+from fee_oracle import FeeOracle
+from nonce_manager import NonceManager
 from utils import Registrar, prune_config
 
 
@@ -35,3 +39,45 @@ class TxSenderBrownie(TxSender, BrownieData):
             # calldata = fn.encode_input(*args)
             fn(*args, {"from": self.sender} | self.send_params)
             time.sleep(3)  # Wait for propagate
+
+
+class PipelinedTxSender(TxSender, Web3PyData):
+    """
+    Sends all txs of a batch back to back with locally assigned nonces and waits for them concurrently,
+    stuck txs are bumped and dropped ones resent (see nonce_manager.py).
+    Txs are (target, calldata) pairs or tx dicts.
+    EIP-1559 fees come from FeeOracle (fee history reused within a block) unless set in `send_params` or the tx.
+    """
+    def __init__(self, config, fee_oracle: FeeOracle = None):
+        """
+        @param fee_oracle Oracle shared with other senders, one is built from config if not set
+        """
+        super().__init__(config)
+        config = prune_config(config, self.__class__)
+        self._import_web3(config)
+        self.fee_oracle = fee_oracle or FeeOracle(
+            self.web3, blocks=config.get("fee_blocks", 20), percentile=config.get("fee_percentile", 50),
+            headroom_blocks=config.get("fee_headroom_blocks", 6), max_age=config.get("fee_max_age", 12),
+        )
+        self.nonce_manager = NonceManager(
+            self.web3, os.environ[config.get("private_key_env", "KEEPER_PK")], fee_fn=self.fee_oracle.fees,
+            stuck_time=config.get("stuck_time", 30), max_bumps=config.get("max_bumps", 5),
+        )
+        self.send_params = config.get("send_params", {})
+        self.gas_multiplier = config.get("gas_multiplier", 1.2)
+
+    def _build(self, tx) -> dict:
+        if not isinstance(tx, dict):
+            target, calldata = tx
+            tx = {"to": target, "data": calldata}
+        tx = {"from": self.nonce_manager.address} | self.send_params | tx
+        if "gas" not in tx:
+            tx["gas"] = int(self.gas_multiplier * self.web3.eth.estimate_gas(tx))
+        return tx
+
+    def send(self, txs: list):
+        receipts = self.nonce_manager.send([self._build(tx) for tx in txs])
+        for receipt in receipts:
+            if receipt is None or receipt["status"] != 1:
+                print(f"Not executed: {receipt}")
+        return receipts
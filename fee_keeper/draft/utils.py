@@ -1,7 +1,10 @@
 import json
 import os.path
+import sqlite3
+import tempfile
+from abc import abstractmethod
 from enum import Enum
-from typing import Union
+from typing import Optional
 from time import time as timestamp  # TODO: use pending block timestamp
 
 import yaml
@@ -101,8 +104,20 @@ class Registrar:
         return cls.get_from_type(subclass_type)
 
 
+def serialize_state(d):
+    """Recursively convert `Cached` state into JSON-compatible structures"""
+    if isinstance(d, dict):
+        return {k: serialize_state(v) for k, v in d.items()}
+    elif isinstance(d, (str, int, float, bool)) or d is None:
+        return d
+    elif isinstance(d, (list, tuple, set)):
+        return [serialize_state(v) for v in d]
+    return serialize_state(d.__getstate__())
+
+
 class Cached:
     _DIR = "fee_keeper/cache"
+    _store: "CacheStore" = None
 
     def __getstate__(self) -> dict:
         """Should be of type dict"""
@@ -112,37 +127,135 @@ class Cached:
         """Implement for each class"""
         pass
 
+    @staticmethod
+    def set_cache_store(store: "CacheStore"):
+        Cached._store = store
+
+    @property
+    def cache_store(self) -> "CacheStore":
+        if Cached._store is None:
+            Cached._store = SQLiteCacheStore()
+        return Cached._store
+
     @property
     def cache_file_name(self):
         return f"{self._DIR}/{self.__class__.__name__}.json"
 
     def save_cache(self):
-        def recursive_serialize(d: Union[dict, Cached]):
-            if hasattr(d, "__getstate__"):
-                return recursive_serialize(d.__getstate__())
-            elif isinstance(d, dict):
-                for k, v in d.items():
-                    d[k] = recursive_serialize(v)
-            elif hasattr(d, "__iter__") and not isinstance(d, str):
-                return [recursive_serialize(v) for v in d]
-            return d
-
-        initial = {}
-        if os.path.isfile(self.cache_file_name):
-            with open(self.cache_file_name, "r") as file:
-                initial = json.load(file)
-
-        # NOTE: not recursive since logic is: cache[chain] = whole_new_cache
-        initial.update(recursive_serialize(self))
-        with open(self.cache_file_name, "w+") as file:
-            json.dump(recursive_serialize(self), file, indent=2)
+        self.cache_store.save(self.__class__.__name__, serialize_state(self))
 
     def load_cache(self, cache=None):
         if not cache:
-            cache = {}
-            if os.path.isfile(self.cache_file_name):
-                with open(self.cache_file_name, 'r') as f:
-                    cache = json.load(f)
+            cache = self.cache_store.load(self.__class__.__name__)
         if isinstance(super(), Cached):
             super().__setstate__(cache)
         self.__setstate__(cache)
+
+
+class CacheStore(Registrar):
+    """Storage of `Cached` states. State is {chain: data}, saving replaces data of given chains only."""
+    def __init__(self, config: Optional[dict] = None):
+        pass
+
+    @abstractmethod
+    def load(self, name: str) -> dict:
+        return {}
+
+    @abstractmethod
+    def save(self, name: str, state: dict):
+        pass
+
+
+class JSONCacheStore(CacheStore):
+    """Whole state in one JSON file per class"""
+    @staticmethod
+    def file_name(name: str) -> str:
+        return f"{Cached._DIR}/{name}.json"
+
+    def load(self, name: str) -> dict:
+        if not os.path.isfile(self.file_name(name)):
+            return {}
+        with open(self.file_name(name), "r") as file:
+            return json.load(file)
+
+    def save(self, name: str, state: dict):
+        # NOTE: not recursive since logic is: cache[chain] = whole_new_cache
+        cache = self.load(name)
+        cache.update(state)
+        os.makedirs(Cached._DIR, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=Cached._DIR, suffix=".tmp", delete=False) as file:
+            json.dump(cache, file, indent=2)
+        os.replace(file.name, self.file_name(name))  # atomic
+
+
+class SQLiteCacheStore(CacheStore):
+    """
+    Rows keyed by (class, chain, key) in SQLite WAL mode, only changed rows are written in one transaction.
+    Nested dicts are split into rows per key path, lists and other values are stored as one JSON row.
+    """
+    _FILE = "cache.sqlite"
+
+    def __init__(self, config: Optional[dict] = None):
+        super().__init__(config)
+        os.makedirs(Cached._DIR, exist_ok=True)
+        self.connection = sqlite3.connect(f"{Cached._DIR}/{self._FILE}")
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "cls TEXT NOT NULL, chain TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "PRIMARY KEY (cls, chain, key))"
+        )
+        self.connection.commit()
+        self._rows: dict[str, dict[tuple[str, str], str]] = {}  # name: {(chain, key): value} as stored
+
+    def _flatten(self, data, path: tuple = ()):
+        if isinstance(data, dict) and data:
+            for k, v in data.items():
+                yield from self._flatten(v, path + (str(k),))
+        else:
+            yield json.dumps(path), json.dumps(data, sort_keys=True)
+
+    def _unflatten(self, rows: dict[tuple[str, str], str]) -> dict:
+        state = {}
+        for (chain, key), value in sorted(rows.items()):
+            path = [chain] + json.loads(key)
+            node = state
+            for segment in path[:-1]:
+                node = node.setdefault(segment, {})
+            node[path[-1]] = json.loads(value)
+        return state
+
+    def _stored_rows(self, name: str) -> dict[tuple[str, str], str]:
+        if name not in self._rows:
+            self._rows[name] = {
+                (chain, key): value for chain, key, value in
+                self.connection.execute("SELECT chain, key, value FROM cache WHERE cls = ?", (name,))
+            }
+        return self._rows[name]
+
+    def load(self, name: str) -> dict:
+        rows = self._stored_rows(name)
+        if not rows:  # Migrate from whole-file JSON cache
+            state = JSONCacheStore().load(name)
+            if state:
+                self.save(name, state)
+            return state
+        return self._unflatten(rows)
+
+    def save(self, name: str, state: dict):
+        stored = self._stored_rows(name)
+        rows = {(chain, key): value for chain, data in state.items() for key, value in self._flatten(data)}
+
+        upserts = [(name, chain, key, value) for (chain, key), value in rows.items() if stored.get((chain, key)) != value]
+        deletes = [(name, chain, key) for chain, key in stored if chain in state and (chain, key) not in rows]
+        if not upserts and not deletes:
+            return
+        with self.connection:  # Transaction, rolled back on failure
+            self.connection.executemany(
+                "INSERT INTO cache (cls, chain, key, value) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (cls, chain, key) DO UPDATE SET value = excluded.value",
+                upserts,
+            )
+            self.connection.executemany("DELETE FROM cache WHERE cls = ? AND chain = ? AND key = ?", deletes)
+        self._rows[name] = {k: v for k, v in stored.items() if k[0] not in state} | rows
@@ -0,0 +1,106 @@
+"""
+Incremental tally of fee sources driven by logs.
+"""
+import asyncio
+import json
+import os
+import tempfile
+
+from web3 import Web3
+
+
+TRANSFER_TOPIC = bytes.fromhex("ddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef")
+APPROVAL_TOPIC = bytes.fromhex("8c5be1e5ebec7d5bd14f71427d1e84f3dd0314c0f7b2291e5b200ac8c7c3b925")
+
+
+def address_topic(address: str) -> str:
+    return "0x" + address.lower()[2:].rjust(64, "0")
+
+
+class IncrementalTally:
+    """
+    Keeps last tallies and finds sources touched since the last processed block, so only those are re-read:
+      - pools with any log except LP token Transfer/Approval (swaps, liquidity changes, admin actions)
+      - coins with Transfer from or to holders
+    State is persisted, so restarts resume from the last processed block.
+
+    Usage:
+        changes = await tally.changes(web3, pools, [PROXY, FEE_COLLECTOR], block)
+        if changes is None:  # no state or too far behind
+            ...  # tally everything
+        tally.state["pools"][pool] = ...
+        tally.update(block)
+    """
+
+    def __init__(self, path="fee_keeper/cache/incremental_tally.json", block_range=2_000, address_chunk=500,
+                 max_lag=50_000):
+        """
+        @param path File to persist state to
+        @param block_range Maximum blocks per eth_getLogs
+        @param address_chunk Maximum addresses per eth_getLogs
+        @param max_lag Tally everything if last processed block is further behind
+        """
+        self.path = path
+        self.block_range = block_range
+        self.address_chunk = address_chunk
+        self.max_lag = max_lag
+        self.state = self.load()
+
+    @staticmethod
+    def _empty_state():
+        return {"last_block": None, "pools": {}, "pk_profits": {}, "holders": {}}
+
+    def load(self) -> dict:
+        try:
+            with open(self.path, "r") as f:
+                return {**self._empty_state(), **json.load(f)}
+        except (FileNotFoundError, json.JSONDecodeError):
+            return self._empty_state()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+    def update(self, block: int):
+        """Mark state as tallied at `block`"""
+        self.state["last_block"] = block
+        self.save()
+
+    def _block_ranges(self, to_block):
+        for start in range(self.state["last_block"] + 1, to_block + 1, self.block_range):
+            yield start, min(start + self.block_range - 1, to_block)
+
+    async def changes(self, web3, pools: list[str], holders: list[str], to_block: int) ->\
+            tuple[set[str], set[str]] | None:
+        """
+        @param web3 Async web3
+        @param pools Pool addresses to watch
+        @param holders Addresses to watch transfers of
+        @param to_block Last block to process
+        @return (changed pools, changed coins) lowercase, None if everything should be tallied
+        """
+        last_block = self.state["last_block"]
+        if last_block is None or to_block - last_block > self.max_lag:
+            return None
+
+        pools = [Web3.to_checksum_address(pool) for pool in pools]
+        holder_topics = [address_topic(holder) for holder in holders]
+        pool_requests, transfer_requests = [], []
+        for from_block, till_block in self._block_ranges(to_block):
+            block_filter = {"fromBlock": from_block, "toBlock": till_block}
+            for i in range(0, len(pools), self.address_chunk):
+                pool_requests.append(web3.eth.get_logs({**block_filter, "address": pools[i: i + self.address_chunk]}))
+            transfer_requests.append(web3.eth.get_logs({**block_filter, "topics": ["0x" + TRANSFER_TOPIC.hex(), holder_topics]}))
+            transfer_requests.append(web3.eth.get_logs({**block_filter, "topics": ["0x" + TRANSFER_TOPIC.hex(), None, holder_topics]}))
+        pool_logs = await asyncio.gather(*pool_requests)
+        transfer_logs = await asyncio.gather(*transfer_requests)
+
+        changed_pools = set(
+            log["address"].lower() for logs in pool_logs for log in logs
+            if not log["topics"] or bytes(log["topics"][0]) not in (TRANSFER_TOPIC, APPROVAL_TOPIC)
+        )
+        changed_coins = set(log["address"].lower() for logs in transfer_logs for log in logs)
+        return changed_pools, changed_coins
@@ -2,14 +2,15 @@
 Script template to one-time collect of fees found manually through some special route.
 Follow "# ALTER" lines to fill all needed data.
 """
-import time
-import requests
 import os
 from dotenv import load_dotenv
 
 from web3 import Web3
 from eth_account import Account
 
+from bundles import BundleSubmitter
+from draft.fee_oracle import FeeOracle
+
 
 chain = "etherum"  # ALTER: chain
 FEE_COLLECTOR = {
@@ -26,12 +27,14 @@ BUILDERS = [
     "https://rsync-builder.xyz",
     # "https://relay.flashbots.net",
 ]
+bundle_submitter = BundleSubmitter(BUILDERS)
 
 web3 = Web3(
     provider=Web3.HTTPProvider(
         "http://localhost:8545",  # ALTER: Chain RPC
     ),
 )
+fee_oracle = FeeOracle(web3)
 if os.path.exists(".env"):
     load_dotenv()
 account = Account.from_key(os.getenv("ACCOUNT_PK"))  # ALTER: load private key
@@ -81,8 +84,7 @@ def build_multicall_transaction(calls):
         {
             "from": account.address,
             "nonce": nonce,
-            "maxFeePerGas": 5 * 10 ** 9,
-            "maxPriorityFeePerGas": 1 * 10 ** 9,
+            **fee_oracle.fees(),
         }
     )
     signed_tx = web3.eth.account.sign_transaction(tx, private_key=account.private_key)
@@ -92,39 +94,9 @@ def build_multicall_transaction(calls):
 def send_transaction(signed_tx):
     wallet_address = signed_tx["from"]
     nonce = signed_tx["nonce"]
-    iters = 5  # ALTER: number of iterations to try
-    while web3.eth.get_transaction_count(wallet_address) < nonce and iters > 0:
-        block = web3.eth.get_block_number() + 1
-        print(f"Trying block: {block}")
-        for builder in BUILDERS:
-            if "flashbots" in builder:
-                r = requests.post(builder, json={
-                    "jsonrpc": "2.0",
-                    "id": 1,
-                    "method": "eth_sendBundle",
-                    "params": [
-                        {
-                            "version": "v0.1",
-                            "inclusion": {"block": str(hex(block)), "maxBlock": str(hex(block))},
-                            "body": [{"tx": signed_tx.rawTransaction.hex(), "canRevert": True}],
-                        }
-                    ]
-                })
-            else:
-                r = requests.post(builder, json={
-                    "jsonrpc": "2.0",
-                    "id": 1,
-                    "method": "eth_sendBundle",
-                    "params": [
-                        {
-                            "txs": [signed_tx.rawTransaction.hex()],
-                            "blockNumber": str(hex(block)),
-                        }
-                    ]
-                })
-            print(builder, r.json())
-        iters -= 1
-        time.sleep(6)  # wait some time between blocks
+    n_blocks = 5  # ALTER: number of blocks to try
+    included = bundle_submitter.submit_until_included(web3, [signed_tx], wallet_address, nonce + 1, max_blocks=n_blocks)
+    fee_oracle.record_outcome(included)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,139 @@
+"""
+Persistent fork state for boa: RPC responses of a pinned block are recorded to SQLite and reused across runs.
+"""
+import json
+import os
+import sqlite3
+
+from boa.rpc import RPC, RPCError, EthereumRPC
+
+DEFAULT_PATH = "fee_keeper/cache/fork.sqlite"
+
+
+class SnapshotRPC(RPC):
+    """
+    RPC of one block, every response (accounts, code, storage slots, traces) is stored keyed by
+    (chain id, block, method, params), so a fork of the same block does not touch the node again.
+    Without `url` it replays a recorded snapshot offline, missing entries raise RPCError.
+
+    Usage:
+        env.fork_rpc(SnapshotRPC(url, 19_000_000), block_identifier=19_000_000, cache_dir=None)
+        # or
+        rpc = fork(url)  # latest block, boa.env
+    """
+
+    def __init__(self, url: str | None, block_identifier: int | str = "latest", path: str = DEFAULT_PATH,
+                 chain_id: int | None = None):
+        """
+        @param url Node to record from, None to run offline
+        @param block_identifier Block to pin, tags resolve to a number (offline: latest recorded block)
+        @param path SQLite file of snapshots
+        @param chain_id Chain of snapshot to replay, any recorded chain if not set
+        """
+        self._rpc = EthereumRPC(url) if url else None
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS rpc ("
+            "chain_id INTEGER NOT NULL, block INTEGER NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "PRIMARY KEY (chain_id, block, key))"
+        )
+        self.db.commit()
+
+        if self._rpc is not None:
+            self.chain_id = int(self._rpc.fetch("eth_chainId", []), 16)
+            if isinstance(block_identifier, str):
+                block_identifier = int(self._rpc.fetch("eth_getBlockByNumber", [block_identifier, False])["number"], 16)
+        else:
+            conditions, args = [], []
+            if chain_id:
+                conditions.append("chain_id = ?")
+                args.append(chain_id)
+            if not isinstance(block_identifier, str):
+                conditions.append("block = ?")
+                args.append(block_identifier)
+            where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+            chain_id, block = self.db.execute(f"SELECT chain_id, MAX(block) FROM rpc{where}", args).fetchone()
+            if block is None:
+                raise RPCError(f"No recorded snapshot of block {block_identifier}", -32000)
+            self.chain_id, block_identifier = chain_id, block
+        self.block = block_identifier
+
+    @property
+    def identifier(self) -> str:
+        return f"snapshot:{self.chain_id}:{self.block}"
+
+    @property
+    def name(self) -> str:
+        return f"{self._rpc.name if self._rpc else 'offline'} at {self.block}"
+
+    @staticmethod
+    def _key(method: str, params) -> str:
+        return json.dumps([method, params], sort_keys=True)
+
+    def _load(self, keys: list[str]) -> dict[str, object]:
+        found = {}
+        for i in range(0, len(keys), 500):
+            chunk = keys[i: i + 500]
+            for key, value in self.db.execute(
+                f"SELECT key, value FROM rpc WHERE chain_id = ? AND block = ? AND key IN ({','.join('?' * len(chunk))})",
+                (self.chain_id, self.block, *chunk),
+            ):
+                found[key] = json.loads(value)
+        return found
+
+    def _store(self, items: dict[str, object]):
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO rpc VALUES (?, ?, ?, ?)",
+                [(self.chain_id, self.block, key, json.dumps(value)) for key, value in items.items()],
+            )
+
+    def fetch_multi(self, payloads: list[tuple[str, object]]) -> list:
+        keys = [self._key(method, params) for method, params in payloads]
+        found = self._load(list(set(keys)))
+        missing = [(key, payload) for key, payload in zip(keys, payloads) if key not in found]
+        if missing:
+            if self._rpc is None:
+                raise RPCError(f"{missing[0][1][0]} is not in snapshot of block {self.block}", -32000)
+            results = self._rpc.fetch_multi([payload for _, payload in missing])
+            fetched = {key: result for (key, _), result in zip(missing, results)}
+            self._store(fetched)
+            found.update(fetched)
+        return [found[key] for key in keys]
+
+    def fetch(self, method: str, params):
+        key = self._key(method, params)
+        found = self._load([key])
+        if key in found:
+            return found[key]
+        if self._rpc is None:
+            raise RPCError(f"{method} is not in snapshot of block {self.block}", -32000)
+        result = self._rpc.fetch(method, params)
+        self._store({key: result})
+        return result
+
+    def fetch_uncached(self, method: str, params):
+        # Responses at a pinned block do not change, needed to fork offline
+        return self.fetch(method, params)
+
+    def prune(self, keep_from_block: int):
+        """Remove snapshots of blocks before `keep_from_block`"""
+        with self.db:
+            self.db.execute("DELETE FROM rpc WHERE chain_id = ? AND block < ?", (self.chain_id, keep_from_block))
+
+    def close(self):
+        """Close the snapshot file, the RPC can not be used after"""
+        self.db.close()
+
+
+def fork(url: str | None, block_identifier: int | str = "latest", path: str = DEFAULT_PATH, env=None) -> SnapshotRPC:
+    """Fork `env` (boa.env by default) from a persistent snapshot, offline if `url` is None"""
+    if env is None:
+        import boa
+        env = boa.env
+    rpc = SnapshotRPC(url, block_identifier, path)
+    env.fork_rpc(rpc, block_identifier=rpc.block, cache_dir=None)  # snapshot is the cache
+    return rpc
@@ -0,0 +1,142 @@
+"""
+Gas model of keeper operations learned from receipts and simulations.
+"""
+import json
+import math
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+
+class GasModel:
+    """
+    Gas of an operation is `base[op] + sum(cost[op][item] for item in items)`, items being pools or coins of the call.
+    Every observation of a whole call (receipt or simulation) updates the base and costs of its items
+    by normalized least mean squares, so per-item costs are learned from batched calls.
+    Items seen fewer than `min_observations` times are priced at the average item cost of the operation,
+    and a prediction is not trusted while such items are present or the operation error is high.
+
+    Usage:
+        gas, certain = model.predict("COLLECT", coins)
+        gas_limits = model.gas_limits(web3, txs, [("COLLECT", coins)])  # estimate_gas only for uncertain ones
+        model.observe("COLLECT", coins, receipt["gasUsed"])
+        chunks = model.pack("COLLECT", coins, max_gas=5_000_000, max_len=64)
+    """
+
+    def __init__(self, path="fee_keeper/cache/gas_model.json", learning_rate=0.5, min_observations=2,
+                 max_error=0.1):
+        """
+        @param path File to persist the model to
+        @param learning_rate Share of prediction error corrected by each observation
+        @param min_observations Observations of an item to trust its cost
+        @param max_error Relative error of an operation to trust its predictions
+        """
+        self.path = path
+        self.learning_rate = learning_rate
+        self.min_observations = min_observations
+        self.max_error = max_error
+        self.ops = self.load()  # op: {"base", "n", "error", "items": {item: [cost, n]}}
+
+    def load(self) -> dict:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.ops, f)
+        os.replace(tmp_path, self.path)
+
+    def _item_cost(self, op: dict, item: str) -> float:
+        cost, n = op["items"].get(item, (0., 0))
+        if n >= self.min_observations:
+            return cost
+        known = [cost for cost, n in op["items"].values() if n >= self.min_observations]
+        return sum(known) / len(known) if known else cost
+
+    def predict(self, op_name: str, items: list[str]) -> tuple[int, bool]:
+        """
+        @return (gas, whether prediction can be trusted)
+        """
+        op = self.ops.get(op_name)
+        if op is None:
+            return 0, False
+        items = [item.lower() for item in items]
+        gas = op["base"] + sum(self._item_cost(op, item) for item in items)
+        certain = op["n"] >= self.min_observations and op["error"] <= self.max_error and\
+            all(op["items"].get(item, (0., 0))[1] >= self.min_observations for item in items)
+        return int(gas), certain
+
+    def pack(self, op_name: str, items: list[str], max_gas: int, max_len: int, default_gas: int = 100_000) ->\
+            list[list[str]]:
+        """
+        Split items into the fewest calls that fit `max_len` items and `max_gas` gas, balancing gas between calls:
+        items go from the most expensive one into the least loaded chunk, so expensive items don't pile up in one call.
+        Items are in ascending address order within chunks (FeeCollector.collect requires sorted coins).
+        @param default_gas Cost of an item if nothing is learned for the operation yet
+        """
+        if not items:
+            return []
+        op = self.ops.get(op_name)
+        base = op["base"] if op else 0.
+        cost = {item: max(self._item_cost(op, item.lower()), 0.) if op and op["items"] else default_gas
+                for item in items}
+        n = max(math.ceil(len(items) / max_len), math.ceil(sum(cost.values()) / max(max_gas - base, 1)))
+        while True:
+            chunks, loads = [[] for _ in range(n)], [0.] * n
+            for item in sorted(items, key=lambda item: -cost[item]):
+                i = min((i for i in range(n) if len(chunks[i]) < max_len), key=lambda i: loads[i])
+                chunks[i].append(item)
+                loads[i] += cost[item]
+            if base + max(loads) <= max_gas or n >= len(items):
+                break
+            n += 1
+        chunks = [sorted(chunk, key=lambda item: int(item, 16)) for chunk in chunks if chunk]
+        return sorted(chunks, key=lambda chunk: int(chunk[0], 16))
+
+    def observe(self, op_name: str, items: list[str], gas: int, save=True):
+        """Learn from gas used by a call of `op_name` over `items`"""
+        op = self.ops.setdefault(op_name, {"base": float(gas), "n": 0, "error": 1., "items": {}})
+        items = [item.lower() for item in items]
+        predicted = op["base"] + sum(self._item_cost(op, item) for item in items)
+        residual = gas - predicted
+        op["error"] = 0.7 * op["error"] + 0.3 * abs(residual) / max(gas, 1) if op["n"] else 1.
+
+        # NLMS step over features: 1 for base and item counts
+        counts = {}
+        for item in items:
+            counts[item] = counts.get(item, 0) + 1
+        norm = 1 + sum(count ** 2 for count in counts.values())
+        step = self.learning_rate * residual / norm
+        op["base"] += step
+        for item, count in counts.items():
+            cost, n = op["items"].get(item, (self._item_cost(op, item), 0))
+            op["items"][item] = [cost + step * count, n + 1]
+        op["n"] += 1
+        if save:
+            self.save()
+
+    def gas_limits(self, web3, txs: list[dict], ops: list[tuple[str, list[str]]], margin=1.2, max_workers=8) ->\
+            list[int]:
+        """
+        Gas limits of `txs` from the model, `estimate_gas` is requested concurrently for uncertain ones
+        @param ops (operation, items) of each tx
+        """
+        limits, uncertain = [], []
+        for i, (op_name, items) in enumerate(ops):
+            gas, certain = self.predict(op_name, items)
+            limits.append(int(margin * gas))
+            if not certain:
+                uncertain.append(i)
+        if uncertain:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                estimates = list(executor.map(
+                    web3.eth.estimate_gas, [{k: v for k, v in txs[i].items() if k != "gas"} for i in uncertain],
+                ))
+            for i, estimate in zip(uncertain, estimates):
+                limits[i] = int(margin * estimate)
+        return limits
@@ -0,0 +1,238 @@
+"""
+Index FeeCollector, Burner and Hooker events into local SQLite.
+
+Usage:
+    python3 fee_keeper/indexer.py ethereum 19000000
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from eth_abi.exceptions import DecodingError
+from web3 import Web3
+from web3.exceptions import MismatchedABI
+
+
+ABI_CACHE = "fee_keeper/cache/abi"
+CONTRACTS = {  # deployments.json name: source
+    "FeeCollector": "contracts/FeeCollector.vy",
+    "Hooker": "contracts/hooks/Hooker.vy",
+    "Burner": "contracts/burners/DutchAuctionBurner.vy",
+}
+EVENTS = {  # events to index
+    "FeeCollector": ["SetKilled", "SetMaxFee", "SetBurner", "SetHooker", "SetTarget"],
+    "Hooker": ["HookShot", "Act", "DutyAct"],
+    "Burner": ["Exchanged"],
+}
+TRANSFER_ABI = {
+    "anonymous": False, "type": "event", "name": "Transfer", "inputs": [
+        {"indexed": True, "name": "sender", "type": "address"},
+        {"indexed": True, "name": "receiver", "type": "address"},
+        {"indexed": False, "name": "value", "type": "uint256"},
+    ],
+}
+TOO_MANY_RESULTS = ["too many", "limit", "exceed", "range", "timeout", "-32005"]
+
+
+def load_abi(path: str) -> list:
+    """ABI of Vyper contract, compiled once per source version"""
+    with open(path, "rb") as f:
+        source = f.read()
+    name = os.path.splitext(os.path.basename(path))[0]
+    cache_path = os.path.join(ABI_CACHE, f"{name}-{hashlib.sha1(source).hexdigest()[:12]}.json")
+    if os.path.exists(cache_path):
+        with open(cache_path, "r") as f:
+            return json.load(f)
+
+    import vyper
+    abi = vyper.compile_code(source.decode(), output_formats=["abi"])["abi"]
+    os.makedirs(ABI_CACHE, exist_ok=True)
+    with open(cache_path, "w") as f:
+        json.dump(abi, f)
+    return abi
+
+
+def _column(value):
+    """SQLite value: uint256 that does not fit int64 is kept as decimal text"""
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, int):
+        return value if value < 2 ** 63 else str(value)
+    if isinstance(value, bytes):
+        return "0x" + value.hex()
+    if isinstance(value, (list, tuple, dict)):
+        return json.dumps(value, default=str)
+    return value
+
+
+class Stream:
+    """
+    Logs of one filter, decoded by their event ABIs.
+    Logs sharing the signature with another layout (e.g. ERC721 Transfer with indexed tokenId) are skipped.
+    """
+
+    def __init__(self, name: str, filters: list[dict], event_abis: list[dict]):
+        """
+        @param name Stream name, table prefix
+        @param filters eth_getLogs filters without block range
+        @param event_abis ABIs of events to keep
+        """
+        self.name = name
+        self.filters = filters
+        self.contract = Web3().eth.contract(abi=event_abis)
+        self.events = {}  # topic: (event name, event, number of topics)
+        for abi in event_abis:
+            signature = f"{abi['name']}({','.join(i['type'] for i in abi['inputs'])})"
+            n_topics = 1 + sum(i["indexed"] for i in abi["inputs"])
+            self.events[bytes(Web3.keccak(text=signature))] = (abi["name"], self.contract.events[abi["name"]](), n_topics)
+        self.columns = {abi["name"]: [i["name"] for i in abi["inputs"]] for abi in event_abis}
+
+    def table(self, event: str) -> str:
+        return f"{self.name}_{event}"
+
+    def decode(self, log) -> tuple[str, dict] | None:
+        if not log["topics"] or bytes(log["topics"][0]) not in self.events:
+            return None
+        event_name, event, n_topics = self.events[bytes(log["topics"][0])]
+        if len(log["topics"]) != n_topics:
+            return None
+        try:
+            return event_name, event.process_log(log)["args"]
+        except (MismatchedABI, DecodingError) as e:
+            print(f"Skipping {event_name} log at block {log['blockNumber']}:{log['logIndex']}", repr(e))
+            return None
+
+
+class EventIndexer:
+    """
+    Syncs streams of logs into SQLite, table per event with a column per argument.
+    Block ranges are adapted: halved when the node refuses a range, doubled back after successes.
+    Each stream keeps a checkpoint with block hash; if the hash changed the last `reorg_depth` blocks are re-indexed.
+    """
+
+    def __init__(self, web3, path="fee_keeper/cache/events.db", reorg_depth=64, chunk=10_000, max_chunk=100_000):
+        self.web3 = web3
+        self.reorg_depth = reorg_depth
+        self.chunk = chunk
+        self.max_chunk = max_chunk
+        self.streams = []
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS checkpoints (stream TEXT PRIMARY KEY, block INTEGER, hash TEXT)")
+
+    def add_stream(self, stream: Stream):
+        self.streams.append(stream)
+        for event, columns in stream.columns.items():
+            args = "".join(f', "{column}"' for column in columns)
+            self.db.execute(
+                f'CREATE TABLE IF NOT EXISTS "{stream.table(event)}" '
+                f'(block_number INTEGER, log_index INTEGER, tx_hash TEXT, address TEXT{args}, '
+                f'PRIMARY KEY (block_number, log_index))'
+            )
+        self.db.commit()
+
+    def add_contract(self, name: str, address: str, abi: list, events: list[str]):
+        event_abis = [abi_item for abi_item in abi if abi_item["type"] == "event" and abi_item["name"] in events]
+        self.add_stream(Stream(name, [{"address": Web3.to_checksum_address(address)}], event_abis))
+
+    def add_transfers(self, name: str, holder: str):
+        """ERC20 transfers of any token into and out of `holder`"""
+        topic = "0x" + holder.lower()[2:].rjust(64, "0")
+        transfer = "0x" + bytes(Web3.keccak(text="Transfer(address,address,uint256)")).hex()
+        self.add_stream(Stream(name, [{"topics": [transfer, topic]}, {"topics": [transfer, None, topic]}], [TRANSFER_ABI]))
+
+    def checkpoint(self, stream: Stream) -> tuple[int, str] | None:
+        return self.db.execute("SELECT block, hash FROM checkpoints WHERE stream = ?", (stream.name,)).fetchone()
+
+    def _block_hash(self, number: int) -> str:
+        return "0x" + bytes(self.web3.eth.get_block(number)["hash"]).hex()
+
+    def _rollback(self, stream: Stream, block: int):
+        """Remove everything after `block`"""
+        for event in stream.columns:
+            self.db.execute(f'DELETE FROM "{stream.table(event)}" WHERE block_number > ?', (block,))
+        self.db.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)", (stream.name, block, self._block_hash(block)))
+        self.db.commit()
+
+    def _get_logs(self, stream: Stream, from_block: int, to_block: int) -> list:
+        logs = []
+        for log_filter in stream.filters:
+            logs += self.web3.eth.get_logs({**log_filter, "fromBlock": from_block, "toBlock": to_block})
+        return logs
+
+    def _store(self, stream: Stream, logs: list, to_block: int):
+        """Write logs and move checkpoint in one transaction"""
+        with self.db:
+            for log in logs:
+                decoded = stream.decode(log)
+                if decoded is None:
+                    continue
+                event, args = decoded
+                columns = stream.columns[event]
+                self.db.execute(
+                    f'INSERT OR REPLACE INTO "{stream.table(event)}" VALUES (?, ?, ?, ?{", ?" * len(columns)})',
+                    (log["blockNumber"], log["logIndex"], "0x" + bytes(log["transactionHash"]).hex(), log["address"],
+                     *[_column(args[column]) for column in columns]),
+                )
+            self.db.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)",
+                            (stream.name, to_block, self._block_hash(to_block)))
+
+    def sync_stream(self, stream: Stream, start_block: int, to_block: int):
+        checkpoint = self.checkpoint(stream)
+        if checkpoint is not None:
+            block, block_hash = checkpoint
+            if self._block_hash(block) != block_hash:
+                print(f"{stream.name}: reorg at {block}, rolling back {self.reorg_depth} blocks")
+                self._rollback(stream, block - self.reorg_depth)
+                block = block - self.reorg_depth
+            from_block = block + 1
+        else:
+            from_block = start_block
+
+        chunk = self.chunk
+        while from_block <= to_block:
+            till_block = min(from_block + chunk - 1, to_block)
+            try:
+                logs = self._get_logs(stream, from_block, till_block)
+            except Exception as e:
+                if chunk > 1 and any(message in str(e).lower() for message in TOO_MANY_RESULTS):
+                    chunk //= 2
+                    continue
+                raise
+            self._store(stream, logs, till_block)
+            print(f"{stream.name}: [{from_block}, {till_block}] {len(logs)} logs")
+            from_block = till_block + 1
+            chunk = min(2 * chunk, self.max_chunk)
+
+    def sync(self, start_block: int, to_block: int = None) -> int:
+        """
+        @param start_block Block to start streams without checkpoint from
+        @param to_block Last block to index, head by default
+        @return Last indexed block
+        """
+        to_block = to_block if to_block is not None else self.web3.eth.block_number
+        for stream in self.streams:
+            self.sync_stream(stream, start_block, to_block)
+        return to_block
+
+
+if __name__ == "__main__":
+    chain, start_block = sys.argv[1], int(sys.argv[2])
+    rpc = {
+        "ethereum": "http://localhost:8545",
+        "gnosis": "https://rpc.gnosischain.com",
+    }[chain]
+    with open("deployments.json", "r") as f:
+        deployments = json.load(f)[chain]
+
+    indexer = EventIndexer(Web3(Web3.HTTPProvider(rpc)), f"fee_keeper/cache/events_{chain}.db")
+    for name, source in CONTRACTS.items():
+        indexer.add_contract(name, deployments[name], load_abi(source), EVENTS[name])
+    indexer.add_transfers("FeeCollectorTransfers", deployments["FeeCollector"])
+    while True:
+        indexer.sync(start_block)
+        time.sleep(60)
@@ -0,0 +1,275 @@
+"""
+Integer-exact model of FeeCollector, DutchAuctionBurner and Hooker math.
+Reproduces contracts' view functions without RPC calls, so keeper can evaluate what-if timestamps offline.
+Functions reproduce reverts with ValueError.
+
+Usage:
+    fee_collector = FeeCollectorModel(max_fee={EPOCH["COLLECT"]: 2 * 10 ** 16, EPOCH["FORWARD"]: 10 ** 16})
+    fee_collector.fees(EPOCH["COLLECT"], range(start, end, 12))
+"""
+START_TIME = 1600300800
+WEEK = 7 * 24 * 3600
+ONE = 10 ** 18
+EPOCH = {  # FeeCollector.Epoch
+    "SLEEP": 1,
+    "COLLECT": 2,
+    "EXCHANGE": 4,
+    "FORWARD": 8,
+}
+EPOCH_TIMESTAMPS = [
+    0, 0,  # 1
+    4 * 24 * 3600,  # 2
+    0, 5 * 24 * 3600,   # 4
+    0, 0, 0, 6 * 24 * 3600,  # 8
+    0, 0, 0, 0, 0, 0, 0, WEEK,  # 16, next period
+]
+
+_UINT256 = 2 ** 256
+_INT256_MIN = -2 ** 255
+
+
+def _uint256(x: int) -> int:
+    if not 0 <= x < _UINT256:
+        raise ValueError("uint256 overflow")
+    return x
+
+
+def _wrap_int256(x: int) -> int:
+    """Two's complement wrap of unsafe_* int256 math"""
+    return (x - _INT256_MIN) % _UINT256 + _INT256_MIN
+
+
+def _sdiv(a: int, b: int) -> int:
+    """EVM SDIV, rounds towards zero"""
+    q = abs(a) // abs(b)
+    return _wrap_int256(q if (a < 0) == (b < 0) else -q)
+
+
+def wad_exp(x: int) -> int:
+    """DutchAuctionBurner._wad_exp (snekmate)"""
+    if x <= -41_446_531_673_892_822_313:
+        return 0
+    if x >= 135_305_999_368_893_231_589:
+        raise ValueError("Math: wad_exp overflow")
+
+    value = _sdiv(_wrap_int256(x << 78), 5 ** 18)
+    k = _wrap_int256(_sdiv(_wrap_int256(value << 96), 54_916_777_467_707_473_351_141_471_128) + 2 ** 95) >> 96
+    value = _wrap_int256(value - k * 54_916_777_467_707_473_351_141_471_128)
+
+    y = _wrap_int256(_wrap_int256(_wrap_int256(value + 1_346_386_616_545_796_478_920_950_773_328) * value) >> 96)
+    y = _wrap_int256(y + 57_155_421_227_552_351_082_224_309_758_442)
+    p = _wrap_int256(_wrap_int256(y + value) - 94_201_549_194_550_492_254_356_042_504_812)
+    p = _wrap_int256(_wrap_int256(p * y) >> 96)
+    p = _wrap_int256(p + 28_719_021_644_029_726_153_956_944_680_412_240)
+    p = _wrap_int256(_wrap_int256(p * value) + (4_385_272_521_454_847_904_659_076_985_693_276 << 96))
+
+    q = _wrap_int256(_wrap_int256(value - 2_855_989_394_907_223_263_936_484_059_900) * value) >> 96
+    q = _wrap_int256(q + 50_020_603_652_535_783_019_961_831_881_945)
+    q = _wrap_int256(_wrap_int256(_wrap_int256(q * value) >> 96) - 533_845_033_583_426_703_283_633_433_725_380)
+    q = _wrap_int256(_wrap_int256(_wrap_int256(q * value) >> 96) + 3_604_857_256_930_695_427_073_651_918_091_429)
+    q = _wrap_int256(_wrap_int256(_wrap_int256(q * value) >> 96) - 14_423_608_567_350_463_180_887_372_962_807_573)
+    q = _wrap_int256(_wrap_int256(_wrap_int256(q * value) >> 96) + 26_449_188_498_355_588_339_934_803_723_976_023)
+
+    r = _sdiv(p, q)
+    result = ((r % _UINT256) * 3_822_833_074_963_236_453_042_738_258_902_158_003_155_416_615_667 % _UINT256) >>\
+        ((195 - k) % _UINT256)
+    if result >= 2 ** 255:
+        raise ValueError("int256 overflow")
+    return result
+
+
+class FeeCollectorModel:
+    """FeeCollector epochs and keeper fee"""
+
+    def __init__(self, max_fee: dict[int, int]):
+        """
+        @param max_fee {epoch: FeeCollector.max_fee(epoch)}
+        """
+        self.max_fee = max_fee
+
+    @staticmethod
+    def epoch(ts: int) -> int:
+        ts = _uint256(ts - START_TIME) % WEEK
+        for epoch in EPOCH.values():
+            if ts < EPOCH_TIMESTAMPS[2 * epoch]:
+                return epoch
+        raise ValueError("unreachable")
+
+    @staticmethod
+    def epoch_time_frame(epoch: int, ts: int) -> (int, int):
+        if epoch <= 0 or epoch & (epoch - 1) != 0:
+            raise ValueError("Bad Epoch")
+        ts = ts - _uint256(ts - START_TIME) % WEEK
+        return ts + EPOCH_TIMESTAMPS[epoch], ts + EPOCH_TIMESTAMPS[2 * epoch]
+
+    def fee(self, epoch: int, ts: int) -> int:
+        """
+        @param epoch Epoch to count fee for, current at `ts` if 0
+        """
+        if epoch == 0:
+            epoch = self.epoch(ts)
+        start, end = self.epoch_time_frame(epoch, ts)
+        if ts >= end:
+            return 0
+        return self.max_fee.get(epoch, 0) * _uint256(ts + 1 - start) // (end - start)
+
+    def fees(self, epoch: int, timestamps) -> list[int]:
+        return [self.fee(epoch, ts) for ts in timestamps]
+
+
+class DutchAuctionBurnerModel:
+    """
+    DutchAuctionBurner prices.
+    Price records are in the contract layout: ((prev_exchange, prev_target), (cur_exchange, cur_target), cur_week)
+    """
+
+    def __init__(self, target_threshold: int, max_price_amplifier: int, records_smoothing: int,
+                 records: dict = None, base: int = 2718281828459045235, ln_base: int = ONE):
+        self.target_threshold = target_threshold
+        self.max_price_amplifier = max_price_amplifier
+        self.records_smoothing = records_smoothing
+        self.records = records or {}
+        self.base = base
+        self.ln_base = ln_base
+
+    def get_price_record(self, coin: str, week: int) -> tuple:
+        (prev_exchange, prev_target), (cur_exchange, cur_target), cur_week = \
+            self.records.get(coin, ((0, 0), (0, 0), 0))
+        if cur_week < week:
+            if week - cur_week > 4:
+                prev_exchange, prev_target = cur_exchange, cur_target
+            else:
+                prev_exchange += cur_exchange
+                prev_target += cur_target
+                for _ in range(week - cur_week):
+                    prev_exchange = prev_exchange * self.records_smoothing // ONE
+                    prev_target = prev_target * self.records_smoothing // ONE
+            cur_exchange, cur_target, cur_week = 0, 0, week
+        return (prev_exchange, prev_target), (cur_exchange, cur_target), cur_week
+
+    @staticmethod
+    def low(current_amount: int, target_amount: int, price_record: tuple) -> int:
+        (prev_exchange, prev_target), (cur_exchange, cur_target), _ = price_record
+        a = current_amount + prev_exchange + cur_exchange
+        if a == 0:
+            raise ValueError("division by zero")
+        return _uint256((target_amount + prev_target + cur_target) * ONE) // a
+
+    def time_amplifier(self, ts: int) -> int:
+        start, end = FeeCollectorModel.epoch_time_frame(EPOCH["EXCHANGE"], ts)
+        if not start <= ts < end:
+            raise ValueError("Bad time")
+        exp = wad_exp((end - ts) * self.ln_base // (end - start))
+        return _uint256(exp - ONE) * ONE // (self.base - ONE)
+
+    def _price(self, low_price: int, time_amplifier: int) -> int:
+        return _uint256(low_price + _uint256(_uint256(self.max_price_amplifier * low_price) * time_amplifier) // ONE)
+
+    def price(self, coin: str, balance: int, ts: int) -> int:
+        """
+        @param coin Coin to get price of
+        @param balance coin.balanceOf(fee_collector)
+        @param ts Timestamp at which to count price
+        """
+        return self._price(
+            self.low(balance, self.target_threshold, self.get_price_record(coin, ts // WEEK)),
+            self.time_amplifier(ts),
+        )
+
+    def prices(self, coins: list[str], balances: list[int], timestamps) -> list[list[int]]:
+        """
+        Prices of all coins at all timestamps, [ts][coin].
+        Time amplifier is computed once per timestamp and lowest prices once per week.
+        """
+        lows = {}
+        result = []
+        for ts in timestamps:
+            week = ts // WEEK
+            if week not in lows:
+                lows[week] = [self.low(balance, self.target_threshold, self.get_price_record(coin, week))
+                              for coin, balance in zip(coins, balances)]
+            time_amplifier = self.time_amplifier(ts)
+            result.append([self._price(low, time_amplifier) for low in lows[week]])
+        return result
+
+
+class HookerModel:
+    """
+    Hooker compensations.
+    Compensation strategies are in the contract layout: (amount, (duty_counter, used, limit), start, end, dutch)
+    """
+
+    def __init__(self, strategies: list[tuple], duty_counter: int, duties_checklist: int = 0):
+        """
+        @param strategies `compensation_strategy` of each hook by id
+        @param duty_counter Hooker.duty_counter
+        @param duties_checklist Mask of duty hooks
+        """
+        self.strategies = strategies
+        self.duty_counter = duty_counter
+        self.duties_checklist = duties_checklist
+
+    @classmethod
+    def from_hooks(cls, hooks: list[tuple], duty_counter: int):
+        """
+        @param hooks Hooks in the contract layout: (to, foreplay, compensation_strategy, duty)
+        """
+        return cls(
+            [hook[2] for hook in hooks],
+            duty_counter,
+            sum(1 << i for i, hook in enumerate(hooks) if hook[3]),
+        )
+
+    def _compensate(self, strategy: tuple, ts: int, num: int) -> int:
+        amount, (duty_counter, used, limit), start, end, dutch = strategy
+        if amount == 0 or self.duty_counter < duty_counter or used + num > limit:
+            return 0
+
+        ts = _uint256(ts - START_TIME) % WEEK
+        if ts < start:
+            ts += WEEK
+        if end <= start:
+            end += WEEK
+        if end <= ts:  # out of bound
+            return 0
+
+        if dutch:
+            return amount * (ts - start) // (end - start)
+        return amount
+
+    def calc_compensation(self, hook_ids: list[int], duty: bool, ts: int) -> int:
+        """
+        @param hook_ids Ids of hooks to act, sorted
+        @param duty Whether act is through fee_collector
+        @param ts Timestamp at which to calculate compensations
+        """
+        current_duty_counter = self.duty_counter
+        if duty:
+            hook_mask = 0
+            for hook_id in hook_ids:
+                hook_mask |= 1 << hook_id
+            if hook_mask & self.duties_checklist != self.duties_checklist:
+                raise ValueError("Not all duties")
+
+            start, end = FeeCollectorModel.epoch_time_frame(EPOCH["FORWARD"], ts)
+            if start <= ts < end:
+                current_duty_counter = _uint256(ts - START_TIME) // WEEK
+
+        compensation = 0
+        prev_idx = 0
+        num = 0
+        for hook_id in hook_ids:
+            if prev_idx > hook_id:
+                raise ValueError("Hooks not sorted")
+            num = num + 1 if prev_idx == hook_id else 1
+
+            strategy = self.strategies[hook_id]
+            amount, (duty_counter, used, limit), start, end, dutch = strategy
+            if duty_counter < current_duty_counter:
+                strategy = (amount, (duty_counter, 0, limit), start, end, dutch)
+            compensation += self._compensate(strategy, ts, num)
+            prev_idx = hook_id
+        return compensation
+
+    def calc_compensations(self, hook_ids: list[int], duty: bool, timestamps) -> list[int]:
+        return [self.calc_compensation(hook_ids, duty, ts) for ts in timestamps]
@@ -0,0 +1,282 @@
+"""
+RPC helpers for keeper scripts.
+"""
+import asyncio
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+import aiohttp
+from web3 import AsyncHTTPProvider
+
+
+class BlockCache:
+    """
+    Read cache for web3 middleware pinned to block number.
+    `eth_call`, `eth_getBalance` and `eth_getTransactionCount` results are keyed by (block, method, to, calldata),
+    requests at "latest" are resolved to the last seen block and sent pinned to it. Bounded LRU, outdated blocks are evicted on new block.
+    Head is pushed by a `BlockSource`; `eth_blockNumber` is asked only for "latest" reads when no head was pushed lately,
+    once for all concurrent reads.
+    Thread-safe, so the head may be set from a `BlockSource` thread while the event loop reads.
+
+    Usage:
+        cache = BlockCache()
+        web3.middleware_onion.add(cache.middleware, "block_cache")  # or cache.async_middleware for AsyncHTTPProvider
+        block_source.on_head(lambda header: cache.set_head(header["number"], pushed=True))
+        ...
+        print(cache.stats())
+    """
+    METHODS = ["eth_call", "eth_getBalance", "eth_getTransactionCount"]
+
+    def __init__(self, max_size=100_000, head_ttl=1., pushed_head_ttl=60.):
+        """
+        @param max_size Maximum number of cached responses
+        @param head_ttl Seconds to trust last seen block before asking `eth_blockNumber`
+        @param pushed_head_ttl Seconds to trust pushed heads, `eth_blockNumber` is used if they stop coming
+        """
+        self.max_size = max_size
+        self.head_ttl = head_ttl
+        self.pushed_head_ttl = pushed_head_ttl
+        self.head = None
+        self.head_ts = 0.
+        self.pushed_ts = 0.
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refresh = None  # eth_blockNumber in flight of async middleware
+        self.hits, self.misses, self.evictions, self.head_requests = 0, 0, 0, 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return f"RPC cache: {self.hits}/{total} hits ({self.hits / max(total, 1):.0%}), " \
+               f"{self.evictions} evicted, {self.head_requests} eth_blockNumber"
+
+    def set_head(self, block_number, pushed=False):
+        """
+        @param pushed Head comes from a block source, not a response passing by
+        """
+        with self._lock:
+            self.head_ts = time.time()
+            if pushed:
+                self.pushed_ts = self.head_ts
+            if self.head is not None and block_number <= self.head:
+                return
+            self.head = block_number
+            outdated = [key for key in self._cache if key[0] < block_number]
+            for key in outdated:
+                del self._cache[key]
+            self.evictions += len(outdated)
+
+    def _observe(self, method, params, response):
+        """Track head from responses passing by"""
+        result = response.get("result")
+        if result is None:
+            return
+        if method == "eth_blockNumber":
+            self.set_head(int(result, 16) if isinstance(result, str) else result)
+        elif method == "eth_getBlockByNumber" and params and params[0] == "latest":
+            number = result["number"]
+            self.set_head(int(number, 16) if isinstance(number, str) else number)
+
+    def _key(self, method, params):
+        """Key at resolved block or None if not cacheable"""
+        if method not in self.METHODS:
+            return None
+        target, block = (params[0], params[1] if len(params) > 1 else "latest")
+        if block == "latest":
+            block = self.head
+        elif isinstance(block, str) and block.startswith("0x"):
+            block = int(block, 16)
+        elif not isinstance(block, int):
+            return None  # pending, safe, finalized
+        if isinstance(target, dict):
+            return block, method, (target.get("to") or "").lower(), target.get("data") or target.get("input"),\
+                (target.get("from") or "").lower()
+        return block, method, target.lower(), None, None
+
+    @staticmethod
+    def _pin(params, key):
+        """Request at the block of `key`, so the response matches the key it is cached under"""
+        if len(params) > 1 and params[1] != "latest":
+            return params
+        return [params[0], hex(key[0]), *params[2:]]
+
+    def _get(self, key):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+            self.misses += 1
+            return None
+
+    def _put(self, key, response):
+        if "error" in response:
+            return
+        with self._lock:
+            if self.head is not None and key[0] < self.head:
+                return  # head moved on while requesting
+            self._cache[key] = response
+            if len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+
+    def _head_outdated(self, method=None, params=None):
+        """Head is needed to resolve the request and is not trusted anymore"""
+        if method is not None and (method not in self.METHODS or (len(params) > 1 and params[1] != "latest")):
+            return False
+        now = time.time()
+        return now > self.head_ts + self.head_ttl and now > self.pushed_ts + self.pushed_head_ttl
+
+    def _refresh_head(self, make_request):
+        with self._refresh_lock:
+            if self._head_outdated():  # not refreshed by another thread meanwhile
+                self.head_requests += 1
+                self._observe("eth_blockNumber", [], make_request("eth_blockNumber", []))
+
+    async def _async_refresh_head(self, make_request):
+        if self._refresh is None:
+            self.head_requests += 1
+            self._refresh = asyncio.ensure_future(make_request("eth_blockNumber", []))
+            self._refresh.add_done_callback(lambda _: setattr(self, "_refresh", None))
+        self._observe("eth_blockNumber", [], await asyncio.shield(self._refresh))
+
+    def middleware(self, make_request, w3):
+        def inner(method, params):
+            if self._head_outdated(method, params):
+                self._refresh_head(make_request)
+            key = self._key(method, params)
+            if key is not None and key[0] is not None:
+                if (response := self._get(key)) is not None:
+                    return response
+            if key is not None and key[0] is not None:
+                params = self._pin(params, key)
+            response = make_request(method, params)
+            self._observe(method, params, response)
+            if key is not None and key[0] is not None:
+                self._put(key, response)
+            return response
+        return inner
+
+    async def async_middleware(self, make_request, w3):
+        async def inner(method, params):
+            if self._head_outdated(method, params):
+                await self._async_refresh_head(make_request)
+            key = self._key(method, params)
+            if key is not None and key[0] is not None:
+                if (response := self._get(key)) is not None:
+                    return response
+            if key is not None and key[0] is not None:
+                params = self._pin(params, key)
+            response = await make_request(method, params)
+            self._observe(method, params, response)
+            if key is not None and key[0] is not None:
+                self._put(key, response)
+            return response
+        return inner
+
+
+class BatchingAsyncHTTPProvider(AsyncHTTPProvider):
+    """
+    Coalesce requests issued within a short window into JSON-RPC batches.
+    Requests missing from the batch response or rejected as a whole are retried one by one.
+
+    Usage:
+        web3 = Web3(provider=BatchingAsyncHTTPProvider(RPC, {"verify_ssl": False}, max_batch_size=200), ...)
+        ...
+        await web3.provider.close()
+    """
+    BATCH_METHODS = ["eth_call", "eth_getBalance"]
+    RETRY_ERROR_CODES = [-32600, -32005]  # invalid request (batch not supported), limit exceeded
+
+    def __init__(self, endpoint_uri=None, request_kwargs=None, max_batch_size=100, window=0.005, **kwargs):
+        """
+        @param max_batch_size Maximum number of requests in one HTTP request
+        @param window Seconds to wait for other requests before sending a batch
+        """
+        super().__init__(endpoint_uri, request_kwargs, **kwargs)
+        self.max_batch_size = max_batch_size
+        self.window = window
+        self._pending = []  # [(request, future)]
+        self._flush_handle = None
+        self._tasks = set()  # batches in flight, referenced so they are not garbage collected
+        self._ids = itertools.count()
+        self._session = None
+        self.batches, self.fallbacks = 0, 0
+
+    async def make_request(self, method, params):
+        if method not in self.BATCH_METHODS:
+            return await super().make_request(method, params)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        request = {"jsonrpc": "2.0", "id": next(self._ids), "method": method, "params": params}
+        self._pending.append((request, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        while self._pending:
+            batch, self._pending = self._pending[:self.max_batch_size], self._pending[self.max_batch_size:]
+            task = asyncio.ensure_future(self._send_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def close(self):
+        """Wait for batches in flight and close the session"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _post_batch(self, requests):
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        # request kwargs include headers
+        async with self._session.post(self.endpoint_uri, json=requests, **dict(self.get_request_kwargs())) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def _send_single(self, request, future):
+        self.fallbacks += 1
+        try:
+            response = await AsyncHTTPProvider.make_request(self, request["method"], request["params"])
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():  # caller might have been cancelled meanwhile
+            future.set_result(response)
+
+    async def _send_batch(self, batch):
+        batch = [(request, future) for request, future in batch if not future.done()]  # skip cancelled callers
+        if not batch:
+            return
+        self.batches += 1
+        try:
+            responses = await self._post_batch([request for request, _ in batch])
+        except Exception as e:
+            print(f"Batch of {len(batch)} failed, falling back to single requests", repr(e))
+            responses = []
+        if not isinstance(responses, list):  # whole batch rejected
+            responses = []
+        by_id = {response.get("id"): response for response in responses if isinstance(response, dict)}
+
+        retries = []
+        for request, future in batch:
+            response = by_id.get(request["id"])
+            if future.done():
+                continue
+            if response is None or response.get("error", {}).get("code") in self.RETRY_ERROR_CODES:
+                retries.append(self._send_single(request, future))
+            else:
+                future.set_result(response)
+        await asyncio.gather(*retries)
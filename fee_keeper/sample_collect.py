@@ -2,20 +2,36 @@ import asyncio
 import os
 import json
 import time
-import requests
 
+import numpy as np
 from web3 import Web3
 from web3.eth import AsyncEth
 from web3.middleware import geth_poa_middleware
 from getpass import getpass
 from eth_account import account
 
+from balances import BalanceReader
+from blocks import BlockSource
+from bundles import BundleSubmitter
+from curve_api import CURVE_API, coin_usd_price, get_pool_data, fetch_pool_data
+from events import IncrementalTally
+from draft.fee_oracle import FeeOracle
+from gas_model import GasModel
+from draft.nonce_manager import NonceManager
+from rpc import BatchingAsyncHTTPProvider, BlockCache
+from schedule import BreakEvenScheduler, FEE_COLLECTOR_ABI
+from simulate import BundleSimulator, SimCall, intrinsic_gas
+
 
 chain = "ethereum"  # ethereum|xdai
 RPC = {
     "ethereum": f"http://localhost:8545",
     "xdai": f"https://rpc.gnosischain.com",
 }
+RPC_WS = {  # newHeads subscription, polling if not set
+    "ethereum": "ws://localhost:8546",
+    "xdai": None,
+}
 ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
 ETH_ADDRESS = "0xEeeeeEeeeEeEeeEeEeEeeEEEeeeeEeeeeeeeEEeE"
 CRVUSD = {
@@ -38,6 +54,25 @@ EXTREME_AMOUNT = {  # basically CoWBurner target_threshold
     "ethereum": 400,
     "xdai": 1,
 }[chain]
+BLOCK_TIME = {
+    "ethereum": 12,
+    "xdai": 5,
+}[chain]
+WRAPPED_NATIVE = {
+    "ethereum": "0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2",
+    "xdai": "0xe91D153E0b41518A2Ce8Dd3D7944Fa863463a97d",
+}[chain]
+SOURCE_GAS = 850_000  # conservative gas per source, ~30 USD at 10 gwei and 3500 USD/ETH
+MAX_SLEEP = 5 * 60  # refresh accrued amounts at least this often
+WARM_UP = 10 * 60  # start preparing this long before the epoch
+MULTICALL = "0xcA11bde05977b3631167028862bE2a173976CA11"
+FOLD_CALLS = True  # collect-phase calls in one aggregate3 tx, proxy calls stay separate
+FOLD_GAS_SHARE = 0.5  # of block gas limit a folded tx may take, split into more txs above
+FOLD_CALL_GAS = 5_000  # aggregate3 overhead per call
+CHUNK_GAS = 5_000_000  # gas target of one withdraw_many/burn_many/collect call
+PROXY_MAX_LEN = 20  # address[20] of proxy withdraw_many/burn_many
+COLLECT_MAX_LEN = 64  # FeeCollector MAX_LEN
+FORK_KEEP_BLOCKS = 300  # fork snapshots kept for re-runs, ~1 hour, older ones are pruned
 
 web3 = Web3(
     provider=Web3.HTTPProvider(
@@ -46,12 +81,18 @@ web3 = Web3(
 )
 if chain == "xdai":
     web3.middleware_onion.inject(geth_poa_middleware, layer=0)
+rpc_cache = BlockCache()  # reads of the same block are shared by both providers
+web3.middleware_onion.add(rpc_cache.middleware, "block_cache")
+block_source = BlockSource(web3, BLOCK_TIME, RPC_WS[chain])
+block_source.on_head(lambda header: rpc_cache.set_head(header["number"], pushed=True))
+fee_oracle = FeeOracle(web3, lambda: coin_usd_price(chain, WRAPPED_NATIVE), {"source": SOURCE_GAS}, max_age=BLOCK_TIME)
 
 class DataFetcher:
     web3 = Web3(
-        provider=Web3.AsyncHTTPProvider(
+        provider=BatchingAsyncHTTPProvider(
             RPC[chain],
             {"verify_ssl": False},
+            max_batch_size=200,  # local node, might be lower for public RPCs
         ),
         modules={"eth": (AsyncEth,)},
     )
@@ -78,10 +119,7 @@ class DataFetcher:
             if not prices.get(coin.lower(), None):
                 prices[coin.lower()] = (price, int(dec))
 
-        response = requests.get(
-            f"https://api.curve.fi/api/getPools/all/{chain}/",
-        ).json()["data"]["poolData"]
-        for pool_dict in response:
+        for pool_dict in get_pool_data(f"{CURVE_API}/getPools/all/{chain}/"):
             for coin, dec in zip(pool_dict["coins"], pool_dict["decimals"]):
                 update_if_not_set(coin["address"], coin["usdPrice"], dec)
             update_if_not_set(pool_dict["lpTokenAddress"], pool_dict["usdTotal"] * (int(pool_dict["virtualPrice"]) / max(int(pool_dict["totalSupply"]), 1)), 18)  # approximation
@@ -94,31 +132,22 @@ class DataFetcher:
 
         self.all_coins = list(set(all_coins) - set(unpriced_coins))
 
-    def balance_of(self, coin, of):
-        of = Web3.to_checksum_address(of)
-        if coin == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee":
-            return self.web3.eth.get_balance(of)
-        contract = self.web3.eth.contract(
-            address=Web3.to_checksum_address(coin),
-            abi=[{"constant": True, "inputs": [{"name": "_owner", "type": "address"}], "name": "balanceOf", "outputs": [{"name": "balance", "type": "uint256"}], "payable": False, "stateMutability": "view", "type": "function"}, ],
-        )
-        return contract.functions.balanceOf(of).call()
+    async def get_balances(self, coins, holders, block="latest"):
+        """Raw balances of coins of every holder, {holder: {coin: amount}}"""
+        balances = BalanceReader.to_float(await balance_reader.read_matrix(self.web3, holders, coins, block))
+        return {holder: dict(zip(coins, row.tolist())) for holder, row in zip(holders, balances)}
 
-    async def get_balances(self, coins, of, _decimals=None):
-        balances = {}
-        for coin in coins:
-            balances[coin] = self.balance_of(coin, of)
-        for coin in coins:
-            price, dec = self.prices.get(coin, (0., 0))
-            balances[coin] = ((await balances[coin]) / (10 ** dec)) * price
-        return balances
+    def to_usd(self, balances):
+        """{coin: raw amount} -> {coin: USD amount}"""
+        coins = list(balances.keys())
+        prices = np.array([self.prices.get(coin, (0., 0))[0] for coin in coins], dtype=np.float64)
+        decimals = np.array([self.prices.get(coin, (0., 0))[1] for coin in coins], dtype=np.float64)
+        amounts = np.array(list(balances.values()), dtype=np.float64) / 10 ** decimals * prices
+        return dict(zip(coins, amounts.tolist()))
 
     def fetch_sources(self):
-        stable_data = []
-        for registry in ["main", "factory", "factory-crvusd"]:  # "factory-stable-ng" should withdraw automatically, may be not all
-            stable_data.extend(requests.get(
-                f"https://api.curve.fi/api/getPools/{chain}/{registry}",
-            ).json().get("data", {}).get("poolData", []))
+        # "factory-stable-ng" should withdraw automatically, may be not all
+        stable_data = fetch_pool_data(chain, ["main", "factory", "factory-crvusd"])
 
         self.stable_pools = []
         for pool_dict in stable_data:
@@ -138,44 +167,98 @@ class DataFetcher:
         # Add crypto pools
 
 
-    async def get_amounts(self):
-        for pool in self.stable_pools:
+    async def get_amounts(self, block):
+        """
+        Tally sources at `block`, re-reading only ones which had logs since the last tallied block
+        """
+        holders = [PROXY, FEE_COLLECTOR]
+        state = incremental_tally.state
+        watched_pools = [pool["address"] for pool in self.stable_pools] + [pool for _, pool in self.peg_keepers]
+        changes = await incremental_tally.changes(self.web3, watched_pools, holders, block)
+        changed_pools, changed_coins = changes if changes is not None else (None, None)
+
+        def pool_changed(pool):
+            return changed_pools is None or pool in changed_pools or pool not in state["pools"]
+
+        to_read = [pool for pool in self.stable_pools if pool_changed(pool["address"])]
+        pairs = [(pool["address"], coin) for pool in to_read for coin in pool["coins"]]
+        pool_balances = asyncio.ensure_future(balance_reader.read_pairs(self.web3, pairs, block))
+        for pool in to_read:
+            pool["balances"] = None
             try:
                 contract = self.web3.eth.contract(
                     address=Web3.to_checksum_address(pool["address"]),
                     abi=[{"name": "balances", "outputs": [{"type": "uint256", "name": ""}], "inputs": [{"type": "uint256", "name": "i"}], "stateMutability": "view", "type": "function", "gas": 5076},] if pool["address"] not in self.I128_BALANCES_LIST else [{"name": "balances", "outputs": [{"type": "uint256", "name": ""}], "inputs": [{"type": "int128", "name": "i"}], "stateMutability": "view", "type": "function", "gas": 5076},],
                 )
-                pool["balances"] = [[self.balance_of(coin, pool["address"]), contract.functions.balances(i).call()] for i, coin in enumerate(pool["coins"])]
+                pool["balances"] = [[None, asyncio.ensure_future(contract.functions.balances(i).call(block_identifier=block))] for i, coin in enumerate(pool["coins"])]
             except Exception as e:
                 print(f"Couldn't get balances for {pool['address']}",  repr(e))
 
-        for pool in self.stable_pools:
-            pool["amount"] = 0
-            for i, bals in enumerate(pool["balances"]):
-                for j in range(len(bals)):
+        try:
+            pool_balances = await pool_balances
+        except BaseException:  # inner reads would be left pending
+            for pool in to_read:
+                for _, inner in pool["balances"] or []:
+                    inner.cancel()
+            raise
+        offset = 0
+        for pool in to_read:
+            failed = pool["balances"] is None
+            for i, bals in enumerate(pool["balances"] or []):
+                bals[0] = pool_balances[offset + i]
+                for j in range(1, len(bals)):
                     try:
                         pool["balances"][i][j] = await pool["balances"][i][j]
                     except Exception as e:
-                        print(f"Couldn't get balances for {pool['address']} {i} {'inner' if j == 1 else 'balanceOf'}", repr(e))
-                        pool["balances"][i][j] = 0
+                        print(f"Couldn't get balances for {pool['address']} {i} inner", repr(e))
+                        failed = True
+            if failed:  # not tallied, so it is re-read next time
+                state["pools"].pop(pool["address"], None)
+            else:
+                state["pools"][pool["address"]] = pool["balances"]
+            offset += len(pool["coins"])
+
+        for pool in self.stable_pools:
+            pool["balances"] = state["pools"].get(pool["address"], [])
+            pool["amount"] = 0
             for coin, (bal, inner_bal) in zip(pool["coins"], pool["balances"]):
                 if coin in self.COINS_BLACKLIST:
                     continue
                 price, dec = self.prices.get(coin, (0., 0))
                 pool["amount"] += ((bal - inner_bal) / 10 ** dec) * price
+        print(f"fetched stable pools amounts: {len(to_read)}/{len(self.stable_pools)} re-read")
 
         pks = []
         for pk, pool in self.peg_keepers:
-            contract = self.web3.eth.contract(address=pk, abi=[{"stateMutability":"view","type":"function","name":"calc_profit","inputs":[],"outputs":[{"name":"","type":"uint256"}]},])
-            pks.append((pk, pool, (await contract.functions.calc_profit().call()) / 10 ** 18))
+            if pool_changed(pool) or pk not in state["pk_profits"]:
+                contract = self.web3.eth.contract(address=pk, abi=[{"stateMutability":"view","type":"function","name":"calc_profit","inputs":[],"outputs":[{"name":"","type":"uint256"}]},])
+                pks.append((pk, asyncio.ensure_future(contract.functions.calc_profit().call(block_identifier=block))))
+        profits = await asyncio.gather(*[profit for _, profit in pks], return_exceptions=True)
+        for (pk, _), profit in zip(pks, profits):
+            if isinstance(profit, BaseException):
+                raise profit
+            state["pk_profits"][pk] = profit
+        pks = [(pk, pool, state["pk_profits"][pk] / 10 ** 18) for pk, pool in self.peg_keepers]
+
+        coins = [
+            coin for coin in self.all_coins
+            if changed_coins is None or coin in changed_coins or coin == ETH_ADDRESS.lower() or
+            any(coin not in state["holders"].get(holder, {}) for holder in holders)
+        ]
+        for holder, balances in (await self.get_balances(coins, holders, block)).items():
+            state["holders"].setdefault(holder, {}).update(balances)
+        proxy_balances, collector_balances = [
+            self.to_usd({coin: state["holders"][holder][coin] for coin in self.all_coins}) for holder in holders
+        ]
+        print(f"fetched proxy and collector balances: {len(coins)}/{len(self.all_coins)} re-read")
+
+        incremental_tally.update(block)
+        return self.stable_pools, proxy_balances, pks, collector_balances
 
-        print(f"fetched stable pools amounts")
-        proxy_balances = await self.get_balances(self.all_coins, PROXY)
-        print(f"fetched proxy balances")
-        collector_balances = await self.get_balances(self.all_coins, FEE_COLLECTOR)
-        print(f"fetched collector balances")
 
-        return self.stable_pools, proxy_balances, pks, collector_balances
+DataFetcher.web3.middleware_onion.add(rpc_cache.async_middleware, "block_cache")
+balance_reader = BalanceReader()
+incremental_tally = IncrementalTally(f"fee_keeper/cache/incremental_tally_{chain}.json")
 
 
 def account_load_pkey(fname):
@@ -193,248 +276,420 @@ BUILDERS = [
     "https://rsync-builder.xyz",
     "https://relay.flashbots.net",
 ]
-
-
-def collect_l1(withdraw_proxy, burn, withdraw_fc, pk_profit, collect, iters=5):
+bundle_submitter = BundleSubmitter(BUILDERS)
+simulator = BundleSimulator(RPC[chain], wallet_address, RECEIVER, BLOCK_TIME, keep_blocks=FORK_KEEP_BLOCKS)
+gas_model = GasModel(f"fee_keeper/cache/gas_model_{chain}.json")
+nonce_manager = NonceManager(web3, wallet_pk, fee_oracle.fees)
+
+
+def collect_l1(withdraw_proxy, burn, withdraw_fc, pk_profit, collect, iters=5, fold=FOLD_CALLS):
+    """
+    @param iters Number of blocks to keep the bundle submitted for
+    @param fold Fold calls into aggregate3 txs, see `fold_calls`
+    @return Bundle got included
+    """
+    bundle = prepare_l1(withdraw_proxy, burn, withdraw_fc, pk_profit, collect, fold=fold)
+    if not bundle:
+        return False
+    return submit_l1(bundle, iters)
+
+
+def prepare_l1(withdraw_proxy, burn, withdraw_fc, pk_profit, collect, ts=None, fold=FOLD_CALLS):
+    """
+    Simulate, price and sign collect bundle
+    @param ts Timestamp of the block to simulate in, the pending block by default
+    @param fold Fold calls into aggregate3 txs, see `fold_calls`
+    @return (signed txs, wallet nonce after inclusion, (label, items) of each tx), None if nothing to send
+    """
     # multicall = web3.eth.contract("0xcA11bde05977b3631167028862bE2a173976CA11", abi=[{"inputs": [{"components": [{"internalType": "address", "name": "target", "type": "address"},{"internalType": "bool", "name": "allowFailure", "type": "bool"},{"internalType": "bytes", "name": "callData", "type": "bytes"}], "internalType": "struct Multicall3.Call3[]","name": "calls","type": "tuple[]"}],"name": "aggregate3", "outputs": [{"components": [{"internalType": "bool", "name": "success", "type": "bool"},{"internalType": "bytes", "name": "returnData", "type": "bytes"}],"internalType": "struct Multicall3.Result[]", "name": "returnData", "type": "tuple[]"}],"stateMutability": "payable","type": "function"}, ])
     fee_collector = web3.eth.contract(FEE_COLLECTOR, abi=[
         {"stateMutability":"nonpayable", "type": "function", "name": "withdraw_many", "inputs": [{"name": "_pools", "type": "address[]"}], "outputs": []},
         {"stateMutability":"nonpayable","type":"function","name":"collect","inputs":[{"name":"_coins","type":"address[]"},{"name":"_receiver","type":"address"}],"outputs":[]},], )
 
-    nonce = web3.eth.get_transaction_count(wallet_address)
-    max_fee = 20 * 10 ** 9  # even 10 GWEI should be enough for Wednesday morning
-    max_priority = 2 * 10 ** 9 + 10 ** 8
+    proxy = web3.eth.contract(PROXY, abi=[
+        {"name":"withdraw_many","outputs":[],"inputs":[{"type":"address[20]","name":"_pools"}],"stateMutability":"nonpayable","type":"function","gas":93116},
+        {"name":"burn_many","outputs":[],"inputs":[{"type":"address[20]","name":"_coins"}],"stateMutability":"nonpayable","type":"function","gas":780568},])
 
-    txs = []
+    def encoder(contract, fn_name, *args, pad=None):
+        """Calldata of `fn_name(items, *args)`, items padded with ZERO_ADDRESS to `pad`"""
+        def encode(items):
+            items = items + [ZERO_ADDRESS] * (pad - len(items)) if pad else items
+            return Web3.to_bytes(hexstr=contract.encodeABI(fn_name, [items, *args]))
+        return encode
+
+    calls = []
     if withdraw_proxy:  # proxy.burn() has tx.origin check
         withdraw_proxy = [web3.to_checksum_address(coin) for coin in withdraw_proxy]
-        if len(withdraw_proxy) % 20:
-            withdraw_proxy += [ZERO_ADDRESS] * (20 - (len(withdraw_proxy) % 20))
-        proxy = web3.eth.contract(PROXY, abi=[{"name":"withdraw_many","outputs":[],"inputs":[{"type":"address[20]","name":"_pools"}],"stateMutability":"nonpayable","type":"function","gas":93116},])
-        for i in range(0, len(withdraw_proxy), 20):
-            print("WITHDRAW PROXY", withdraw_proxy[i: i + 20])
-            txs.append(proxy.functions.withdraw_many(withdraw_proxy[i: i + 20]).build_transaction({
-                "from": wallet_address, "nonce": nonce,
-                "maxFeePerGas": max_fee, "maxPriorityFeePerGas": max_priority,
-            }))
-            nonce += 1
-
+        for chunk in gas_model.pack("WITHDRAW PROXY", withdraw_proxy, CHUNK_GAS, PROXY_MAX_LEN):
+            calls.append(SimCall("WITHDRAW PROXY", PROXY, chunk, encoder(proxy, "withdraw_many", pad=PROXY_MAX_LEN)))
     if burn:
         burn = [web3.to_checksum_address(coin) for coin in burn]
-        if len(burn) % 20:
-            burn += [ZERO_ADDRESS] * (20 - (len(burn) % 20))
-        proxy = web3.eth.contract(PROXY, abi=[{"name":"burn_many","outputs":[],"inputs":[{"type":"address[20]","name":"_coins"}],"stateMutability":"nonpayable","type":"function","gas":780568},])
-        for i in range(0, len(burn), 20):
-            print("BURN PROXY", burn[i: i + 20])
-            txs.append(proxy.functions.burn_many(burn[i: i + 20]).build_transaction({
-                "from": wallet_address, "nonce": nonce,
-                "maxFeePerGas": max_fee, "maxPriorityFeePerGas": max_priority,
-            }))
-            nonce += 1
+        for chunk in gas_model.pack("BURN PROXY", burn, CHUNK_GAS, PROXY_MAX_LEN):
+            calls.append(SimCall("BURN PROXY", PROXY, chunk, encoder(proxy, "burn_many", pad=PROXY_MAX_LEN)))
     if withdraw_fc:
         withdraw_fc = [web3.to_checksum_address(coin) for coin in withdraw_fc]
-        print("WITHDRAW FC", withdraw_fc)
-        txs.append(fee_collector.functions.withdraw_many(withdraw_fc).build_transaction({
-            "from": wallet_address, "nonce": nonce,
-            "maxFeePerGas": max_fee, "maxPriorityFeePerGas": max_priority,
-        }))
-        nonce += 1
-
+        calls.append(SimCall("WITHDRAW FC", FEE_COLLECTOR, withdraw_fc, encoder(fee_collector, "withdraw_many")))
     if pk_profit:
         pk_profit = [web3.to_checksum_address(pk) for pk in pk_profit]
-        print("PK PROFIT", pk_profit)
         for pk in pk_profit:
             contract = web3.eth.contract(pk, abi=[{"stateMutability":"nonpayable","type":"function","name":"withdraw_profit","inputs":[],"outputs":[{"name":"","type":"uint256"}]},])
-            txs.append(contract.functions.withdraw_profit().build_transaction({
-                "from": wallet_address, "nonce": nonce,
-                "maxFeePerGas": max_fee, "maxPriorityFeePerGas": max_priority,
-            }))
-            nonce += 1
+            calldata = Web3.to_bytes(hexstr=contract.encodeABI("withdraw_profit"))
+            calls.append(SimCall("PK PROFIT", pk, [pk], lambda _, calldata=calldata: calldata, allow_failure=True))
 
     if ETH_ADDRESS.lower() in collect:
         collect.remove(ETH_ADDRESS.lower())
         if "0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2".lower() not in collect:
             collect.append("0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2".lower())
-    collect = list(sorted(collect, key=lambda coin: int(coin, base=16)))
     collect = [web3.to_checksum_address(coin) for coin in collect]
-    print("COLLECT", collect)
-    for i in range(0, len(collect), 64):
-        txs.append(fee_collector.functions.collect(collect[i: min(i + 64, len(collect))], RECEIVER).build_transaction({
-            "from": wallet_address, "nonce": nonce,
-            "maxFeePerGas": max_fee, "maxPriorityFeePerGas": max_priority,
-        }))
-        nonce += 1
+    for chunk in gas_model.pack("COLLECT", collect, CHUNK_GAS, COLLECT_MAX_LEN):  # sorted within chunks
+        calls.append(SimCall("COLLECT", FEE_COLLECTOR, chunk, encoder(fee_collector, "collect", RECEIVER)))
 
+    # Pre-flight on the pending block: prune reverting items, take gas from simulation
+    latest_block = block_source.latest()
+    simulator.fork(latest_block["number"], (ts - BLOCK_TIME) if ts else latest_block["timestamp"])
     try:
-        for tx in txs:
-            gas_estimate = web3.eth.estimate_gas(tx)
-            tx["gas"] = int(2 * gas_estimate)
+        simulation = simulator.simulate(calls, collect)
+        for call, items, _, gas in simulation["calls"]:
+            gas_model.observe(call.label, items, gas, save=False)
+        gas_model.save()
     except Exception as e:
-        print("Could not estimate gas", repr(e))
+        print("Could not simulate, using gas model", repr(e))
+        simulation = {"calls": [(call, call.items, call.data(), None) for call in calls], "pruned": {}, "fees": {}}
+    for label, items in simulation["pruned"].items():
+        print("PRUNED", label, items)
+    for coin, fee in simulation["fees"].items():
+        if fee > 0:
+            print(f"FEE {coin}: {fee}")
+    if not any(call.label == "COLLECT" for call, _, _, _ in simulation["calls"]):
+        print("Nothing to collect after pruning")
         return
-    signed_txs = [web3.eth.account.sign_transaction(tx, private_key=wallet_pk) for tx in txs]
-    # block = web3.eth.get_block_number()
-    while web3.eth.get_transaction_count(wallet_address) < nonce and iters > 0:
-        block = web3.eth.get_block_number() + 1
-        print(f"Trying block: {block}")
-        for builder in BUILDERS:
-            if "flashbots" in builder:
-                r = requests.post(builder, json={
-                    "jsonrpc": "2.0",
-                    "id": 1,
-                    "method": "eth_sendBundle",
-                    "params": [
-                        {
-                            "version": "v0.1",
-                            "inclusion": {"block": str(hex(block)), "maxBlock": str(hex(block))},
-                            "body": [{"tx": tx.rawTransaction.hex(), "canRevert": True} for tx in signed_txs],
-                        }
-                    ]
-                })
-            else:
-                r = requests.post(builder, json={
-                    "jsonrpc": "2.0",
-                    "id": 1,
-                    "method": "eth_sendBundle",
-                    "params": [
-                        {
-                            "txs": [tx.rawTransaction.hex() for tx in signed_txs],
-                            "blockNumber": str(hex(block)),
-                        }
-                    ]
-                })
-            print(builder, r.json())
-        iters -= 1
-        # block += 1
-        time.sleep(6)  # wait some time between blocks
-    if web3.eth.get_transaction_count(wallet_address) > nonce:
-        print("Go check ur wallet, I dit sth for ya ^&^")
 
+    calls = simulation["calls"]
+    unsimulated = [i for i, (_, _, _, gas) in enumerate(calls) if gas is None]
+    if unsimulated:
+        try:
+            gas_limits = gas_model.gas_limits(
+                web3, [{"from": wallet_address, "to": calls[i][0].to, "data": calls[i][2]} for i in unsimulated],
+                [(calls[i][0].label, calls[i][1]) for i in unsimulated], margin=1.,
+            )
+        except Exception as e:
+            print("Could not estimate gas", repr(e))
+            return
+        for i, gas in zip(unsimulated, gas_limits):
+            calls[i] = (*calls[i][:3], gas)
+    for call, items, _, gas in calls:
+        print(call.label, items, f"gas: {gas}")
+    if fold:
+        bundle = fold_calls(calls, int(FOLD_GAS_SHARE * latest_block["gasLimit"] / 1.2) or None)
+    else:
+        bundle = [(call.to, data, gas, (call.label, items)) for call, items, data, gas in calls]
+
+    nonce = web3.eth.get_transaction_count(wallet_address)
+    fees = fee_oracle.fees()
+    chain_id = web3.eth.chain_id
 
-def collect_l2(withdraw_proxy, burn, withdraw_fc, collect):
+    txs = []
+    for to, data, gas, _ in bundle:
+        txs.append({
+            "from": wallet_address, "to": to, "data": data, "value": 0, "chainId": chain_id, "nonce": nonce,
+            "gas": int(1.2 * gas), **fees,
+        })
+        nonce += 1
+    print(f"Signed {len(txs)} txs for {len(calls)} calls")
+    signed_txs = [web3.eth.account.sign_transaction(tx, private_key=wallet_pk) for tx in txs]
+    return signed_txs, nonce, [op for _, _, _, op in bundle]
+
+
+def submit_l1(bundle, iters=5, first_block=None):
+    """
+    @param bundle Result of `prepare_l1`
+    @param first_block First block bundle is valid in, the next one by default
+    @return Bundle got included
+    """
+    signed_txs, nonce, ops = bundle
+    included = bundle_submitter.submit_until_included(web3, signed_txs, wallet_address, nonce, n_blocks=3,
+                                                      max_blocks=iters, block_source=block_source,
+                                                      first_block=first_block)
+    fee_oracle.record_outcome(included)
+    if included:
+        observe_receipts(signed_txs, ops)
+        print("Go check ur wallet, I dit sth for ya ^&^")
+    return included
+
+
+def fold_calls(calls, max_gas=None):
+    """
+    Fold consecutive calls into Multicall3.aggregate3 txs, so the bundle pays base tx cost, nonce and signature once.
+    Proxy calls have tx.origin check and stay separate txs, a new tx is started when folded gas exceeds `max_gas`.
+    Gas of a folded tx is the sum of its calls' execution gas, an upper bound since storage gets warm across calls.
+    @param calls [(SimCall, items, calldata, gas)] in bundle order, gas includes intrinsic gas
+    @return [(to, calldata, gas, (label, items) or None if folded)]
+    """
+    multicall = web3.eth.contract(MULTICALL, abi=[{"inputs": [{"components": [{"internalType": "address", "name": "target", "type": "address"},{"internalType": "bool", "name": "allowFailure", "type": "bool"},{"internalType": "bytes", "name": "callData", "type": "bytes"}], "internalType": "struct Multicall3.Call3[]","name": "calls","type": "tuple[]"}],"name": "aggregate3", "outputs": [{"components": [{"internalType": "bool", "name": "success", "type": "bool"},{"internalType": "bytes", "name": "returnData", "type": "bytes"}],"internalType": "struct Multicall3.Result[]", "name": "returnData", "type": "tuple[]"}],"stateMutability": "payable","type": "function"}, ])
+
+    def folded(batch):
+        if len(batch) == 1:
+            call, items, data, gas = batch[0]
+            return call.to, data, gas, (call.label, items)
+        data = Web3.to_bytes(hexstr=multicall.encodeABI(
+            "aggregate3", [[(call.to, call.allow_failure, data) for call, _, data, _ in batch]]))
+        gas = sum(gas - intrinsic_gas(data) + FOLD_CALL_GAS for _, _, data, gas in batch) + intrinsic_gas(data)
+        return MULTICALL, data, gas, None
+
+    bundle, batch = [], []
+    for entry in calls:
+        call = entry[0]
+        if call.to == PROXY:
+            if batch:
+                bundle.append(folded(batch))
+            bundle.append(folded([entry]))
+            batch = []
+            continue
+        if batch and max_gas and folded(batch + [entry])[2] > max_gas:
+            bundle.append(folded(batch))
+            batch = []
+        batch.append(entry)
+    if batch:
+        bundle.append(folded(batch))
+    return bundle
+
+
+def observe_receipts(signed_txs, ops):
+    """Teach gas model actual gas used by included transactions"""
+    receipts = []
+    for signed_tx, op in zip(signed_txs, ops):
+        if op is None:  # folded calls, learned from simulation
+            receipts.append(None)
+            continue
+        try:
+            receipts.append(web3.eth.get_transaction_receipt(signed_tx.hash))
+        except Exception as e:
+            print(f"No receipt of {op[0]}: {repr(e)}")
+            receipts.append(None)
+    learn_receipts(receipts, ops)
+
+
+def learn_receipts(receipts, ops):
+    for receipt, op in zip(receipts, ops):
+        if op and receipt and receipt["status"] == 1:
+            gas_model.observe(*op, receipt["gasUsed"], save=False)
+    gas_model.save()
+
+
+async def collect_l2(withdraw_proxy, burn, withdraw_fc, collect):
     # multicall = web3.eth.contract("0xcA11bde05977b3631167028862bE2a173976CA11", abi=[{"inputs": [{"components": [{"internalType": "address", "name": "target", "type": "address"},{"internalType": "bool", "name": "allowFailure", "type": "bool"},{"internalType": "bytes", "name": "callData", "type": "bytes"}], "internalType": "struct Multicall3.Call3[]","name": "calls","type": "tuple[]"}],"name": "aggregate3", "outputs": [{"components": [{"internalType": "bool", "name": "success", "type": "bool"},{"internalType": "bytes", "name": "returnData", "type": "bytes"}],"internalType": "struct Multicall3.Result[]", "name": "returnData", "type": "tuple[]"}],"stateMutability": "payable","type": "function"}, ])
     fee_collector = web3.eth.contract(FEE_COLLECTOR, abi=[
         {"stateMutability":"nonpayable", "type": "function", "name": "withdraw_many", "inputs": [{"name": "_pools", "type": "address[]"}], "outputs": []},
         {"stateMutability":"nonpayable","type":"function","name":"collect","inputs":[{"name":"_coins","type":"address[]"},{"name":"_receiver","type":"address"}],"outputs":[]},], )
 
-    nonce = web3.eth.get_transaction_count(wallet_address)
+    nonce = 0  # assigned by nonce_manager
+    fees = fee_oracle.fees()  # explicit, else build_transaction fills web3 defaults
     # max_fee = 20 * 10 ** 9  # even 10 GWEI should be enough for Wednesday morning
     # max_priority = 2 * 10 ** 9
 
-    txs = []
+    txs, ops = [], []  # ops: (operation, items) of each tx for gas model
     if withdraw_proxy:  # proxy.burn() has tx.origin check
         withdraw_proxy = [web3.to_checksum_address(coin) for coin in withdraw_proxy]
-        if len(withdraw_proxy) % 20:
-            withdraw_proxy += [ZERO_ADDRESS] * (20 - (len(withdraw_proxy) % 20))
         proxy = web3.eth.contract(PROXY, abi=[{"name":"withdraw_many","outputs":[],"inputs":[{"type":"address[20]","name":"_pools"}],"stateMutability":"nonpayable","type":"function","gas":93116},])
-        for i in range(0, len(withdraw_proxy), 20):
-            print("WITHDRAW PROXY", withdraw_proxy[i: i + 20])
-            txs.append(proxy.functions.withdraw_many(withdraw_proxy[i: i + 20]).build_transaction({"from": wallet_address}))
-            txs[-1]["nonce"] = nonce
-            txs[-1]["gas"] = int(1.1 * txs[-1]["gas"])
+        for chunk in gas_model.pack("WITHDRAW PROXY", withdraw_proxy, CHUNK_GAS, PROXY_MAX_LEN):
+            print("WITHDRAW PROXY", chunk)
+            txs.append(proxy.functions.withdraw_many(chunk + [ZERO_ADDRESS] * (PROXY_MAX_LEN - len(chunk))).build_transaction(
+                {"from": wallet_address, "nonce": nonce, "gas": 0, **fees}))
+            ops.append(("WITHDRAW PROXY", chunk))
             nonce += 1
 
     if burn:
         burn = [web3.to_checksum_address(coin) for coin in burn]
-        if len(burn) % 20:
-            burn += [ZERO_ADDRESS] * (20 - (len(burn) % 20))
         proxy = web3.eth.contract(PROXY, abi=[{"name":"burn_many","outputs":[],"inputs":[{"type":"address[20]","name":"_coins"}],"stateMutability":"nonpayable","type":"function","gas":780568},])
-        for i in range(0, len(burn), 20):
-            print("BURN PROXY", burn[i: i + 20])
-            txs.append(proxy.functions.burn_many(burn[i: i + 20]).build_transaction({"from": wallet_address}))
-            txs[-1]["nonce"] = nonce
-            txs[-1]["gas"] = int(1.1 * txs[-1]["gas"])
+        for chunk in gas_model.pack("BURN PROXY", burn, CHUNK_GAS, PROXY_MAX_LEN):
+            print("BURN PROXY", chunk)
+            txs.append(proxy.functions.burn_many(chunk + [ZERO_ADDRESS] * (PROXY_MAX_LEN - len(chunk))).build_transaction(
+                {"from": wallet_address, "nonce": nonce, "gas": 0, **fees}))
+            ops.append(("BURN PROXY", chunk))
             nonce += 1
     if withdraw_fc:
         withdraw_fc = [web3.to_checksum_address(coin) for coin in withdraw_fc]
         print("WITHDRAW FC", withdraw_fc)
-        txs.append(fee_collector.functions.withdraw_many(withdraw_fc).build_transaction({"from": wallet_address}))
-        txs[-1]["nonce"] = nonce
-        txs[-1]["gas"] = int(1.1 * txs[-1]["gas"])
+        txs.append(fee_collector.functions.withdraw_many(withdraw_fc).build_transaction(
+            {"from": wallet_address, "nonce": nonce, "gas": 0, **fees}))
+        ops.append(("WITHDRAW FC", withdraw_fc))
         nonce += 1
 
-    collect = list(sorted(collect, key=lambda coin: int(coin, base=16)))
     collect = [web3.to_checksum_address(coin) for coin in collect]
-    print("COLLECT", collect)
-    txs.append(fee_collector.functions.collect(collect, RECEIVER).build_transaction({"from": wallet_address}))
-    txs[-1]["nonce"] = nonce
-    txs[-1]["gas"] = int(1.1 * txs[-1]["gas"])
+    for chunk in gas_model.pack("COLLECT", collect, CHUNK_GAS, COLLECT_MAX_LEN):  # sorted within chunks
+        print("COLLECT", chunk)
+        txs.append(fee_collector.functions.collect(chunk, RECEIVER).build_transaction(
+            {"from": wallet_address, "nonce": nonce, "gas": 0, **fees}))
+        ops.append(("COLLECT", chunk))
+        nonce += 1
 
-    for tx in txs:
-        signed_tx = web3.eth.account.sign_transaction(tx, private_key=wallet_pk)
-        web3.eth.send_raw_transaction(signed_tx.rawTransaction)
-    print("Go check ur wallet, I dit sth for ya ^&^")
+    # Gas from model, estimate_gas only for uncertain txs
+    try:
+        for tx, gas_limit in zip(txs, gas_model.gas_limits(web3, txs, ops, margin=1.1)):
+            tx["gas"] = gas_limit
+    except Exception as e:
+        print("Could not estimate gas", repr(e))
+        return False
+    receipts = await nonce_manager.send_all(txs)
+    learn_receipts(receipts, ops)
+    collected = all(receipt and receipt["status"] == 1 for receipt in receipts)
+    if collected:
+        print("Go check ur wallet, I dit sth for ya ^&^")
+    return collected
 
 
-def collect(withdraw_proxy, burn, withdraw_fc, pk_profit, collect, iters=None):
+async def collect(withdraw_proxy, burn, withdraw_fc, pk_profit, collect, iters=None):
+    """@return Everything got collected"""
     if chain == "ethereum":
-        collect_l1(withdraw_proxy, burn, withdraw_fc, pk_profit, collect, **({"iters": iters} if iters else {}))
-    else:
-        collect_l2(withdraw_proxy, burn, withdraw_fc, collect)
+        return collect_l1(withdraw_proxy, burn, withdraw_fc, pk_profit, collect, **({"iters": iters} if iters else {}))
+    return await collect_l2(withdraw_proxy, burn, withdraw_fc, collect)
 
 
-async def run():
-    data_fetcher = DataFetcher()
+def gas_cost_and_min_amount():
+    if chain == "ethereum":
+        return fee_oracle.gas_cost("source"), EXTREME_AMOUNT
+    return 0., max(100, EXTREME_AMOUNT)
+
+
+async def select_sources(data_fetcher, scheduler, ts, block_number, gas_cost, min_amount):
+    """
+    Sources profitable at `ts`
+    @return ((proxy_withdraw, to_burn, fc_withdraw, pk_profit, to_collect), count, total amount, deadlines)
+    """
+    deadlines = []
+
+    def is_due(amount, n=1):
+        """Profitable at `ts`, otherwise remember when it will be"""
+        if amount < min_amount * n:
+            return False
+        deadlines.append(scheduler.break_even_ts(amount, gas_cost * n))
+        return scheduler.is_due(amount, gas_cost * n, ts)
+
+    stable_pools, proxy_balances, pks, fc_balances = await data_fetcher.get_amounts(block_number)
+    proxy_withdraw, to_burn, fc_withdraw, to_collect = [], set(), [], set()
+    cnt, total = 0, 0
+    for pool in stable_pools:
+        try:
+            if is_due(pool.get("amount", 0), len(pool["coins"])):
+                cs = [coin for coin in pool["coins"] if coin not in data_fetcher.COINS_BLACKLIST]
+                if pool["address"].lower() in data_fetcher.PROXY_RECEIVER:
+                    proxy_withdraw.append(pool["address"])
+                    to_burn.update(cs)
+                else:
+                    proxy_withdraw.append(pool["address"])
+                to_collect.update(cs)
+                cnt += 1 ; total += pool["amount"]
+        except Exception as e:
+            print(f"{pool} admin_balances {repr(e)}")
+    for coin, amount in proxy_balances.items():
+        try:
+            if is_due(amount):
+                to_burn.add(coin)
+                to_collect.add(coin)
+                cnt += 1 ; total += amount
+        except Exception as e:
+            print(f"Proxy balances {repr(e)}")
+    pk_profit = []
+    for pk, pool, amount in pks:
+        if is_due(amount):
+            pk_profit.append(pk)
+            to_collect.add(pool)
+            cnt += 1 ; total += amount
+    for coin, amount in fc_balances.items():
+        try:
+            if is_due(amount):
+                to_collect.add(coin)
+                cnt += 1 ; total += amount
+        except Exception as e:
+            print(f"Proxy balances {repr(e)}")
+    return (proxy_withdraw, list(to_burn), fc_withdraw, pk_profit, list(to_collect)), cnt, total, deadlines
+
+
+async def warm_up(data_fetcher, scheduler):
+    """
+    Get ready for the first profitable block of the epoch instead of starting cold inside of it.
+    `WARM_UP` seconds before the epoch: fetch prices and sources, tally amounts (incremental tally state gets built)
+    and open builder connections. The fee is ~0 at epoch start, so the bundle targets the first block where some
+    source breaks even: at the block before it amounts are refreshed, then the bundle is simulated at that block's
+    time, signed and submitted, so it is in builders' hands before that block is built. If nothing breaks even
+    within `MAX_SLEEP` of the epoch start, the main loop takes over at the first epoch block.
+    L2 txs go to the mempool and would revert before the epoch, so there the first iteration sends at the first block.
+    @return Latest block
+    """
+    wake_ts = scheduler.start - WARM_UP
+    print(f"Warming up at {time.ctime(wake_ts)}, epoch starts at {time.ctime(scheduler.start)}")
+    await asyncio.sleep(max(wake_ts - time.time(), 0.))
+
     data_fetcher.fetch_prices()
     data_fetcher.fetch_sources()
+    latest_block = block_source.latest()
+    sign_ts = scheduler.start
+    if chain == "ethereum":
+        bundle_submitter.connect()
+        gas_cost, min_amount = gas_cost_and_min_amount()
+        _, _, _, deadlines = await select_sources(
+            data_fetcher, scheduler, scheduler.start, latest_block["number"], gas_cost, min_amount,
+        )
+        sign_ts = min([deadline for deadline in deadlines if deadline is not None], default=None)
+        if sign_ts is not None and sign_ts > scheduler.start + MAX_SLEEP:
+            sign_ts = None
+    else:
+        await data_fetcher.get_amounts(latest_block["number"])
+    wait_ts = sign_ts or scheduler.start
+
+    while latest_block["timestamp"] + BLOCK_TIME < wait_ts:
+        await asyncio.sleep(scheduler.sleep_time(wait_ts - BLOCK_TIME, BLOCK_TIME))
+        latest_block = await block_source.async_wait_for_new_head(after=latest_block["number"])
+    if chain != "ethereum" or sign_ts is None:
+        return latest_block
+
+    ts = latest_block["timestamp"] + BLOCK_TIME  # first block at or after break-even
+    gas_cost, min_amount = gas_cost_and_min_amount()
+    sources, cnt, total, _ = await select_sources(
+        data_fetcher, scheduler, ts, latest_block["number"], gas_cost, min_amount,
+    )
+    if cnt > 0:
+        print(f"Pre-signing {cnt} sources worth {total:.2f} for block {latest_block['number'] + 1}")
+        bundle = prepare_l1(*sources, ts=ts)
+        if bundle:
+            submit_l1(bundle, first_block=latest_block["number"] + 1)
+    return block_source.latest()
 
-    latest_block = web3.eth.get_block("latest")
-    base_fee = latest_block["baseFeePerGas"]
-    ts = latest_block["timestamp"] + 12
-    while 4 * 24 * 3600 < (ts - 1600300800) % (7 * 24 * 3600) < 5 * 24 * 3600:
-        if chain == "ethereum":
-            safe_amount = 30 * (base_fee / (10 * 10 ** 9)) * (3500 / 3500)
-        else:
-            safe_amount = 1000
-        fee = 0.02 * ((ts - 1600300800) % (24 * 3600)) / (24 * 3600)
-        safe_threshold = max(int(safe_amount / fee) if chain == "ethereum" else 100, EXTREME_AMOUNT)
-        print(f"Safe amount: {safe_threshold}")
-
-        stable_pools, proxy_balances, pks, fc_balances = await data_fetcher.get_amounts()
-        proxy_withdraw, to_burn, fc_withdraw, to_collect = [], set(), [], set()
-        cnt, total = 0, 0
-        for pool in stable_pools:
-            try:
-                if pool.get("amount", 0) >= safe_threshold * len(pool["coins"]):
-                    cs = [coin for coin in pool["coins"] if coin not in data_fetcher.COINS_BLACKLIST]
-                    if pool["address"].lower() in data_fetcher.PROXY_RECEIVER:
-                        proxy_withdraw.append(pool["address"])
-                        to_burn.update(cs)
-                    else:
-                        proxy_withdraw.append(pool["address"])
-                    to_collect.update(cs)
-                    cnt += 1 ; total += pool["amount"]
-            except Exception as e:
-                print(f"{pool} admin_balances {repr(e)}")
-        for coin, amount in proxy_balances.items():
-            try:
-                if amount >= safe_threshold:
-                    to_burn.add(coin)
-                    to_collect.add(coin)
-                    cnt += 1 ; total += amount
-            except Exception as e:
-                print(f"Proxy balances {repr(e)}")
-        pk_profit = []
-        for pk, pool, amount in pks:
-            if amount >= safe_threshold:
-                pk_profit.append(pk)
-                to_collect.add(pool)
-                cnt += 1 ; total += amount
-        for coin, amount in fc_balances.items():
-            try:
-                if amount >= safe_threshold:
-                    to_collect.add(coin)
-                    cnt += 1 ; total += amount
-            except Exception as e:
-                print(f"Proxy balances {repr(e)}")
-
-        if cnt > 0:
-            print(f"Trying to profit {total * fee:.2f} crvUSD from {cnt} sources")
-            collect(proxy_withdraw, list(to_burn), fc_withdraw, pk_profit, list(to_collect))
 
-        latest_block = web3.eth.get_block("latest")
-        base_fee = latest_block["baseFeePerGas"]
-        ts = latest_block["timestamp"] + 12
+async def run():
+    data_fetcher = DataFetcher()
+    try:
+        latest_block = block_source.latest()
+        ts = latest_block["timestamp"] + BLOCK_TIME
+        scheduler = BreakEvenScheduler.upcoming(web3.eth.contract(FEE_COLLECTOR, abi=FEE_COLLECTOR_ABI), "COLLECT", ts)
+        if ts < scheduler.start:
+            latest_block = await warm_up(data_fetcher, scheduler)
+            ts = latest_block["timestamp"] + BLOCK_TIME
+        else:
+            data_fetcher.fetch_prices()
+            data_fetcher.fetch_sources()
+        while scheduler.start <= ts < scheduler.end:
+            gas_cost, min_amount = gas_cost_and_min_amount()
+            fee = scheduler.fee(ts)
+            print(f"Gas cost: {gas_cost:.2f}, fee: {fee:.4%}")
+
+            sources, cnt, total, deadlines = await select_sources(
+                data_fetcher, scheduler, ts, latest_block["number"], gas_cost, min_amount,
+            )
+            collected = True
+            if cnt > 0:
+                print(f"Trying to profit {total * fee:.2f} crvUSD from {cnt} sources")
+                collected = await collect(*sources)
+            print(rpc_cache.stats())
+
+            wake_ts = scheduler.next_deadline(deadlines, ts, MAX_SLEEP, BLOCK_TIME, collected)
+            print(f"Sleeping until {time.ctime(wake_ts)}")
+            await asyncio.sleep(scheduler.sleep_time(wake_ts, BLOCK_TIME))
+
+            latest_block = await block_source.async_wait_for_new_head(after=latest_block["number"])  # react to the first block after waking
+            ts = latest_block["timestamp"] + BLOCK_TIME
+    finally:
+        await DataFetcher.web3.provider.close()
 
 
 if __name__ == "__main__":
@@ -2,7 +2,6 @@ import asyncio
 import os
 import json
 import time
-import requests
 
 from web3 import Web3
 from web3.eth import AsyncEth
@@ -10,11 +9,22 @@ from web3.middleware import geth_poa_middleware
 from getpass import getpass
 from eth_account import account
 
+from blocks import BlockSource
+from bundles import BundleSubmitter
+from curve_api import coin_usd_price, fetch_pool_data
+from draft.fee_oracle import FeeOracle
+from draft.nonce_manager import NonceManager
+from schedule import BreakEvenScheduler, FEE_COLLECTOR_ABI
+
 chain = "ethereum"  # ethereum|xdai
 RPC = {
     "ethereum": f"http://localhost:8545",
     "xdai": f"https://rpc.gnosischain.com",
 }
+RPC_WS = {  # newHeads subscription, polling if not set
+    "ethereum": "ws://localhost:8546",
+    "xdai": None,
+}
 ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
 ETH_ADDRESS = "0xEeeeeEeeeEeEeeEeEeEeeEEEeeeeEeeeeeeeEEeE"
 CRVUSD = {
@@ -30,6 +40,17 @@ PROXY = {
     "xdai": "0x3B48eE129D74A63461FE54Ec7226C019F5b6b203",
 }[chain]
 EMPTY_HOOK_INPUT = (0, 0, b"")
+BLOCK_TIME = {
+    "ethereum": 12,
+    "xdai": 5,
+}[chain]
+WRAPPED_NATIVE = {
+    "ethereum": "0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2",
+    "xdai": "0xe91D153E0b41518A2Ce8Dd3D7944Fa863463a97d",
+}[chain]
+SOURCE_GAS = 850_000  # conservative gas per source, ~30 USD at 10 gwei and 3500 USD/ETH
+MAX_SLEEP = 5 * 60  # refresh accrued amounts at least this often
+WARM_UP = 10 * 60  # start preparing this long before the epoch
 
 web3 = Web3(
     provider=Web3.HTTPProvider(
@@ -38,6 +59,8 @@ web3 = Web3(
 )
 if chain == "xdai":
     web3.middleware_onion.inject(geth_poa_middleware, layer=0)
+block_source = BlockSource(web3, BLOCK_TIME, RPC_WS[chain])
+fee_oracle = FeeOracle(web3, lambda: coin_usd_price(chain, WRAPPED_NATIVE), {"source": SOURCE_GAS}, max_age=BLOCK_TIME)
 
 
 def account_load_pkey(fname):
@@ -55,6 +78,9 @@ BUILDERS = [
     "https://rsync-builder.xyz",
     "https://relay.flashbots.net",
 ]
+bundle_submitter = BundleSubmitter(BUILDERS)
+nonce_manager = NonceManager(web3, wallet_pk, fee_oracle.fees)
+
 
 class DataFetcher:
     web3 = Web3(
@@ -72,11 +98,7 @@ class DataFetcher:
         self.POOL_BLACKLIST = [pool.lower() for pool in self.POOL_BLACKLIST]
 
     def fetch_sources(self):
-        pool_data = []
-        for registry in ["main", "factory", "factory-crvusd"]:
-            pool_data.extend(requests.get(
-                f"https://api.curve.fi/api/getPools/{chain}/{registry}",
-            ).json().get("data", {}).get("poolData", []))
+        pool_data = fetch_pool_data(chain, ["main", "factory", "factory-crvusd"])
 
         crvusd_pools = []
         for pool_dict in pool_data:
@@ -129,113 +151,112 @@ def forward(prev_tx, calls):
     calls += [
         (fee_collector.address, False, fee_collector.encodeABI("forward", ([EMPTY_HOOK_INPUT], "0xcb78EA4Bc3c545EB48dDC9b8302Fa9B03d1B1B61"))),
     ]
-    max_fee = 20 * 10 ** 9  # even 10 GWEI should be enough for Wednesday morning
-    max_priority = 1000000000
+    fees = fee_oracle.fees()
 
     txs = []
     if prev_tx:
         txs.append(prev_tx.build_transaction({
-            "from": wallet_address, "nonce": nonce,
-            "maxFeePerGas": max_fee, "maxPriorityFeePerGas": max_priority,
+            "from": wallet_address, "nonce": nonce, **fees,
         }))
     print(calls)
     txs.append(multicall.functions.aggregate3(calls).build_transaction({
-        "from": wallet_address, "nonce": nonce + (1 if prev_tx else 0),
-        "maxFeePerGas": max_fee, "maxPriorityFeePerGas": max_priority,
+        "from": wallet_address, "nonce": nonce + (1 if prev_tx else 0), **fees,
     }))
 
-    iters = 0
-    while web3.eth.get_transaction_count(wallet_address) <= nonce and iters < 2:
-        try:
-            for tx in txs:
-                gas_estimate = web3.eth.estimate_gas(tx)
-                tx["gas"] = int(2 * gas_estimate)
-        except Exception as e:
-            print("Could not estimate gas", repr(e))
-            return
-        signed_txs = [web3.eth.account.sign_transaction(tx, private_key=wallet_pk) for tx in txs]
-        block = web3.eth.get_block_number() + 1
-        print(f"Trying block: {block}")
-        for builder in BUILDERS:
-            if "flashbots" in builder:
-                r = requests.post(builder, json={
-                    "jsonrpc": "2.0",
-                    "id": 1,
-                    "method": "eth_sendBundle",
-                    "params": [
-                        {
-                            "version": "v0.1",
-                            "inclusion": {"block": str(hex(block)), "maxBlock": str(hex(block))},
-                            "body": [{"tx": tx.rawTransaction.hex(), "canRevert": True} for tx in signed_txs],
-                        }
-                    ]
-                })
-            else:
-                r = requests.post(builder, json={
-                    "jsonrpc": "2.0",
-                    "id": 1,
-                    "method": "eth_sendBundle",
-                    "params": [
-                        {
-                            "txs": [tx.rawTransaction.hex() for tx in signed_txs],
-                            "blockNumber": str(hex(block)),
-                        }
-                    ]
-                })
-            print(builder, r.json())
-        iters += 1
-        time.sleep(2 * 12)  # wait for a couple of blocks
-    if web3.eth.get_transaction_count(wallet_address) > nonce:
+    try:
+        for tx in txs:
+            gas_estimate = web3.eth.estimate_gas(tx)
+            tx["gas"] = int(2 * gas_estimate)
+    except Exception as e:
+        print("Could not estimate gas", repr(e))
+        return False
+    signed_txs = [web3.eth.account.sign_transaction(tx, private_key=wallet_pk) for tx in txs]
+    included = bundle_submitter.submit_until_included(web3, signed_txs, wallet_address, nonce + len(txs), n_blocks=3,
+                                                      max_blocks=4, block_source=block_source)
+    fee_oracle.record_outcome(included)
+    if included:
         print("Go check ur wallet, I dit sth for ya ^&^")
+    return included
 
 
-def forward_l2(prev_tx, calls):
+async def forward_l2(prev_tx, calls):
     multicall = web3.eth.contract("0xcA11bde05977b3631167028862bE2a173976CA11", abi=[{"inputs": [{"components": [{"internalType": "address", "name": "target", "type": "address"},{"internalType": "bool", "name": "allowFailure", "type": "bool"},{"internalType": "bytes", "name": "callData", "type": "bytes"}], "internalType": "struct Multicall3.Call3[]","name": "calls","type": "tuple[]"}],"name": "aggregate3", "outputs": [{"components": [{"internalType": "bool", "name": "success", "type": "bool"},{"internalType": "bytes", "name": "returnData", "type": "bytes"}],"internalType": "struct Multicall3.Result[]", "name": "returnData", "type": "tuple[]"}],"stateMutability": "payable","type": "function"}, ])
     fee_collector = web3.eth.contract(FEE_COLLECTOR, abi=[{"stateMutability": "payable", "type": "function", "name": "forward", "inputs": [{"name": "_hook_inputs", "type": "tuple[]","components": [{"name": "hook_id", "type": "uint8"}, {"name": "value", "type": "uint256"},{"name": "data", "type": "bytes"}]}], "outputs": [{"name": "", "type": "uint256"}]},{"stateMutability": "payable", "type": "function", "name": "forward", "inputs": [{"name": "_hook_inputs", "type": "tuple[]","components": [{"name": "hook_id", "type": "uint8"}, {"name": "value", "type": "uint256"},{"name": "data", "type": "bytes"}]}, {"name": "_receiver", "type": "address"}],"outputs": [{"name": "", "type": "uint256"}]}, ], )
 
-    nonce = web3.eth.get_transaction_count(wallet_address)
     calls += [
         (fee_collector.address, True, fee_collector.encodeABI("forward", ([EMPTY_HOOK_INPUT], "0x8C95d2ad015f12B03ad4712a48a37c2A68970f62"))),
     ]
+    fees = fee_oracle.fees()  # explicit, else build_transaction fills web3 defaults
     txs = []
     if prev_tx:
-        txs.append(prev_tx.build_transaction({"from": wallet_address, "nonce": nonce,}))
-    txs.append(multicall.functions.aggregate3(calls).build_transaction({
-        "from": wallet_address,"nonce": nonce + (1 if prev_tx else 0),
-    }))
+        txs.append(prev_tx.build_transaction({"from": wallet_address, "nonce": 0, **fees}))
+    txs.append(multicall.functions.aggregate3(calls).build_transaction({"from": wallet_address, "nonce": 0, **fees}))
 
-    iters = 0
-    for tx in txs:
-        while web3.eth.get_transaction_count(wallet_address) <= nonce and iters < 2:
-            signed_tx = web3.eth.account.sign_transaction(tx, private_key=wallet_pk)
-            web3.eth.send_raw_transaction(signed_tx.rawTransaction)
-            iters += 1
-            time.sleep(2 * 12)  # wait for a couple of blocks
-        nonce += 1
-    if web3.eth.get_transaction_count(wallet_address) > nonce:
+    receipts = await nonce_manager.send_all(txs)  # nonces are assigned by nonce_manager
+    forwarded = all(receipt and receipt["status"] == 1 for receipt in receipts)
+    if forwarded:
         print("Go check ur wallet, I dit sth for ya ^&^")
+    return forwarded
+
+
+async def warm_up(data_fetcher, scheduler):
+    """
+    Fetch sources, amounts and open builder connections `WARM_UP` seconds before the epoch,
+    then wait for the last block before it, so the first iteration runs for the first epoch block.
+    forward() estimates gas, which reverts before the epoch, so txs are not pre-signed.
+    @return Latest block
+    """
+    wake_ts = scheduler.start - WARM_UP
+    print(f"Warming up at {time.ctime(wake_ts)}, epoch starts at {time.ctime(scheduler.start)}")
+    await asyncio.sleep(max(wake_ts - time.time(), 0.))
+
+    data_fetcher.fetch_sources()
+    if chain == "ethereum":
+        bundle_submitter.connect()
+    await data_fetcher.get_amounts()
+    fee_oracle.fees()  # fee history
+
+    latest_block = block_source.latest()
+    while latest_block["timestamp"] + BLOCK_TIME < scheduler.start:
+        await asyncio.sleep(scheduler.sleep_time(scheduler.start - BLOCK_TIME, BLOCK_TIME))
+        latest_block = await block_source.async_wait_for_new_head(after=latest_block["number"])
+    return latest_block
 
 
 async def run():
     data_fetcher = DataFetcher()
-    data_fetcher.fetch_sources()
 
-    latest_block = web3.eth.get_block("latest")
-    base_fee = latest_block["baseFeePerGas"]
-    ts = latest_block["timestamp"] + 12
-    while 6 * 24 * 3600 < (ts - 1600300800) % (7 * 24 * 3600) < 7 * 24 * 3600:
+    latest_block = block_source.latest()
+    ts = latest_block["timestamp"] + BLOCK_TIME
+    scheduler = BreakEvenScheduler.upcoming(web3.eth.contract(FEE_COLLECTOR, abi=FEE_COLLECTOR_ABI), "FORWARD", ts)
+    if ts < scheduler.start:
+        latest_block = await warm_up(data_fetcher, scheduler)
+        ts = latest_block["timestamp"] + BLOCK_TIME
+    else:
+        data_fetcher.fetch_sources()
+    while scheduler.start <= ts < scheduler.end:
         if chain == "ethereum":
-            safe_amount = 30 * (base_fee / (10 * 10 ** 9)) * (3500 / 3500)
+            gas_cost = int(fee_oracle.gas_cost("source") * 10 ** 18)  # crvUSD
+            min_amount = 0
         else:
-            safe_amount = 1000
-        fee = 0.01 * ((ts - 1600300800) % (24 * 3600)) / (24 * 3600)
-        safe_threshold = int(safe_amount / fee) * 10 ** 18 if chain == "ethereum" else 100 * 10 ** 18
+            gas_cost = 0
+            min_amount = 100 * 10 ** 18
+        fee = scheduler.fee(ts)
+
+        deadlines = []
+
+        def is_due(amount):
+            """Profitable at next block, otherwise remember when it will be"""
+            if amount < min_amount:
+                return False
+            deadlines.append(scheduler.break_even_ts(amount, gas_cost))
+            return scheduler.is_due(amount, gas_cost, ts)
 
         pools, controllers, bridge_txs, balance, proxy_balance = await data_fetcher.get_amounts()
         calls, cnt, total = [], 0, 0
         for pool, amount in pools.items():
             try:
-                if amount >= safe_threshold:
+                if is_due(amount):
                     calls.append((pool, False, bytes.fromhex("30c54085")))
                     cnt += 1 ; total += amount
             except Exception as e:
@@ -243,36 +264,40 @@ async def run():
                 return
         for controller, amount in controllers.items():
             try:
-                if amount >= safe_threshold:  # TODO check balance of controller in case of rug_debt_ceiling
+                if is_due(amount):  # TODO check balance of controller in case of rug_debt_ceiling
                     calls.append((controller, False, bytes.fromhex("1e0cfcef")))
                     cnt += 1 ; total += amount
             except Exception as e:
                 print(f"{controller} admin_fees() {repr(e)}")
                 return
         for (bridge, tx), amount in bridge_txs:
-            if amount >= safe_threshold:
+            if is_due(amount):
                 calls.append((bridge, False, tx))
                 cnt += 1 ; total += amount
-        if balance >= safe_threshold:
+        if is_due(balance):
             cnt += 1
             total += balance
 
         prev_tx = None
-        if proxy_balance >= safe_threshold:
+        if is_due(proxy_balance):
             contract = web3.eth.contract(PROXY, abi=[{"name":"burn","outputs":[],"inputs":[{"type":"address","name":"_coin"}],"stateMutability":"nonpayable","type":"function","gas":93478},])
             prev_tx = contract.functions.burn(CRVUSD)
             cnt += 1 ; total += proxy_balance
 
+        forwarded = True
         if cnt > 0:
             print(f"Trying to profit {total * fee / 10 ** 18:.2f} crvUSD from {cnt} sources")
             if chain == "ethereum":
-                forward(prev_tx, calls)
+                forwarded = forward(prev_tx, calls)
             else:
-                forward_l2(prev_tx, calls)
+                forwarded = await forward_l2(prev_tx, calls)
+
+        wake_ts = scheduler.next_deadline(deadlines, ts, MAX_SLEEP, BLOCK_TIME, forwarded)
+        print(f"Sleeping until {time.ctime(wake_ts)}")
+        await asyncio.sleep(scheduler.sleep_time(wake_ts, BLOCK_TIME))
 
-        latest_block = web3.eth.get_block("latest")
-        base_fee = latest_block["baseFeePerGas"]
-        ts = latest_block["timestamp"] + 12
+        latest_block = await block_source.async_wait_for_new_head(after=latest_block["number"])  # react to the first block after waking
+        ts = latest_block["timestamp"] + BLOCK_TIME
 
 
 if __name__ == "__main__":
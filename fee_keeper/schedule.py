@@ -0,0 +1,92 @@
+"""
+Timing of keeper actions.
+"""
+import math
+import time
+
+
+START_TIME = 1600300800  # FeeCollector.START_TIME
+WEEK = 7 * 24 * 3600
+ONE = 10 ** 18
+EPOCH = {  # FeeCollector.Epoch
+    "SLEEP": 1,
+    "COLLECT": 2,
+    "EXCHANGE": 4,
+    "FORWARD": 8,
+}
+FEE_COLLECTOR_ABI = [
+    {"stateMutability": "view", "type": "function", "name": "epoch_time_frame", "inputs": [{"name": "_epoch", "type": "uint256"}, {"name": "_ts", "type": "uint256"}], "outputs": [{"name": "", "type": "uint256"}, {"name": "", "type": "uint256"}]},
+    {"stateMutability": "view", "type": "function", "name": "max_fee", "inputs": [{"name": "arg0", "type": "uint256"}], "outputs": [{"name": "", "type": "uint256"}]},
+]
+
+
+class BreakEvenScheduler:
+    """
+    Keeper fee is a linear ramp over epoch time frame: `max_fee * (ts + 1 - start) / (end - start)`.
+    So the earliest profitable timestamp of a candidate can be computed instead of polling:
+        amount * fee(ts) >= gas_cost
+
+    Usage:
+        scheduler = BreakEvenScheduler.from_fee_collector(fee_collector, "COLLECT", ts)
+        scheduler.break_even_ts(amount=1000, gas_cost=5)  # None if never profitable within the epoch
+    """
+
+    def __init__(self, start, end, max_fee):
+        """
+        @param start Epoch time frame start
+        @param end Epoch time frame end
+        @param max_fee Maximum fee with base 10**18
+        """
+        self.start = start
+        self.end = end
+        self.max_fee = max_fee
+
+    @classmethod
+    def from_fee_collector(cls, fee_collector, epoch, ts):
+        start, end = fee_collector.functions.epoch_time_frame(EPOCH[epoch], ts).call()
+        return cls(start, end, fee_collector.functions.max_fee(EPOCH[epoch]).call())
+
+    @classmethod
+    def upcoming(cls, fee_collector, epoch, ts):
+        """Epoch time frame containing `ts` or the next one if this week's has passed"""
+        start, end = fee_collector.functions.epoch_time_frame(EPOCH[epoch], ts).call()
+        if ts >= end:
+            start, end = fee_collector.functions.epoch_time_frame(EPOCH[epoch], ts + WEEK).call()
+        return cls(start, end, fee_collector.functions.max_fee(EPOCH[epoch]).call())
+
+    def fee(self, ts):
+        """Keeper fee share at `ts`, same as FeeCollector.fee()"""
+        if not self.start <= ts < self.end:
+            return 0.
+        return self.max_fee * (ts + 1 - self.start) / (self.end - self.start) / ONE
+
+    def break_even_ts(self, amount, gas_cost):
+        """
+        @param amount Accrued amount in units of `gas_cost`
+        @param gas_cost Cost of including candidate
+        @return Earliest timestamp of the epoch when candidate is profitable, None if never
+        """
+        if amount <= 0 or self.max_fee == 0:
+            return None
+        ts = max(math.ceil(self.start - 1 + gas_cost * ONE * (self.end - self.start) / (amount * self.max_fee)), self.start)
+        return ts if ts < self.end else None
+
+    def is_due(self, amount, gas_cost, ts):
+        break_even = self.break_even_ts(amount, gas_cost)
+        return break_even is not None and break_even <= ts
+
+    @staticmethod
+    def next_deadline(deadlines, ts, max_sleep, block_time, done=True):
+        """
+        Earliest future deadline, not later than `ts + max_sleep` so accrued amounts get refreshed.
+        Candidates due at `ts` that were not done (bundle failed, not included or pruned) are retried at the next block.
+        @param done Everything due at `ts` was sent and included
+        """
+        if not done and any(deadline is not None and deadline <= ts for deadline in deadlines):
+            return ts + block_time
+        return min([deadline for deadline in deadlines if deadline is not None and deadline > ts] + [ts + max_sleep])
+
+    @staticmethod
+    def sleep_time(wake_ts, block_time):
+        """Seconds to sleep so the next block after waking is at `wake_ts`"""
+        return max(wake_ts - block_time - time.time(), 0.)
@@ -0,0 +1,147 @@
+"""
+Pre-flight simulation of collect bundles on a titanoboa fork.
+"""
+import boa
+
+from fork_cache import DEFAULT_PATH, SnapshotRPC
+
+BALANCE_OF = bytes.fromhex("70a08231")  # balanceOf(address)
+
+
+def intrinsic_gas(data: bytes) -> int:
+    """Gas charged before execution, not included in computation gas"""
+    zeros = data.count(0)
+    return 21_000 + 4 * zeros + 16 * (len(data) - zeros)
+
+
+class SimCall:
+    """Call built from a list of items (pools, coins, ...), so failing items can be pruned out of it"""
+
+    def __init__(self, label: str, to: str, items: list, encode, allow_failure: bool = False):
+        """
+        @param label Name to report
+        @param to Address to call
+        @param items Arguments to prune
+        @param encode Function from items to calldata bytes
+        @param allow_failure Bundle is still worth it if the call reverts (Multicall3 allowFailure)
+        """
+        self.label = label
+        self.to = to
+        self.items = items
+        self.encode = encode
+        self.allow_failure = allow_failure
+
+    def data(self, items=None) -> bytes:
+        return self.encode(self.items if items is None else items)
+
+
+class BundleSimulator:
+    """
+    Runs bundle calls one after another on a fork of the latest block as if it was mined in the next one.
+    Fork is created once per block and reused: every simulation runs inside an anchor, so the block snapshot and
+    already fetched state stay for the next simulations. Fetched state is persisted (see fork_cache.py), so
+    re-runs over recorded blocks don't touch the node. State of each call is prefetched with one
+    `debug_traceCall(prestateTracer)` request instead of slot-by-slot reads where the node supports it.
+    Calls that revert are bisected to find failing items, those are pruned and the call is retried.
+
+    Usage:
+        simulator = BundleSimulator(RPC[chain], wallet_address, RECEIVER, BLOCK_TIME, keep_blocks=64)
+        simulator.fork(block["number"], block["timestamp"])
+        result = simulator.simulate(calls, coins)
+        result["calls"]  # [(SimCall, kept items, calldata, gas)]
+    """
+
+    def __init__(self, rpc: str | None, sender: str, receiver: str, block_time: int = 12, prefetch: bool = True,
+                 cache_path: str = DEFAULT_PATH, keep_blocks: int | None = None):
+        """
+        @param rpc Node to fork from, None to replay recorded snapshots offline
+        @param sender Keeper address, also tx.origin
+        @param receiver Receiver of keeper fee
+        @param block_time Seconds to shift fork timestamp by to get to the pending block
+        @param prefetch Prefetch state of each call with `debug_traceCall`
+        @param cache_path SQLite file of fork snapshots, shared across runs
+        @param keep_blocks Remove snapshots older than this many blocks, keep all if None
+        """
+        self.rpc = rpc
+        self.sender = sender
+        self.receiver = receiver
+        self.block_time = block_time
+        self.env = boa.Env(fork_try_prefetch_state=prefetch)
+        self.cache_path = cache_path
+        self.keep_blocks = keep_blocks
+        self.block = None
+        self.snapshot = None
+
+    def fork(self, block_number: int, timestamp: int):
+        """
+        Fork `block_number` and move to the pending block, fork is reused if already forked
+        @param timestamp Timestamp of `block_number`, earlier/later one to simulate at other time (e.g. epoch start)
+        """
+        if block_number != self.block:
+            snapshot = SnapshotRPC(self.rpc, block_number, self.cache_path)
+            if self.keep_blocks is not None:
+                snapshot.prune(block_number - self.keep_blocks)
+            self.env.fork_rpc(snapshot, block_identifier=block_number, cache_dir=None)
+            if self.snapshot is not None:
+                self.snapshot.close()  # fork of the previous block is dropped
+            self.snapshot = snapshot
+            self.block = block_number
+        self.env.evm.patch.block_number = block_number + 1
+        self.env.evm.patch.timestamp = timestamp + self.block_time
+
+    def _execute(self, call: SimCall, items: list):
+        return self.env.execute_code(to_address=call.to, sender=self.sender, data=call.data(items))
+
+    def _succeeds(self, call: SimCall, items: list) -> bool:
+        with self.env.anchor():
+            return not self._execute(call, items).is_error
+
+    def _failing(self, call: SimCall, items: list) -> list:
+        """Items that make reverting call revert, halves are checked from the same state"""
+        if len(items) <= 1:
+            return items
+        failing = []
+        for half in (items[:len(items) // 2], items[len(items) // 2:]):
+            if not self._succeeds(call, half):
+                failing += self._failing(call, half)
+        return failing
+
+    def balances(self, coins: list[str], holder: str) -> dict[str, int]:
+        data = BALANCE_OF + bytes(12) + bytes.fromhex(holder.removeprefix("0x"))
+        balances = {}
+        for coin in coins:
+            computation = self.env.execute_code(to_address=coin, data=data, is_modifying=False)
+            balances[coin] = int.from_bytes(computation.output[:32], "big") if not computation.is_error else 0
+        return balances
+
+    def simulate(self, calls: list[SimCall], coins: list[str]) -> dict:
+        """
+        @param calls Calls of the bundle in order
+        @param coins Coins to report keeper fee of
+        @return {
+            "calls": [(call, kept items, calldata, gas)], gas includes intrinsic gas
+            "pruned": {label: [failing items]},
+            "fees": {coin: amount received by receiver},
+        }
+        """
+        result = {"calls": [], "pruned": {}, "fees": {}}
+        with self.env.anchor():
+            before = self.balances(coins, self.receiver)
+            for call in calls:
+                items = call.items
+                computation = self._execute(call, items)
+                if computation.is_error:
+                    failing = self._failing(call, items)
+                    result["pruned"][call.label] = result["pruned"].get(call.label, []) + failing
+                    items = [item for item in items if item not in failing]
+                    if not items:
+                        continue
+                    computation = self._execute(call, items)
+                    if computation.is_error:  # items fail only together, drop the call
+                        result["pruned"][call.label] += items
+                        continue
+                data = call.data(items)
+                result["calls"].append((call, items, data, computation.net_gas_used + intrinsic_gas(data)))
+            after = self.balances(coins, self.receiver)
+        result["fees"] = {coin: after[coin] - before[coin] for coin in coins}
+        return result
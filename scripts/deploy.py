@@ -5,6 +5,9 @@ import sys
 from getpass import getpass
 from eth_account import account
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fee_keeper.fork_cache import fork  # noqa: E402
+
 
 chain = "gnosis"  # ALTER
 TARGET = "0xaBEf652195F98A91E490f047A5006B71c85f058d"  # ALTER: crvUSD
@@ -15,6 +18,7 @@ EMERGENCY_ADMIN = "0x71F718D3e4d1449D1502A6A7595eb84eBcCB1683"  # ALTER
 BURNER = "CowSwap"  # ALTER
 
 NETWORK = f"https://rpc.gnosischain.com"  # ALTER
+FORK_BLOCK = "latest"  # ALTER: pin block number to reuse recorded fork state
 
 EMPTY_COMPENSATION = (0, (0, 0, 0), 0, 0, False)
 EMPTY_HOOK_INPUT = (0, 0, b"")
@@ -109,7 +113,7 @@ def account_load(fname):
 
 if __name__ == "__main__":
     if '--fork' in sys.argv[1:]:
-        boa.env.fork(NETWORK)
+        fork(None if '--offline' in sys.argv[1:] else NETWORK, FORK_BLOCK)  # state is recorded for later runs
 
         boa.env.eoa = '0x71F718D3e4d1449D1502A6A7595eb84eBcCB1683'
     else:
@@ -0,0 +1,6 @@
+import os
+import sys
+
+
+# Draft modules import each other relative to the draft root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, "fee_keeper", "draft")))
@@ -0,0 +1,52 @@
+import pytest
+from hypothesis import HealthCheck, given, settings
+from hypothesis import strategies as st
+
+from utils import Cached, JSONCacheStore, SQLiteCacheStore
+
+
+keys = st.text(min_size=1, max_size=8)
+leaves = st.none() | st.booleans() | st.integers(min_value=-2 ** 255, max_value=2 ** 256) |\
+    st.floats(allow_nan=False, allow_infinity=False) | st.text(max_size=8)
+values = st.recursive(leaves, lambda children: st.lists(children, max_size=4) | st.dictionaries(keys, children, max_size=4),
+                      max_leaves=16)
+states = st.dictionaries(st.sampled_from(["ethereum", "xdai"]), values, min_size=1)
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(Cached, "_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_lists_round_trip(cache_dir):
+    state = {"ethereum": {"queue": [[3, "b"], [1, "a"], [3, "b"]], "pools": {"0x01": [0, 0, 5]}, "empty": []}}
+    store = SQLiteCacheStore()
+    store.save("Test", state)
+    assert store.load("Test") == state
+    assert SQLiteCacheStore().load("Test") == state  # from disk
+
+
+@given(first=states, second=states)
+@settings(deadline=None, max_examples=50, suppress_health_check=[HealthCheck.function_scoped_fixture])
+def test_same_as_json(cache_dir, first, second):
+    name = f"Test{abs(hash((repr(first), repr(second))))}"
+    sqlite_store, json_store = SQLiteCacheStore(), JSONCacheStore()
+    for state in [first, second]:
+        sqlite_store.save(name, state)
+        json_store.save(name, state)
+    assert sqlite_store.load(name) == json_store.load(name)
+    assert SQLiteCacheStore().load(name) == json_store.load(name)
+
+
+def test_only_changed_rows_are_written(cache_dir):
+    store = SQLiteCacheStore()
+    store.save("Test", {"ethereum": {"a": 1, "b": {"c": [1, 2]}}, "xdai": {"a": 2}})
+    changes = store.connection.total_changes
+
+    store.save("Test", {"ethereum": {"a": 1, "b": {"c": [1, 2]}}})
+    assert store.connection.total_changes == changes
+
+    store.save("Test", {"ethereum": {"a": 1, "b": {"c": [2, 1]}}})
+    assert store.connection.total_changes == changes + 1
+    assert store.load("Test") == {"ethereum": {"a": 1, "b": {"c": [2, 1]}}, "xdai": {"a": 2}}
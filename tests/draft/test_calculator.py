@@ -0,0 +1,146 @@
+import pytest
+from hypothesis import given, settings
+from hypothesis import strategies as st
+
+from collect.calculator.calculator import Calculator
+from collect.calculator.fee_applier import FeeApplier
+from collect.fee_source import FeeSource
+from utils import Chain
+
+
+FEE = 0.01
+STABLE, PEG_KEEPER = FeeSource._SourceType.STABLE_POOL, FeeSource._SourceType.PEG_KEEPER
+COINS = [f"0x{i:040x}" for i in range(1, 9)]
+
+
+class FixedFeeApplier(FeeApplier):
+    def get_profit(self, coin, amount=None):
+        return FEE if amount is None else amount * FEE
+
+
+class Source(FeeSource):
+    """Gain is set in `gains`, USD amounts of coins"""
+    gains = {}
+
+    def tally(self):
+        return dict(self.gains.get(self.address, {}))
+
+    def get_call(self):
+        return [(self.address, "withdraw_admin_fees")]
+
+
+class Mirror:
+    def __init__(self, killed=()):
+        self.killed = set(killed)
+
+    def sync(self):
+        pass
+
+    def filter_alive(self, coins, epoch):
+        return [coin for coin in coins if coin not in self.killed]
+
+
+def source(i, coins, gain, source_type=STABLE):
+    address = f"0x{0xa0 + i:040x}"
+    Source.gains[address] = dict(zip(coins, gain))
+    return Source(source_type, address, coins, {})
+
+
+def calculator(calculator_type, killed=(), **kwargs):
+    config = {
+        "chain": Chain.Gnosis, "PriceSourceType": "IdPriceSource", "FeeApplierType": "FixedFeeApplier",
+        calculator_type: {"gas_budget": 2_000_000, "gas_price": 1, "native_price": 1_000.,
+                          "threshold": 1., "max_n_sources": 3, **kwargs},
+    }
+    calculator = Calculator.get_from_type(calculator_type)(config)
+    calculator._fee_collector = Mirror(killed)
+    return calculator
+
+
+@pytest.fixture(autouse=True)
+def clean_gains():
+    Source.gains = {}
+
+
+def test_knapsack_takes_profitable_sources():
+    knapsack = calculator("KnapsackCalculator")
+    profitable = source(0, COINS[:1], [100_000.])  # 1000 USD fee
+    dust = source(1, COINS[1:2], [1.])  # 0.01 USD fee, ~0.2 USD gas
+    to_execute, calls = knapsack.calculate({profitable, dust})
+    assert to_execute == [profitable]
+    assert calls == [[(profitable.address, "withdraw_admin_fees")]]
+
+
+def test_knapsack_shared_coin_makes_source_profitable():
+    knapsack = calculator("KnapsackCalculator")
+    big = source(0, COINS[:2], [100_000., 100_000.])
+    # Alone it pays for its call and two coin transfers, ~0.27 USD gas: 0.2 USD fee is not enough
+    small = source(1, COINS[:2], [10., 10.])
+    assert knapsack.value(Source.gains[small.address]) < knapsack.gas_cost(knapsack._marginal_gas(small, set()))
+    assert knapsack.calculate({small})[0] == []
+    # Coins are collected anyway, only its own call is paid
+    assert set(knapsack.calculate({big, small})[0]) == {big, small}
+
+
+def test_knapsack_skips_killed_coins():
+    knapsack = calculator("KnapsackCalculator", killed=COINS[:1])
+    killed = source(0, COINS[:1], [100_000.])
+    partly = source(1, COINS[:2], [100_000., 100_000.])
+    assert knapsack.calculate({killed, partly})[0] == [partly]
+    assert knapsack.last_tallies == {partly: {COINS[1]: 100_000.}}
+
+
+@given(
+    sources=st.lists(st.tuples(
+        st.lists(st.sampled_from(COINS), min_size=1, max_size=3, unique=True),
+        st.floats(min_value=0., max_value=50_000.),
+        st.sampled_from([STABLE, PEG_KEEPER]),
+    ), min_size=1, max_size=12),
+    gas_budget=st.integers(min_value=100_000, max_value=3_000_000),
+)
+@settings(deadline=None)
+def test_knapsack_within_budget(sources, gas_budget):
+    Source.gains = {}
+    knapsack = calculator("KnapsackCalculator", gas_budget=gas_budget)
+    fee_sources = {source(i, coins, [amount] * len(coins), source_type)
+                   for i, (coins, amount, source_type) in enumerate(sources)}
+    to_execute, _ = knapsack.calculate(fee_sources)
+
+    assert len(set(to_execute)) == len(to_execute)
+    coins = set(coin for fee_source in to_execute for coin in fee_source.coins)
+    gas = knapsack._exact_gas(sum(knapsack.estimate_gas(fee_source) for fee_source in to_execute),
+                              len([fee_source for fee_source in to_execute if fee_source.source_type == STABLE]),
+                              len(coins))
+    assert not to_execute or gas <= gas_budget
+    assert all(knapsack.value(Source.gains[fee_source.address]) > 0 for fee_source in to_execute)
+
+
+@given(
+    gains=st.lists(st.dictionaries(st.sampled_from(COINS), st.floats(min_value=0., max_value=1e6), max_size=4),
+                   min_size=0, max_size=30),
+    max_n_sources=st.integers(min_value=1, max_value=10),
+)
+@settings(deadline=None)
+def test_vectorized_same_as_per_source(gains, max_n_sources):
+    Source.gains = {}
+    vectorized = calculator("VectorizedCalculator", threshold=100., max_n_sources=max_n_sources)
+    fee_sources = {source(i, list(gain), list(gain.values())) for i, gain in enumerate(gains)}
+
+    sources, masses = vectorized.masses(fee_sources)
+    assert set(sources) == set(fee_source for fee_source in fee_sources if fee_source.coins)
+    for fee_source, mass in zip(sources, masses):
+        assert mass == pytest.approx(vectorized.value(Source.gains[fee_source.address]))
+
+    def value(fee_source):
+        return vectorized.value(Source.gains[fee_source.address])
+
+    to_execute, calls = vectorized.calculate(fee_sources)
+    expected = sorted([fee_source for fee_source in sources if value(fee_source) >= 100.], key=lambda s: -value(s))
+    assert [value(fee_source) for fee_source in to_execute] ==\
+        pytest.approx([value(fee_source) for fee_source in expected[:max_n_sources]])
+    assert calls == [fee_source.get_call() for fee_source in to_execute]
+
+
+def test_vectorized_no_sources():
+    vectorized = calculator("VectorizedCalculator")
+    assert vectorized.calculate(set()) == ([], [])
@@ -0,0 +1,74 @@
+import pytest
+import requests
+
+import pool_data
+from data.curve_api import CurveAPIData
+from utils import Chain
+
+
+URL = "https://api.curve.fi/api/getPools/ethereum/main"
+POOL = "0xEcd5e75AFb02eFa118AF914515D6521aaBd189F1"
+
+
+class Response:
+    def __init__(self, status_code, pools=None):
+        self.status_code = status_code
+        self.pools = pools
+        self.headers = {"ETag": f'"{status_code}"'}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Server Error")
+
+    def json(self):
+        return {"data": {"poolData": self.pools}}
+
+
+class Session:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.headers = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.headers.append(headers)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@pytest.fixture(autouse=True)
+def clean_cache(monkeypatch):
+    monkeypatch.setattr(pool_data, "_responses", {})
+    monkeypatch.setattr(pool_data, "_fetched_at", {})
+    monkeypatch.setattr(CurveAPIData, "_cycles", {})
+
+
+def test_get_pool_data(monkeypatch):
+    pools = [{"address": POOL}]
+    session = Session(Response(500), Response(200, pools), Response(304), Response(502),
+                      requests.ConnectionError("timeout"), Response(200, []))
+    monkeypatch.setattr(pool_data, "session", session)
+
+    assert pool_data.get_pool_data(URL, force=True) == []  # nothing cached yet
+    assert pool_data.get_pool_data(URL, force=True) == pools
+    assert pool_data.get_pool_data(URL) == pools  # within refresh cycle
+    assert pool_data.get_pool_data(URL, force=True) == pools  # not modified
+    assert session.headers[-1] == {"If-None-Match": '"200"'}
+    assert pool_data.get_pool_data(URL, force=True) == pools  # error, cached
+    assert pool_data.get_pool_data(URL, force=True) == pools
+    assert pool_data.get_pool_data(URL, force=True) == []
+    assert session.responses == []
+
+
+def test_registry_updates_do_not_change_loaded_pools(monkeypatch):
+    monkeypatch.setattr(CurveAPIData, "_CURVE_API", {
+        **CurveAPIData._CURVE_API, "types": {"stable": ["main"], "crypto": [], "stablecoin": []},
+    })
+    monkeypatch.setattr(pool_data, "session", Session(Response(200, [{"address": POOL, "name": "TUSD"}]), Response(304)))
+
+    pool_datas = CurveAPIData().iterate_over_all_pool_data(Chain.Ethereum, force=True)
+    assert pool_datas == [("stable", {"address": POOL, "name": "TUSD", "type": "stable"})]
+    assert pool_data._responses[URL][2] == [{"address": POOL, "name": "TUSD"}]
+
+    assert CurveAPIData().iterate_over_all_pool_data(Chain.Ethereum, force=True) == pool_datas
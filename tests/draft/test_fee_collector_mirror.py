@@ -0,0 +1,103 @@
+import types
+
+import pytest
+from eth_abi import encode
+from hexbytes import HexBytes
+from web3 import Web3
+
+from collect.calculator.fee_applier import OfflineFeeApplier
+from data.fee_collector import FeeCollectorMirror
+from utils import Cached, Chain, EPOCH, JSONCacheStore
+
+
+COLLECT, FORWARD = 1 << EPOCH.COLLECT.value, 1 << EPOCH.FORWARD.value
+CRV = "0xd533a949740bb3306d119cc777fa900ba034cd52"
+USDT = "0xdac17f958d2ee523a2206206994597c13d831ec7"
+BURNER = "0x0000000000000000000000000000000000000b0b"
+
+
+def topic(signature):
+    return HexBytes(Web3.keccak(text=signature))
+
+
+def address_topic(address):
+    return HexBytes(bytes(12) + bytes.fromhex(address[2:]))
+
+
+class Eth:
+    """Returns `logs` within requested block range"""
+
+    def __init__(self, block_number, logs=()):
+        self.block_number = block_number
+        self.logs = list(logs)
+        self.requests = []
+
+    def get_logs(self, params):
+        self.requests.append((params["fromBlock"], params["toBlock"]))
+        return [log for log in self.logs if params["fromBlock"] <= log["blockNumber"] <= params["toBlock"]]
+
+
+def log(mirror, block_number, index, topics, data=b""):
+    return {"address": mirror.contract.address, "blockNumber": block_number, "logIndex": index, "topics": topics,
+            "data": HexBytes(data), "transactionHash": HexBytes(bytes(32)), "transactionIndex": 0,
+            "blockHash": HexBytes(bytes(32))}
+
+
+@pytest.fixture
+def mirror(tmp_path, monkeypatch):
+    monkeypatch.setattr(Cached, "_DIR", str(tmp_path))
+    monkeypatch.setattr(Cached, "_store", JSONCacheStore())
+    monkeypatch.setattr(FeeCollectorMirror, "_instances", {})
+    mirror = FeeCollectorMirror.from_config({"chain": Chain.Ethereum})
+    mirror.web3 = types.SimpleNamespace(eth=Eth(100), codec=mirror.web3.codec)
+    calls = []
+
+    def multicall(fn_calls, block_identifier):
+        calls.append((fn_calls, block_identifier))
+        values = {"target": "0x" + "11" * 20, "burner": BURNER, "hooker": "0x" + "22" * 20}
+        return [values.get(fn_name, 10 ** 16 * (fn_name == "max_fee")) for fn_name, _ in fn_calls]
+    mirror._multicall = multicall
+    mirror.calls = calls
+    return mirror
+
+
+def test_log_replay(mirror):
+    mirror.sync()
+    assert mirror.block == 100 and len(mirror.calls) == 1
+    assert mirror.max_fee == {1: 10 ** 16, 2: 10 ** 16, 4: 10 ** 16, 8: 10 ** 16}
+
+    mirror.web3.eth.block_number = 20_500
+    mirror.web3.eth.logs = [  # out of order, applied by (block, index)
+        log(mirror, 20_000, 1, [topic("SetMaxFee(uint256,uint256)"), HexBytes(encode(["uint256"], [COLLECT]))],
+            encode(["uint256"], [3 * 10 ** 16])),
+        log(mirror, 150, 0, [topic("SetMaxFee(uint256,uint256)"), HexBytes(encode(["uint256"], [COLLECT]))],
+            encode(["uint256"], [2 * 10 ** 16])),
+        log(mirror, 150, 1, [topic("SetKilled(address,uint256)"), address_topic(CRV)], encode(["uint256"], [COLLECT])),
+        log(mirror, 20_000, 0, [topic("SetBurner(address)"), address_topic("0x" + "33" * 20)]),
+        log(mirror, 20_000, 2, [topic("Transfer(address,address,uint256)")]),  # unknown event
+    ]
+    mirror.sync()
+
+    assert mirror.web3.eth.requests == [(101, 10_100), (10_101, 20_100), (20_101, 20_500)]
+    assert mirror.max_fee[COLLECT] == 3 * 10 ** 16 and mirror.max_fee[FORWARD] == 10 ** 16
+    assert mirror.burner == "0x" + "33" * 20
+    assert mirror.block == 20_500 and len(mirror.calls) == 1  # no reads besides logs
+
+    assert mirror.filter_alive([Web3.to_checksum_address(CRV), USDT], COLLECT) == [USDT]
+    assert mirror.filter_alive([CRV], FORWARD) == [CRV]
+
+    FeeCollectorMirror._instances = {}
+    restored = FeeCollectorMirror.from_config({"chain": Chain.Ethereum})
+    assert (restored.block, restored.max_fee, restored.burner) == (mirror.block, mirror.max_fee, mirror.burner)
+    assert restored.killed(CRV, COLLECT)
+
+
+def test_fee_applier_syncs_mirror(mirror, monkeypatch):
+    monkeypatch.setattr(EPOCH, "get_epoch_time_elapsed", staticmethod(lambda: 3600))
+    fee_applier = OfflineFeeApplier({"chain": Chain.Ethereum})
+    assert fee_applier.fee_collector is mirror and mirror.block is None
+
+    assert fee_applier.get_profit(CRV, 24 * 10 ** 18) == 10 ** 16
+    assert mirror.block == 100 and len(mirror.calls) == 1
+    fee_applier.get_profit(CRV)
+    assert len(mirror.calls) == 1  # synced once
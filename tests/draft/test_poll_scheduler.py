@@ -0,0 +1,94 @@
+import pytest
+
+from collect.fee_source import FeeSource
+from collect.poll_scheduler import AdaptivePollScheduler
+from utils import Cached, Chain, JSONCacheStore
+
+
+class Source:
+    def __init__(self, address):
+        self.source_type = FeeSource._SourceType.STABLE_POOL
+        self.address = address
+
+
+@pytest.fixture
+def cache_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(Cached, "_DIR", str(tmp_path))
+    store = JSONCacheStore()
+    monkeypatch.setattr(Cached, "_store", store)
+    return store
+
+
+def scheduler(**kwargs):
+    return AdaptivePollScheduler({
+        "chain": Chain.Gnosis,
+        "AdaptivePollScheduler": {"threshold": 10., "max_interval": 16, "alpha": 0.5, "safety": 1., **kwargs},
+    })
+
+
+def test_idle_source_backs_off(cache_store):
+    poll_scheduler = scheduler()
+    source = Source("0x01")
+
+    polled = []
+    for block in range(100, 200):
+        if poll_scheduler.due({source}, block):
+            polled.append(block)
+            poll_scheduler.observe({source: 1.}, block)
+    assert polled[:5] == [100, 102, 106, 114, 130]
+    assert all(b - a == 16 for a, b in zip(polled[4:], polled[5:]))  # max_interval
+
+
+def test_growing_source_is_due_before_threshold(cache_store):
+    poll_scheduler = scheduler()
+    source = Source("0x01")
+
+    polled = []
+    for block in range(100, 130):
+        if poll_scheduler.due({source}, block):
+            polled.append(block)
+            poll_scheduler.observe({source: 0.5 * (block - 100)}, block)  # crosses 10 at block 120
+    assert polled[:2] == [100, 102]
+    assert polled[2] <= 120 and len(polled) < 15  # skips blocks while far from threshold
+    assert polled[-9:] == list(range(121, 130))  # above threshold, every block
+
+
+def test_not_tallied_keeps_baseline(cache_store):
+    poll_scheduler = scheduler()
+    source = Source("0x01")
+    key = poll_scheduler._key(source)
+
+    poll_scheduler.due({source}, 100)
+    poll_scheduler.observe({source: 5.}, 100)
+    poll_scheduler.due({source}, 101)
+    poll_scheduler.observe({source: 6.}, 101)
+    rate = poll_scheduler.state[key]["rate"]
+    next_block = poll_scheduler.state[key]["next"]
+
+    assert poll_scheduler.due({source}, next_block) == {source}
+    poll_scheduler.observe({}, next_block)  # tally failed
+    entry = poll_scheduler.state[key]
+    assert (entry["block"], entry["value"], entry["rate"]) == (101, 6., rate)
+    assert entry["next"] > next_block  # retried later
+    assert poll_scheduler.due({source}, entry["next"]) == {source}
+
+    unseen = Source("0x02")
+    assert poll_scheduler.due({unseen}, 200) == {unseen}
+    poll_scheduler.observe({}, 200)
+    assert poll_scheduler.due({unseen}, 201) == {unseen}  # still due
+
+
+def test_state_is_saved_every_interval(cache_store):
+    poll_scheduler = scheduler(save_interval=10)
+    sources = {Source(f"0x{i:02x}") for i in range(3)}
+    saves = []
+    save = cache_store.save
+    cache_store.save = lambda name, state: saves.append(name) or save(name, state)
+
+    for block in range(100, 125):
+        poll_scheduler.observe({source: 1. for source in poll_scheduler.due(sources, block)}, block)
+    assert len(saves) == 3  # 100, 110, 120
+
+    restored = scheduler()
+    assert restored.state.keys() == poll_scheduler.state.keys()
+    assert all(entry["block"] <= 120 for entry in restored.state.values())  # as of the last save
@@ -0,0 +1,82 @@
+import asyncio
+
+import boa
+import pytest
+
+from fee_keeper.balances import BalanceReader
+from .conftest import ETH_ADDRESS
+
+
+REVERTING_TOKEN = """
+# @version 0.3.10
+
+@external
+@view
+def balanceOf(_user: address) -> uint256:
+    raise "No balances"
+"""
+
+
+class BoaEth:
+    """Async `eth.call` of constructor code, like a node would run it without `to`"""
+
+    @staticmethod
+    async def call(tx, block_identifier):
+        with boa.env.anchor():
+            return boa.env.deploy_code(bytecode=bytes.fromhex(tx["data"][2:]))[1]
+
+
+class BoaWeb3:
+    eth = BoaEth
+
+
+@pytest.fixture(scope="module")
+def holders():
+    return [boa.env.generate_address() for _ in range(3)]
+
+
+@pytest.fixture(scope="module")
+def tokens(admin, erc20, erc20_no_return, holders):
+    with boa.env.prank(admin):
+        token = erc20.deploy("Curve DAO", "CRV", 18)
+        token_no_return = erc20_no_return.deploy("Chinese Yuan", "CNY", 2)
+        reverting = boa.loads(REVERTING_TOKEN)
+    eoa = boa.env.generate_address()
+    return [token.address, token_no_return.address, reverting.address, eoa, ETH_ADDRESS], (token, token_no_return)
+
+
+@pytest.fixture(scope="module")
+def expected(tokens, holders):
+    addresses, (token, token_no_return) = tokens
+    balances = []
+    for i, holder in enumerate(holders):
+        amounts = [10 ** 18 * (i + 1), 2 ** 200 + i, 0, 0, 10 ** 20 + i]
+        token._mint_for_testing(holder, amounts[0])
+        token_no_return._mint_for_testing(holder, amounts[1])
+        boa.env.set_balance(holder, amounts[4])
+        balances.append(amounts)
+    return balances
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4, 1000])
+def test_read_pairs(tokens, holders, expected, chunk_size):
+    addresses, _ = tokens
+    pairs = [(holder, token) for holder in holders for token in addresses]
+    balances = asyncio.run(BalanceReader(chunk_size).read_pairs(BoaWeb3, pairs))
+    assert balances == [amount for row in expected for amount in row]
+
+
+def test_read_matrix(tokens, holders, expected):
+    addresses, _ = tokens
+    limbs = asyncio.run(BalanceReader(chunk_size=4).read_matrix(BoaWeb3, holders, addresses))
+    assert limbs.shape == (len(holders), len(addresses), 4)
+    for row, expected_row in zip(limbs.tolist(), expected):
+        assert [sum(limb << (64 * (3 - i)) for i, limb in enumerate(balance)) for balance in row] == expected_row
+
+    balances = BalanceReader.to_float(limbs)
+    assert balances.shape == (len(holders), len(addresses))
+    assert balances.flatten().tolist() == pytest.approx([amount for row in expected for amount in row], rel=1e-15)
+
+
+def test_empty(tokens):
+    assert asyncio.run(BalanceReader().read_pairs(BoaWeb3, [])) == []
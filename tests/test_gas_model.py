@@ -0,0 +1,116 @@
+import random
+
+import pytest
+from hypothesis import given, settings
+from hypothesis import strategies as st
+
+from fee_keeper.gas_model import GasModel
+
+
+BASE = 60_000
+COSTS = {f"0x{i:040x}": 20_000 + 7_000 * (i % 5) for i in range(1, 13)}
+
+
+def gas_used(items):
+    return BASE + sum(COSTS[item] for item in items)
+
+
+@pytest.fixture
+def model(tmp_path):
+    return GasModel(str(tmp_path / "gas_model.json"))
+
+
+def train(model, n=300, seed=0):
+    rng = random.Random(seed)
+    for _ in range(n):
+        items = rng.sample(sorted(COSTS), rng.randint(1, 6))
+        model.observe("COLLECT", items, gas_used(items), save=False)
+
+
+def test_learns_item_costs_from_batches(model):
+    assert model.predict("COLLECT", ["0x01"]) == (0, False)
+    train(model)
+
+    for items in [sorted(COSTS)[:1], sorted(COSTS)[3:9], sorted(COSTS)]:
+        gas, certain = model.predict("COLLECT", items)
+        assert certain
+        assert gas == pytest.approx(gas_used(items), rel=0.02)
+    assert model.ops["COLLECT"]["error"] <= model.max_error
+
+
+def test_unknown_item_is_not_certain(model):
+    train(model)
+    unknown = "0x" + "ff" * 20
+    gas, certain = model.predict("COLLECT", [sorted(COSTS)[0], unknown])
+    assert not certain
+    average = sum(COSTS.values()) / len(COSTS)
+    assert gas == pytest.approx(BASE + COSTS[sorted(COSTS)[0]] + average, rel=0.05)
+
+
+def test_persisted(model):
+    train(model, n=50)
+    model.save()
+    assert GasModel(model.path).ops == model.ops
+
+
+def test_gas_limits_estimate_only_uncertain(model):
+    train(model)
+    items = sorted(COSTS)[:3]
+    unknown = ["0x" + "ff" * 20]
+    estimates = []
+
+    class Eth:
+        @staticmethod
+        def estimate_gas(tx):
+            estimates.append(tx)
+            return 500_000
+
+    class Web3:
+        eth = Eth
+
+    txs = [{"to": "0x01", "gas": 1}, {"to": "0x02", "gas": 1}]
+    limits = model.gas_limits(Web3, txs, [("COLLECT", items), ("COLLECT", unknown)], margin=1.1)
+    assert limits[0] == pytest.approx(1.1 * gas_used(items), rel=0.02)
+    assert limits[1] == int(1.1 * 500_000)
+    assert estimates == [{"to": "0x02"}]
+
+
+def learned(costs, base=BASE, n=5):
+    model = GasModel("/nonexistent/gas_model.json")
+    model.ops["COLLECT"] = {"base": base, "n": n, "error": 0., "items": {item: [cost, n] for item, cost in costs.items()}}
+    return model
+
+
+@given(
+    costs=st.lists(st.integers(min_value=1_000, max_value=1_000_000), min_size=1, max_size=80),
+    max_len=st.integers(min_value=1, max_value=64),
+    max_gas=st.integers(min_value=BASE + 1_000_000, max_value=10_000_000),
+)
+@settings(deadline=None)
+def test_pack(costs, max_len, max_gas):
+    costs = {f"0x{i + 1:040x}": cost for i, cost in enumerate(costs)}
+    model = learned(costs)
+    chunks = model.pack("COLLECT", list(reversed(costs)), max_gas, max_len)
+
+    assert sorted(item for chunk in chunks for item in chunk) == sorted(costs)
+    for chunk in chunks:
+        assert 0 < len(chunk) <= max_len
+        assert chunk == sorted(chunk, key=lambda item: int(item, 16))  # FeeCollector.collect needs sorted coins
+        assert model.predict("COLLECT", chunk)[0] <= max_gas
+    assert [chunk[0] for chunk in chunks] == sorted((chunk[0] for chunk in chunks), key=lambda item: int(item, 16))
+    lower_bound = max(-(-len(costs) // max_len), -(-sum(costs.values()) // (max_gas - BASE)))
+    assert len(chunks) >= lower_bound
+
+
+def test_pack_balances_expensive_items():
+    model = learned({"0x01": 900_000, "0x02": 800_000, "0x03": 100_000, "0x04": 100_000})
+    chunks = model.pack("COLLECT", ["0x01", "0x02", "0x03", "0x04"], max_gas=1_200_000, max_len=20)
+    assert chunks == [["0x01", "0x04"], ["0x02", "0x03"]]
+
+
+def test_pack_default_gas():
+    model = GasModel("/nonexistent/gas_model.json")
+    items = [f"0x{i:02x}" for i in range(1, 11)]
+    chunks = model.pack("COLLECT", items, max_gas=350_000, max_len=64, default_gas=100_000)
+    assert [len(chunk) for chunk in chunks] == [3, 3, 2, 2]  # 3 chunks of 100_000 gas items don't fit
+    assert model.pack("COLLECT", [], max_gas=350_000, max_len=64) == []
@@ -0,0 +1,135 @@
+import boa
+import pytest
+
+from hypothesis import given, settings
+from hypothesis import strategies as st
+
+from fee_keeper.model import START_TIME, FeeCollectorModel, DutchAuctionBurnerModel, HookerModel, wad_exp
+from .conftest import ZERO_ADDRESS, Epoch, WEEK
+
+
+def assert_same(contract_call, model_call):
+    try:
+        expected = model_call()
+    except ValueError:
+        with boa.reverts():
+            contract_call()
+        return
+    assert contract_call() == expected
+
+
+timestamps = st.integers(min_value=START_TIME, max_value=START_TIME + 1000 * WEEK)
+
+
+@given(
+    epoch=st.sampled_from([0] + list(Epoch)),
+    ts=timestamps,
+    max_fee=st.integers(min_value=0, max_value=10 ** 18),
+)
+@settings(deadline=None)
+def test_fee_collector(fee_collector, admin, epoch, ts, max_fee):
+    with boa.env.anchor():
+        if epoch:
+            with boa.env.prank(admin):
+                fee_collector.set_max_fee(epoch, max_fee)
+        model = FeeCollectorModel({int(e): fee_collector.max_fee(e) for e in Epoch})
+
+        assert fee_collector.epoch(ts) == model.epoch(ts)
+        for e in Epoch:
+            assert fee_collector.epoch_time_frame(e, ts) == model.epoch_time_frame(e, ts)
+        assert_same(lambda: fee_collector.fee(epoch, ts), lambda: model.fee(epoch, ts))
+
+
+@pytest.fixture(scope="module")
+def dutch_auction_burner(admin, fee_collector):
+    with boa.env.prank(admin):
+        return boa.load("contracts/burners/DutchAuctionBurner.vy",
+                        fee_collector, 10 * 10 ** 18, 10_000, [], 10 ** 18 // 2)
+
+
+@given(x=st.integers(min_value=-42 * 10 ** 18, max_value=136 * 10 ** 18))
+@settings(deadline=None)
+def test_wad_exp(dutch_auction_burner, x):
+    assert_same(lambda: dutch_auction_burner.internal._wad_exp(x), lambda: wad_exp(x))
+
+
+amounts = st.integers(min_value=0, max_value=10 ** 30)
+
+
+@given(
+    balance=amounts,
+    record=st.tuples(st.tuples(amounts, amounts), st.tuples(amounts, amounts), st.integers(min_value=-6, max_value=1)),
+    ts=timestamps,
+    smoothing=st.integers(min_value=0, max_value=10 ** 18),
+    target_threshold=amounts,
+    max_price_amplifier=st.integers(min_value=0, max_value=10 ** 18),
+)
+@settings(deadline=None)
+def test_dutch_auction_price(dutch_auction_burner, fee_collector, coins, admin,
+                             balance, record, ts, smoothing, target_threshold, max_price_amplifier):
+    coin = coins[0]
+    record = (record[0], record[1], ts // WEEK + record[2])
+    with boa.env.anchor():
+        coin._mint_for_testing(fee_collector, balance)
+        balance = coin.balanceOf(fee_collector)
+        with boa.env.prank(admin):
+            dutch_auction_burner.set_records([(coin, record)])
+            dutch_auction_burner.set_records_smoothing(smoothing)
+            dutch_auction_burner.set_price_parameters(target_threshold, max_price_amplifier)
+
+        model = DutchAuctionBurnerModel(
+            target_threshold, max_price_amplifier, smoothing, {coin.address: record},
+            dutch_auction_burner.base(), dutch_auction_burner.ln_base(),
+        )
+        assert_same(lambda: dutch_auction_burner.price(coin, ts), lambda: model.price(coin.address, balance, ts))
+
+
+def test_dutch_auction_prices(dutch_auction_burner, fee_collector, coins):
+    start, end = fee_collector.epoch_time_frame(Epoch.EXCHANGE)
+    with boa.env.anchor():
+        for coin in coins:
+            coin._mint_for_testing(fee_collector, 10 ** 18)
+        balances = [coin.balanceOf(fee_collector) for coin in coins]
+        model = DutchAuctionBurnerModel(
+            dutch_auction_burner.target_threshold(), dutch_auction_burner.max_price_amplifier(),
+            dutch_auction_burner.records_smoothing(),
+            {coin.address: dutch_auction_burner.records(coin) for coin in coins},
+        )
+        timestamps = range(start, end, (end - start) // 20)
+        prices = model.prices([coin.address for coin in coins], balances, timestamps)
+        for ts, ts_prices in zip(timestamps, prices):
+            assert [dutch_auction_burner.price(coin, ts) for coin in coins] == ts_prices
+
+
+strategies = st.tuples(
+    st.integers(min_value=0, max_value=10 ** 24),  # amount
+    st.tuples(
+        st.integers(min_value=START_TIME // WEEK, max_value=START_TIME // WEEK + 1100),  # duty_counter
+        st.integers(min_value=0, max_value=3),  # used
+        st.integers(min_value=0, max_value=3),  # limit
+    ),
+    st.integers(min_value=0, max_value=WEEK - 1),  # start
+    st.integers(min_value=0, max_value=WEEK - 1),  # end
+    st.booleans(),  # dutch
+)
+
+
+@given(
+    hooks=st.lists(st.tuples(strategies, st.booleans()), min_size=1, max_size=8),
+    hook_ids=st.lists(st.integers(min_value=0, max_value=7), max_size=8),
+    duty=st.booleans(),
+    ts=timestamps,
+)
+@settings(deadline=None)
+def test_hooker_compensation(hooker, admin, hooks, hook_ids, duty, ts):
+    hooks = [(ZERO_ADDRESS, b"", strategy, is_duty) for strategy, is_duty in hooks]
+    hook_inputs = [(hook_id % len(hooks), 0, b"") for hook_id in sorted(hook_ids)]
+    with boa.env.anchor():
+        with boa.env.prank(admin):
+            hooker.set_hooks(hooks)
+
+        model = HookerModel.from_hooks(hooks, hooker.duty_counter())
+        assert_same(
+            lambda: hooker.calc_compensation(hook_inputs, duty, ts),
+            lambda: model.calc_compensation([hook_id for hook_id, _, _ in hook_inputs], duty, ts),
+        )
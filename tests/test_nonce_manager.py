@@ -0,0 +1,119 @@
+import asyncio
+import types
+
+import pytest
+from web3.exceptions import TransactionNotFound
+
+from fee_keeper.draft.nonce_manager import NonceManager
+
+
+SENDER = "0x71F718D3e4d1449D1502A6A7595eb84eBcCB1683"
+TARGET = "0x4DEcE678ceceb27446b35C672dC7d61F30bAD69E"
+FEES = {"maxFeePerGas": 10, "maxPriorityFeePerGas": 1}
+
+
+class Signed:
+    def __init__(self, tx):
+        self.rawTransaction = tx
+        self.hash = repr(sorted(tx.items())).encode()
+
+
+class Chain:
+    """Mines pending txs in nonce order, rejects txs with "revert" data and ones priced under `base_fee`"""
+
+    def __init__(self, nonce=5, base_fee=0):
+        self.nonce = nonce
+        self.base_fee = base_fee
+        self.chain_id = 1
+        self.pool, self.receipts, self.sent = {}, {}, []
+        self.account = types.SimpleNamespace(from_key=lambda key: types.SimpleNamespace(
+            address=SENDER, sign_transaction=Signed,
+        ))
+
+    def get_transaction_count(self, address, block_identifier="latest"):
+        return self.nonce + (len(self.pool) if block_identifier == "pending" else 0)
+
+    def send_raw_transaction(self, tx):
+        self.sent.append(tx)
+        if tx["nonce"] < self.nonce:
+            raise ValueError("nonce too low")
+        if tx.get("data") == "revert":
+            raise ValueError("execution reverted")
+        if tx["maxFeePerGas"] < self.base_fee:
+            raise ValueError("max fee per gas less than block base fee")
+        self.pool[Signed(tx).hash] = tx
+
+    def get_transaction(self, tx_hash):
+        if tx_hash not in self.pool and tx_hash not in self.receipts:
+            raise TransactionNotFound(tx_hash)
+        return {}
+
+    def get_transaction_receipt(self, tx_hash):
+        if tx_hash not in self.receipts:
+            raise TransactionNotFound(tx_hash)
+        return self.receipts[tx_hash]
+
+    def mine(self):
+        while txs := [(h, tx) for h, tx in self.pool.items() if tx["nonce"] == self.nonce]:
+            tx_hash, tx = txs[-1]
+            self.receipts[tx_hash] = {"status": 1, "gasUsed": tx["gas"], "to": tx["to"], "nonce": tx["nonce"]}
+            self.nonce += 1
+            self.pool = {h: tx for h, tx in self.pool.items() if tx["nonce"] >= self.nonce}
+
+
+def send_all(chain, txs, **kwargs):
+    nonce_manager = NonceManager(types.SimpleNamespace(eth=chain), "0x01", lambda: FEES, poll_interval=0.01, **kwargs)
+
+    async def run():
+        async def miner():
+            while True:
+                await asyncio.sleep(0.02)
+                chain.mine()
+        task = asyncio.ensure_future(miner())
+        try:
+            return await asyncio.wait_for(nonce_manager.send_all(txs), 10)
+        finally:
+            task.cancel()
+    return asyncio.run(run())
+
+
+def test_back_to_back():
+    chain = Chain()
+    receipts = send_all(chain, [{"to": TARGET, "data": f"0x0{i}", "gas": 100_000 + i} for i in range(3)])
+    assert [receipt["nonce"] for receipt in receipts] == [5, 6, 7]
+    assert [receipt["gasUsed"] for receipt in receipts] == [100_000, 100_001, 100_002]
+    assert [tx["maxFeePerGas"] for tx in chain.sent] == [FEES["maxFeePerGas"]] * 3
+
+
+def test_rejected_nonce_is_filled():
+    chain = Chain()
+    txs = [{"to": TARGET, "data": "0x01", "gas": 500_000}, {"to": TARGET, "data": "revert", "gas": 500_000},
+           {"to": TARGET, "data": "0x03", "gas": 500_000}]
+    receipts = send_all(chain, txs)
+
+    assert receipts[0]["nonce"] == 5 and receipts[2]["nonce"] == 7
+    assert receipts[1] is None  # filler's receipt is not the one of the rejected tx
+    filler = next(receipt for receipt in chain.receipts.values() if receipt["nonce"] == 6)
+    assert filler["to"] == SENDER and filler["gasUsed"] == 21_000
+    assert chain.nonce == 8
+
+
+def test_underpriced_filler_is_bumped():
+    chain = Chain(base_fee=12)
+    txs = [{"to": TARGET, "data": "revert", "gas": 500_000},
+           {"to": TARGET, "data": "0x02", "gas": 500_000, "maxFeePerGas": 20, "maxPriorityFeePerGas": 2}]
+    receipts = send_all(chain, txs)
+
+    assert receipts[0] is None
+    assert receipts[1]["nonce"] == 6
+    fillers = [tx for tx in chain.sent if tx["to"] == SENDER]
+    assert fillers[0]["maxFeePerGas"] < 12 <= fillers[-1]["maxFeePerGas"]
+
+
+@pytest.mark.parametrize("max_bumps", [0, 1])
+def test_filler_gives_up(max_bumps):
+    chain = Chain(base_fee=100)
+    receipts = send_all(chain, [{"to": TARGET, "data": "revert", "gas": 500_000}], max_bumps=max_bumps)
+
+    assert receipts == [None]
+    assert len([tx for tx in chain.sent if tx["to"] == SENDER]) == max_bumps + 1
@@ -0,0 +1,195 @@
+import asyncio
+
+import pytest
+from web3 import AsyncHTTPProvider
+
+from fee_keeper.rpc import BatchingAsyncHTTPProvider, BlockCache
+
+
+TOKEN = "0x4DEcE678ceceb27446b35C672dC7d61F30bAD69E"
+CALL = {"to": TOKEN, "data": "0x18160ddd"}
+
+
+class Node:
+    def __init__(self, head=100):
+        self.head = head
+        self.requests = []
+
+    def make_request(self, method, params):
+        self.requests.append((method, params))
+        if method == "eth_blockNumber":
+            return {"result": hex(self.head)}
+        return {"result": f"{method}@{params[-1]}"}
+
+    async def async_make_request(self, method, params):
+        await asyncio.sleep(0.01)
+        return self.make_request(method, params)
+
+    def count(self, method):
+        return len([request for request in self.requests if request[0] == method])
+
+
+@pytest.fixture
+def node():
+    return Node()
+
+
+def test_latest_is_pinned_and_cached(node):
+    cache = BlockCache()
+    request = cache.middleware(node.make_request, None)
+
+    assert request("eth_call", [CALL, "latest"]) == {"result": "eth_call@0x64"}
+    assert request("eth_call", [CALL]) == {"result": "eth_call@0x64"}
+    assert node.requests == [("eth_blockNumber", []), ("eth_call", [CALL, "0x64"])]
+    assert (cache.hits, cache.misses, cache.head_requests) == (1, 1, 1)
+
+    node.head = 101
+    cache.set_head(101)
+    assert request("eth_call", [CALL]) == {"result": "eth_call@0x65"}
+    assert cache.evictions == 1
+
+
+def test_explicit_block_does_not_ask_head(node):
+    cache = BlockCache(head_ttl=0.)
+    request = cache.middleware(node.make_request, None)
+
+    for _ in range(3):
+        request("eth_call", [CALL, "0x10"])
+        request("eth_getBalance", [TOKEN, 16])
+        request("eth_call", [CALL, "pending"])
+    assert node.count("eth_blockNumber") == 0
+    assert node.count("eth_call") == 4  # pending is not cached
+    assert cache.hits == 4
+
+
+def test_pushed_head_is_preferred(node):
+    cache = BlockCache(head_ttl=0.)
+    request = cache.middleware(node.make_request, None)
+
+    cache.set_head(90, pushed=True)
+    for _ in range(3):
+        assert request("eth_call", [CALL]) == {"result": "eth_call@0x5a"}
+    assert node.count("eth_blockNumber") == 0
+
+    cache.pushed_ts = 0.  # pushes stopped coming
+    assert request("eth_call", [CALL]) == {"result": "eth_call@0x64"}
+    assert node.count("eth_blockNumber") == 1
+
+
+def test_concurrent_reads_share_head_request(node):
+    cache = BlockCache()
+    request = asyncio.run(cache.async_middleware(node.async_make_request, None))
+
+    async def run():
+        return await asyncio.gather(*[request("eth_call", [{**CALL, "data": hex(i)}]) for i in range(20)])
+    responses = asyncio.run(run())
+
+    assert responses == [{"result": "eth_call@0x64"}] * 20
+    assert node.count("eth_blockNumber") == 1
+    assert cache.head_requests == 1
+
+
+def test_response_of_old_head_is_not_cached(node):
+    cache = BlockCache()
+    cache.set_head(100)
+
+    def make_request(method, params):
+        cache.set_head(101)  # new block while requesting
+        return node.make_request(method, params)
+    request = cache.middleware(make_request, None)
+
+    request("eth_call", [CALL])
+    request("eth_call", [CALL, "0x64"])
+    assert node.count("eth_call") == 2
+
+
+class BatchNode:
+    """JSON-RPC endpoint answering `eth_call` with its params, dropping ids in `drop`"""
+
+    def __init__(self, drop=(), delay=0.01):
+        self.drop = set(drop)
+        self.delay = delay
+        self.batches, self.singles = [], []
+
+    async def post_batch(self, requests):
+        self.batches.append(requests)
+        await asyncio.sleep(self.delay)
+        return [{"jsonrpc": "2.0", "id": request["id"], "result": request["params"][0]}
+                for request in requests if request["params"][0] not in self.drop]
+
+    async def make_request(self, provider, method, params):
+        self.singles.append(params)
+        await asyncio.sleep(self.delay)
+        return {"jsonrpc": "2.0", "result": params[0]}
+
+
+@pytest.fixture
+def batch_node(monkeypatch):
+    node = BatchNode()
+    monkeypatch.setattr(AsyncHTTPProvider, "make_request", node.make_request)
+    return node
+
+
+def batching_provider(node, **kwargs):
+    provider = BatchingAsyncHTTPProvider("http://localhost:8545", window=0.001, **kwargs)
+    provider._post_batch = node.post_batch
+    return provider
+
+
+def test_requests_are_batched(batch_node):
+    provider = batching_provider(batch_node, max_batch_size=4)
+
+    async def run():
+        return await asyncio.gather(*[provider.make_request("eth_call", [i, "latest"]) for i in range(10)])
+    responses = asyncio.run(run())
+
+    assert [response["result"] for response in responses] == list(range(10))
+    assert [len(batch) for batch in batch_node.batches] == [4, 4, 2]
+    assert batch_node.singles == [] and provider._tasks == set()
+
+
+def test_missing_responses_are_retried(batch_node):
+    batch_node.drop = {1, 3}
+    provider = batching_provider(batch_node)
+
+    async def run():
+        return await asyncio.gather(*[provider.make_request("eth_call", [i, "latest"]) for i in range(5)])
+    responses = asyncio.run(run())
+
+    assert [response["result"] for response in responses] == list(range(5))
+    assert batch_node.singles == [[1, "latest"], [3, "latest"]]
+
+
+def test_cancelled_caller_does_not_break_batch(batch_node):
+    batch_node.drop = {0}
+    provider = batching_provider(batch_node)
+
+    async def run():
+        tasks = [asyncio.ensure_future(provider.make_request("eth_call", [i, "latest"])) for i in range(4)]
+        await asyncio.sleep(0.005)  # batch in flight
+        tasks[0].cancel()  # retried one
+        tasks[1].cancel()  # answered one
+        return await asyncio.wait_for(asyncio.gather(*tasks[2:]), 1)
+    responses = asyncio.run(run())
+
+    assert [response["result"] for response in responses] == [2, 3]
+    assert batch_node.singles == []  # cancelled request is not retried
+
+
+def test_close(batch_node):
+    provider = batching_provider(batch_node)
+    closed = []
+
+    class Session:
+        async def close(self):
+            closed.append(True)
+
+    async def run():
+        request = asyncio.ensure_future(provider.make_request("eth_call", [0, "latest"]))
+        await asyncio.sleep(0.005)
+        provider._session = Session()
+        await provider.close()
+        assert request.done()
+    asyncio.run(run())
+
+    assert closed == [True] and provider._session is None
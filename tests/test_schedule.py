@@ -0,0 +1,46 @@
+from hypothesis import given, settings
+from hypothesis import strategies as st
+
+from fee_keeper.schedule import BreakEvenScheduler
+
+
+START, END = 1_700_000_000, 1_700_086_400
+BLOCK_TIME = 12
+MAX_SLEEP = 300
+
+
+@given(
+    amount=st.floats(min_value=1e-3, max_value=1e9),
+    gas_cost=st.floats(min_value=0., max_value=1e3),
+    max_fee=st.integers(min_value=1, max_value=10 ** 18),
+)
+@settings(deadline=None)
+def test_break_even_ts(amount, gas_cost, max_fee):
+    scheduler = BreakEvenScheduler(START, END, max_fee)
+    ts = scheduler.break_even_ts(amount, gas_cost)
+    if ts is None:
+        assert amount * scheduler.fee(END - 1) < gas_cost * (1 + 1e-9)
+        return
+    assert START <= ts < END
+    assert amount * scheduler.fee(ts) >= gas_cost * (1 - 1e-9)
+    if ts > START:
+        assert amount * scheduler.fee(ts - 1) <= gas_cost * (1 + 1e-9)
+    assert scheduler.is_due(amount, gas_cost, ts) and not scheduler.is_due(amount, gas_cost, ts - 1)
+
+
+def test_next_deadline():
+    ts = START + 1000
+    assert BreakEvenScheduler.next_deadline([], ts, MAX_SLEEP, BLOCK_TIME) == ts + MAX_SLEEP
+    assert BreakEvenScheduler.next_deadline([None, ts + 50, ts + 20], ts, MAX_SLEEP, BLOCK_TIME) == ts + 20
+    assert BreakEvenScheduler.next_deadline([ts + 1000], ts, MAX_SLEEP, BLOCK_TIME) == ts + MAX_SLEEP
+
+
+def test_next_deadline_retries_missed():
+    ts = START + 1000
+    deadlines = [ts - 100, ts, ts + 50]
+    # Collected: due ones are gone, wait for the next one
+    assert BreakEvenScheduler.next_deadline(deadlines, ts, MAX_SLEEP, BLOCK_TIME, done=True) == ts + 50
+    # Not collected: retry at the next block
+    assert BreakEvenScheduler.next_deadline(deadlines, ts, MAX_SLEEP, BLOCK_TIME, done=False) == ts + BLOCK_TIME
+    # Nothing was due
+    assert BreakEvenScheduler.next_deadline([None, ts + 50], ts, MAX_SLEEP, BLOCK_TIME, done=False) == ts + 50